@@ -1,24 +1,78 @@
 from sqladmin import Admin, ModelView
 from fastapi import FastAPI
-from .database import engine
+from .replicas import routing_session_maker, use_primary
 from .models import Office, Room, Booking, User  # Import your models
+from . import crud
 
-# Create views for your models
-class OfficeAdmin(ModelView, model=Office):
+# Lists and details may come from a replica; the edit form and every write
+# load their object from the primary
+class PrimaryWritesView(ModelView):
+    async def get_object_for_edit(self, request):
+        with use_primary():
+            return await super().get_object_for_edit(request)
+
+    async def get_object_for_delete(self, value):
+        with use_primary():
+            return await super().get_object_for_delete(value)
+
+    async def insert_model(self, request, data):
+        with use_primary():
+            return await super().insert_model(request, data)
+
+    async def update_model(self, request, pk, data):
+        with use_primary():
+            return await super().update_model(request, pk, data)
+
+    async def delete_model(self, request, pk):
+        with use_primary():
+            return await super().delete_model(request, pk)
+
+# Create views for your models. Their writes invalidate the same caches and
+# ETag versions as the API's (see crud.office_changed and friends)
+class OfficeAdmin(PrimaryWritesView, model=Office):
     column_list = [Office.id, Office.name, Office.location]
 
-class RoomAdmin(ModelView, model=Room):
+    async def after_model_change(self, data, model, is_created, request):
+        await crud.office_changed(model.id)
+
+    async def after_model_delete(self, model, request):
+        await crud.office_changed(model.id)
+
+class RoomAdmin(PrimaryWritesView, model=Room):
     column_list = [Room.id, Room.name, Room.capacity, Room.office_id]
 
-class BookingAdmin(ModelView, model=Booking):
+    async def after_model_change(self, data, model, is_created, request):
+        await crud.room_changed(model.id)
+
+    async def after_model_delete(self, model, request):
+        await crud.room_changed(model.id)
+
+class BookingAdmin(PrimaryWritesView, model=Booking):
     column_list = [Booking.id, Booking.room_id, Booking.user_id, Booking.start_time, Booking.end_time]
 
-class UserAdmin(ModelView, model=User):
+    # Called before the form data is set on the model: remember the old slot
+    async def on_model_change(self, data, model, is_created, request):
+        if not is_created:
+            request.state.previous_booking = (model.room_id, model.start_time, model.end_time)
+
+    async def after_model_change(self, data, model, is_created, request):
+        if is_created:
+            await crud.booking_changed("created", model.id, model)
+        else:
+            previous = request.state.previous_booking
+            await crud.booking_changed("updated", model.id, model, previous)
+
+    async def after_model_delete(self, model, request):
+        previous = (model.room_id, model.start_time, model.end_time)
+        await crud.booking_changed("deleted", model.id, previous=previous)
+
+class UserAdmin(PrimaryWritesView, model=User):
     column_list = [User.id, User.username]
 
 # Add Admin instance
 def init_admin(app: FastAPI):
-    admin = Admin(app, engine)
+    # List and detail views read from a replica when one is configured
+    admin = Admin(app, session_maker=routing_session_maker)
     admin.add_view(OfficeAdmin)
     admin.add_view(RoomAdmin)
     admin.add_view(BookingAdmin)
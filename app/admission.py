@@ -0,0 +1,94 @@
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Iterable
+
+from sqlalchemy import func, literal, select
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from . import settings
+
+# First key of the two-key advisory locks, so room ids cannot collide with
+# advisory locks taken for anything else
+ADVISORY_NAMESPACE = 4242
+
+
+# Booking writes for one room are serialized, writes for different rooms are
+# not. In-process that is a fixed set of asyncio locks picked by room id, so
+# memory stays flat however many rooms there are; two rooms only share a
+# lock when their ids are equal modulo the number of stripes.
+class RoomLocks:
+    def __init__(self, stripes: int):
+        self._locks = [asyncio.Lock() for _ in range(max(stripes, 1))]
+        self.acquired = 0
+        self.contended = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def busy(self, room_id: int) -> bool:
+        return self._locks[room_id % len(self._locks)].locked()
+
+    # Stripes are taken in index order, so requests touching several rooms
+    # cannot deadlock each other
+    @asynccontextmanager
+    async def hold(self, room_ids: Iterable[int]):
+        stripes = sorted({room_id % len(self._locks) for room_id in room_ids})
+        held = []
+        try:
+            for stripe in stripes:
+                lock = self._locks[stripe]
+                if lock.locked():
+                    self.contended += 1
+                    started = time.perf_counter()
+                    await lock.acquire()
+                    waited = time.perf_counter() - started
+                    self.wait_seconds_total += waited
+                    self.wait_seconds_max = max(self.wait_seconds_max, waited)
+                else:
+                    await lock.acquire()
+                held.append(lock)
+            self.acquired += 1
+            yield
+        finally:
+            for lock in reversed(held):
+                lock.release()
+
+    def stats(self) -> dict:
+        return {
+            "stripes": len(self._locks),
+            "acquired": self.acquired,
+            "contended": self.contended,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+room_locks = RoomLocks(settings.BOOKING_LOCK_STRIPES)
+
+
+# Across workers: a transaction-level advisory lock per room, released by the
+# commit or rollback that ends the write. Postgres only.
+async def lock_rooms(db: AsyncSession, room_ids: Iterable[int]):
+    if not settings.BOOKING_ADVISORY_LOCKS or db.bind.dialect.name != "postgresql":
+        return
+    for room_id in sorted(set(room_ids)):
+        await db.execute(
+            select(func.pg_advisory_xact_lock(literal(ADVISORY_NAMESPACE), room_id))
+        )
+
+
+# Admission for a booking write touching `room_ids`: the in-process lock is
+# taken first, so requests for a busy room queue up here instead of each
+# holding a pooled connection while it waits for the advisory lock. The
+# transaction must be committed or rolled back inside the block.
+# SQLite is left alone: it has one writer for the whole database, which
+# already serializes the check and the insert, and queueing in front of its
+# busy-wait only makes the wait longer.
+@asynccontextmanager
+async def admit(db: AsyncSession, *room_ids: int):
+    if not settings.BOOKING_ROOM_LOCKS or db.bind.dialect.name == "sqlite":
+        yield
+        return
+    async with room_locks.hold(room_ids):
+        await lock_rooms(db, room_ids)
+        yield
@@ -0,0 +1,328 @@
+import asyncio
+from collections import Counter
+from datetime import date, datetime, time, timedelta
+from typing import List, Optional
+
+from sqlalchemy import and_, delete, extract, func, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from . import settings
+from .database import upsert
+from .models import Booking, Office, Room, RoomUsageDaily, RoomUsageHourly
+from .partitions import overlaps
+
+
+# Rollup changes collected during one write, applied with one upsert per table.
+# Only days within [first_day, last_day] are kept when bounds are given.
+class UsageDelta:
+    def __init__(self, first_day: Optional[date] = None, last_day: Optional[date] = None):
+        self.first_day = first_day
+        self.last_day = last_day
+        self.hourly = Counter()  # (room_id, day, hour) -> seconds
+        self.daily_seconds = Counter()  # (room_id, day) -> seconds
+        self.daily_bookings = Counter()
+        self.daily_cancellations = Counter()
+
+    def _in_range(self, day: date) -> bool:
+        return (self.first_day is None or day >= self.first_day) and (
+            self.last_day is None or day <= self.last_day
+        )
+
+    # sign=-1 takes a booking back out, e.g. on delete or before a move
+    def add_booking(self, room_id: int, start: datetime, end: datetime, sign: int = 1):
+        if self._in_range(start.date()):
+            self.daily_bookings[(room_id, start.date())] += sign
+        cursor = start
+        while cursor < end:
+            next_hour = cursor.replace(minute=0, second=0, microsecond=0) + timedelta(hours=1)
+            slice_end = min(next_hour, end)
+            day = cursor.date()
+            if self._in_range(day):
+                seconds = int((slice_end - cursor).total_seconds())
+                self.hourly[(room_id, day, cursor.hour)] += sign * seconds
+                self.daily_seconds[(room_id, day)] += sign * seconds
+            cursor = slice_end
+
+    def cancel(self, room_id: int, start: datetime):
+        if self._in_range(start.date()):
+            self.daily_cancellations[(room_id, start.date())] += 1
+
+    # Rows go out sorted by key, so two writes touching the same rooms lock
+    # their rollup rows in the same order and cannot deadlock each other
+    async def apply(self, db: AsyncSession):
+        hourly = [
+            {"room_id": room_id, "day": day, "hour": hour, "booked_seconds": seconds}
+            for (room_id, day, hour), seconds in sorted(self.hourly.items())
+            if seconds
+        ]
+        if hourly:
+            stmt = upsert(db, RoomUsageHourly)
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["room_id", "day", "hour"],
+                    set_={
+                        "booked_seconds": RoomUsageHourly.booked_seconds
+                        + stmt.excluded.booked_seconds
+                    },
+                ),
+                hourly,
+            )
+
+        keys = set(self.daily_seconds) | set(self.daily_bookings) | set(self.daily_cancellations)
+        daily = [
+            {
+                "room_id": room_id,
+                "day": day,
+                "booked_seconds": self.daily_seconds[(room_id, day)],
+                "bookings": self.daily_bookings[(room_id, day)],
+                "cancellations": self.daily_cancellations[(room_id, day)],
+            }
+            for room_id, day in sorted(keys)
+        ]
+        if daily:
+            stmt = upsert(db, RoomUsageDaily)
+            await db.execute(
+                stmt.on_conflict_do_update(
+                    index_elements=["room_id", "day"],
+                    set_={
+                        "booked_seconds": RoomUsageDaily.booked_seconds
+                        + stmt.excluded.booked_seconds,
+                        "bookings": RoomUsageDaily.bookings + stmt.excluded.bookings,
+                        "cancellations": RoomUsageDaily.cancellations
+                        + stmt.excluded.cancellations,
+                    },
+                ),
+                daily,
+            )
+
+
+# Write hook for the booking paths; a no-op with analytics switched off
+async def record(db: AsyncSession, delta: UsageDelta):
+    if settings.ANALYTICS_ENABLED:
+        await delta.apply(db)
+
+
+def _capacity_seconds(rooms: int, days: int) -> int:
+    return rooms * days * settings.ANALYTICS_OPEN_HOURS * 3600
+
+
+def _utilization(seconds: int, capacity: int) -> float:
+    return round(seconds / capacity, 4) if capacity else 0.0
+
+
+def _cancellation_rate(bookings: int, cancellations: int) -> float:
+    total = bookings + cancellations
+    return round(cancellations / total, 4) if total else 0.0
+
+
+async def _office_rooms(db: AsyncSession, office_id: int, room_id: Optional[int] = None):
+    if await db.get(Office, office_id) is None:
+        return None
+    query = select(Room.id, Room.name).filter(Room.office_id == office_id)
+    if room_id is not None:
+        query = query.filter(Room.id == room_id)
+    return (await db.execute(query.order_by(Room.id))).all()
+
+
+def _room_usage(rooms, totals, days: int) -> List[dict]:
+    usage = []
+    for room_id, name in rooms:
+        seconds, bookings, cancellations = totals.get(room_id, (0, 0, 0))
+        usage.append(
+            {
+                "room_id": room_id,
+                "name": name,
+                "booked_hours": round(seconds / 3600, 2),
+                "bookings": bookings,
+                "cancellations": cancellations,
+                "utilization": _utilization(seconds, _capacity_seconds(1, days)),
+                "cancellation_rate": _cancellation_rate(bookings, cancellations),
+            }
+        )
+    return usage
+
+
+# Hours booked per day or ISO week for an office (or one of its rooms) plus
+# per-room totals, from the daily rollups: at most one row per day and one
+# per room come back, however many bookings the range holds.
+async def utilization_report(
+    db: AsyncSession,
+    office_id: int,
+    start: date,
+    end: date,
+    granularity: str = "day",
+    room_id: Optional[int] = None,
+) -> Optional[dict]:
+    rooms = await _office_rooms(db, office_id, room_id)
+    if rooms is None:
+        return None
+    room_ids = [room.id for room in rooms]
+    in_range = and_(
+        RoomUsageDaily.room_id.in_(room_ids),
+        RoomUsageDaily.day >= start,
+        RoomUsageDaily.day <= end,
+    )
+    sums = (
+        func.coalesce(func.sum(RoomUsageDaily.booked_seconds), 0),
+        func.coalesce(func.sum(RoomUsageDaily.bookings), 0),
+        func.coalesce(func.sum(RoomUsageDaily.cancellations), 0),
+    )
+    by_day = await db.execute(
+        select(RoomUsageDaily.day, *sums).filter(in_range).group_by(RoomUsageDaily.day)
+    )
+    by_room = await db.execute(
+        select(RoomUsageDaily.room_id, *sums).filter(in_range).group_by(RoomUsageDaily.room_id)
+    )
+
+    periods = {}
+    for day, seconds, bookings, cancellations in by_day.all():
+        key = day if granularity == "day" else day - timedelta(days=day.weekday())
+        total = periods.setdefault(key, [0, 0, 0])
+        total[0] += seconds
+        total[1] += bookings
+        total[2] += cancellations
+
+    period_days = 1 if granularity == "day" else 7
+    report_periods = []
+    for key in sorted(periods):
+        seconds, bookings, cancellations = periods[key]
+        # Weeks cut by the range only count their days inside it
+        days = min(key + timedelta(days=period_days - 1), end) - max(key, start)
+        report_periods.append(
+            {
+                "period_start": key,
+                "booked_hours": round(seconds / 3600, 2),
+                "bookings": bookings,
+                "cancellations": cancellations,
+                "utilization": _utilization(
+                    seconds, _capacity_seconds(len(room_ids), days.days + 1)
+                ),
+            }
+        )
+
+    totals = {row[0]: tuple(row[1:]) for row in by_room.all()}
+    return {
+        "office_id": office_id,
+        "start_date": start,
+        "end_date": end,
+        "granularity": granularity,
+        "periods": report_periods,
+        "rooms": _room_usage(rooms, totals, (end - start).days + 1),
+    }
+
+
+# Day of the week computed in SQL so grouping yields at most 7 * 24 rows:
+# 0 = Sunday on SQLite, 7 = Sunday on Postgres, Monday is 1 on both.
+# Converted to 0 = Monday with (value + 6) % 7.
+def _weekday(db: AsyncSession, column):
+    if db.bind.dialect.name == "sqlite":
+        return func.strftime("%w", column)
+    return extract("isodow", column)
+
+
+# Booked hours by weekday (0 = Monday) and hour of day, summed over the range
+async def peak_hours(
+    db: AsyncSession, office_id: int, start: date, end: date
+) -> Optional[dict]:
+    rooms = await _office_rooms(db, office_id)
+    if rooms is None:
+        return None
+    weekday = _weekday(db, RoomUsageHourly.day)
+    result = await db.execute(
+        select(weekday, RoomUsageHourly.hour, func.sum(RoomUsageHourly.booked_seconds))
+        .filter(
+            RoomUsageHourly.room_id.in_([room.id for room in rooms]),
+            RoomUsageHourly.day >= start,
+            RoomUsageHourly.day <= end,
+        )
+        .group_by(weekday, RoomUsageHourly.hour)
+    )
+    grid = [[0.0] * 24 for _ in range(7)]
+    for day, hour, seconds in result.all():
+        grid[(int(day) + 6) % 7][hour] += seconds / 3600
+    return {
+        "office_id": office_id,
+        "start_date": start,
+        "end_date": end,
+        "hours": [[round(value, 2) for value in row] for row in grid],
+    }
+
+
+# Rooms ranked by the share of their bookings cancelled before the start.
+# Check-ins are not recorded, so late cancellations stand in for no-shows.
+async def cancellation_prone_rooms(
+    db: AsyncSession,
+    office_id: int,
+    start: date,
+    end: date,
+    min_bookings: int = 5,
+    limit: int = 10,
+) -> Optional[List[dict]]:
+    report = await utilization_report(db, office_id, start, end)
+    if report is None:
+        return None
+    rooms = [
+        room
+        for room in report["rooms"]
+        if room["bookings"] + room["cancellations"] >= min_bookings
+    ]
+    rooms.sort(key=lambda room: (-room["cancellation_rate"], room["room_id"]))
+    return rooms[:limit]
+
+
+# Compaction: recompute booked time and booking counts of [start, end] from the
+# bookings table, repairing drift (rows written with analytics off, imports,
+# failed deltas) and dropping empty rows. Cancellations cannot be rebuilt from
+# the bookings that remain, so they are kept as they are. Best run off-peak:
+# deltas committed while it runs may be counted twice or not at all.
+async def rebuild(db: AsyncSession, start: date, end: date) -> int:
+    await db.execute(
+        update(RoomUsageDaily)
+        .where(RoomUsageDaily.day >= start, RoomUsageDaily.day <= end)
+        .values(booked_seconds=0, bookings=0)
+    )
+    await db.execute(
+        delete(RoomUsageHourly).where(RoomUsageHourly.day >= start, RoomUsageHourly.day <= end)
+    )
+
+    low = datetime.combine(start, time.min)
+    high = datetime.combine(end + timedelta(days=1), time.min)
+    delta = UsageDelta(first_day=start, last_day=end)
+    result = await db.stream(
+        select(Booking.room_id, Booking.start_time, Booking.end_time)
+        .filter(overlaps(Booking, low, high))
+        .execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+    )
+    bookings = 0
+    async for rows in result.partitions():
+        for room_id, start_time, end_time in rows:
+            delta.add_booking(room_id, start_time, end_time)
+            bookings += 1
+    await delta.apply(db)
+
+    await db.execute(
+        delete(RoomUsageDaily).where(
+            RoomUsageDaily.day >= start,
+            RoomUsageDaily.day <= end,
+            RoomUsageDaily.booked_seconds == 0,
+            RoomUsageDaily.bookings == 0,
+            RoomUsageDaily.cancellations == 0,
+        )
+    )
+    await db.commit()
+    return bookings
+
+
+async def main():
+    from .database import async_session_maker
+
+    today = datetime.utcnow().date()
+    days = settings.ANALYTICS_COMPACTION_DAYS
+    async with async_session_maker() as db:
+        bookings = await rebuild(db, today - timedelta(days=days), today + timedelta(days=days))
+    print(f"Rebuilt usage rollups from {bookings} bookings")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
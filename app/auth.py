@@ -1,26 +1,112 @@
+import asyncio
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Optional, Tuple
 from jose import JWTError, jwt
 from passlib.context import CryptContext
 from fastapi import Depends, HTTPException, status
 from sqlalchemy.orm import Session
-from passlib.context import CryptContext
-from app.settings import SECRET_KEY
+from app.pubsub import broadcast
+from app.token_cache import REVOCATION_CHANNEL, token_cache, token_digest
+from app.settings import (
+    SECRET_KEY,
+    BCRYPT_ROUNDS,
+    PASSWORD_HASH_WORKERS,
+    PASSWORD_HASH_MAX_QUEUE,
+)
 
 
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 
-# To hash passwords and verify them
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# To hash passwords and verify them. Hashes made with a different cost are
+# reported as needing an update, so they get rehashed on the next login.
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
+
+
+# bcrypt takes 100ms+ of CPU per call, so the async handlers run it on a
+# bounded thread pool (bcrypt releases the GIL) instead of the event loop.
+# Requests beyond the pool size wait in a queue of at most `max_queue`
+# entries; past that they are turned away with a 503.
+class PasswordHasher:
+    def __init__(self, max_workers: int, max_queue: int):
+        self.max_workers = max_workers
+        self.max_queue = max_queue
+        self._executor = ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="password-hash"
+        )
+        self.pending = 0
+        self.completed = 0
+        self.rejected = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    @property
+    def queued(self) -> int:
+        return max(self.pending - self.max_workers, 0)
+
+    def _timed(self, submitted_at: float, func, *args):
+        wait = time.monotonic() - submitted_at
+        self.wait_seconds_total += wait
+        self.wait_seconds_max = max(self.wait_seconds_max, wait)
+        return func(*args)
+
+    async def _run(self, func, *args):
+        if self.queued >= self.max_queue:
+            self.rejected += 1
+            raise HTTPException(
+                status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+                detail="Too many concurrent password checks, try again shortly.",
+                headers={"Retry-After": "1"},
+            )
+        self.pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(
+                self._executor, self._timed, time.monotonic(), func, *args
+            )
+        finally:
+            self.pending -= 1
+            self.completed += 1
 
-# Function to hash a password
-def get_password_hash(password: str):
-    return pwd_context.hash(password)
+    async def hash(self, password: str) -> str:
+        return await self._run(pwd_context.hash, password)
+
+    async def verify(self, plain_password: str, hashed_password: str) -> bool:
+        return await self._run(pwd_context.verify, plain_password, hashed_password)
+
+    # Returns (valid, new_hash); new_hash is set when the stored hash uses an
+    # outdated cost and should be replaced
+    async def verify_and_update(
+        self, plain_password: str, hashed_password: str
+    ) -> Tuple[bool, Optional[str]]:
+        return await self._run(
+            pwd_context.verify_and_update, plain_password, hashed_password
+        )
+
+    def stats(self) -> dict:
+        return {
+            "workers": self.max_workers,
+            "pending": self.pending,
+            "queued": self.queued,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "wait_seconds_total": self.wait_seconds_total,
+            "wait_seconds_max": self.wait_seconds_max,
+        }
+
+
+password_hasher = PasswordHasher(
+    max_workers=PASSWORD_HASH_WORKERS, max_queue=PASSWORD_HASH_MAX_QUEUE
+)
 
-# Function to verify a password
-def verify_password(plain_password: str, hashed_password: str):
-    return pwd_context.verify(plain_password, hashed_password)
 
 # Function to create a JWT token
 def create_access_token(data: dict, expires_delta: Optional[timedelta] = None):
@@ -42,13 +128,25 @@ def verify_token(token: str):
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
 
 
-# Setup passlib context to hash passwords
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Same as verify_token, but repeated requests with one token skip the decode
+def get_token_entry(token: str) -> dict:
+    if token_cache.is_revoked(token):
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token")
+    entry = token_cache.get(token)
+    if entry is None:
+        entry = token_cache.put(token, verify_token(token))
+    return entry
 
-# Function to hash password
-def hash_password(password: str) -> str:
-    return pwd_context.hash(password)
 
-# Function to verify password hash
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    return pwd_context.verify(plain_password, hashed_password)
+# Logout. Only a valid token is revoked (a 401 otherwise), so callers cannot
+# fill the revocation list with made-up strings; it is refused until its own
+# `exp`, here and, through the broadcast, in the other workers.
+async def revoke_token(token: str):
+    entry = get_token_entry(token)
+    expires_at = entry["claims"].get("exp")
+    token_cache.revoke(token, expires_at)
+    await broadcast.publish(
+        REVOCATION_CHANNEL,
+        {"digest": token_digest(token), "expires_at": expires_at},
+        local=False,
+    )
@@ -0,0 +1,107 @@
+from datetime import datetime, timedelta
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from .models import Booking, Office, Room
+from .partitions import overlaps
+
+
+# Sweep over busy intervals sorted by start and return the gaps of at least
+# `min_duration` inside [start, end). Overlapping intervals are merged on the way.
+def free_windows(
+    busy: List[Tuple[datetime, datetime]],
+    start: datetime,
+    end: datetime,
+    min_duration: timedelta = timedelta(0),
+) -> List[Tuple[datetime, datetime]]:
+    windows = []
+    cursor = start
+    for busy_start, busy_end in busy:
+        if busy_start >= end:
+            break
+        if busy_start > cursor:
+            windows.append((cursor, busy_start))
+        cursor = max(cursor, busy_end)
+    if cursor < end:
+        windows.append((cursor, end))
+    return [(s, e) for s, e in windows if e - s >= min_duration]
+
+
+# Free windows of every room of an office within [start, end).
+# All rooms and their overlapping bookings come back from one outer-join query,
+# already ordered by room and start time, so each room is a single sweep.
+async def get_office_availability(
+    db: AsyncSession,
+    office_id: int,
+    start: datetime,
+    end: datetime,
+    min_capacity: Optional[int] = None,
+    duration: Optional[timedelta] = None,
+) -> Optional[dict]:
+    query = (
+        select(
+            Room.id, Room.name, Room.capacity, Booking.start_time, Booking.end_time
+        )
+        .outerjoin(
+            Booking,
+            and_(
+                Booking.room_id == Room.id,
+                overlaps(Booking, start, end),
+            ),
+        )
+        .filter(Room.office_id == office_id)
+        .order_by(Room.id, Booking.start_time)
+    )
+    if min_capacity:
+        query = query.filter(Room.capacity >= min_capacity)
+    rows = (await db.execute(query)).all()
+
+    if not rows:
+        office = await db.execute(select(Office.id).filter(Office.id == office_id))
+        if office.scalar() is None:
+            return None
+
+    min_duration = duration or timedelta(0)
+    rooms = []
+    current = None
+    busy = []
+    for room_id, name, capacity, busy_start, busy_end in rows:
+        if current is None or current["room_id"] != room_id:
+            if current is not None:
+                current["free"] = free_windows(busy, start, end, min_duration)
+            current = {"room_id": room_id, "name": name, "capacity": capacity}
+            rooms.append(current)
+            busy = []
+        if busy_start is not None:
+            busy.append((busy_start, busy_end))
+    if current is not None:
+        current["free"] = free_windows(busy, start, end, min_duration)
+
+    next_slot = None
+    if duration:
+        for room in rooms:
+            if room["free"] and (
+                next_slot is None or room["free"][0][0] < next_slot["start_time"]
+            ):
+                slot_start = room["free"][0][0]
+                next_slot = {
+                    "room_id": room["room_id"],
+                    "start_time": slot_start,
+                    "end_time": slot_start + duration,
+                }
+
+    for room in rooms:
+        room["free"] = [
+            {"start_time": window_start, "end_time": window_end}
+            for window_start, window_end in room["free"]
+        ]
+    return {
+        "office_id": office_id,
+        "start_time": start,
+        "end_time": end,
+        "rooms": rooms,
+        "next_slot": next_slot,
+    }
@@ -0,0 +1,129 @@
+import json
+import time
+from collections import OrderedDict
+from typing import Awaitable, Callable, Dict, Optional
+
+from app import settings
+from app.loaders import SingleFlight
+from app.pubsub import broadcast, redis_client
+
+INVALIDATION_CHANNEL = "cache.invalidate"
+
+
+# In-process LRU with a TTL per entry
+class MemoryBackend:
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, tuple]" = OrderedDict()
+
+    async def get(self, key: str) -> Optional[dict]:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        value, expires_at = entry
+        if expires_at <= time.monotonic():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    async def set(self, key: str, value: dict, ttl: float):
+        self._entries[key] = (value, time.monotonic() + ttl)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    async def delete(self, *keys: str):
+        self.forget(*keys)
+
+    # Drop keys from this process only
+    def forget(self, *keys: str):
+        for key in keys:
+            self._entries.pop(key, None)
+
+
+# Shared between all workers, values stored as JSON
+class RedisBackend:
+    def __init__(self, url: str, prefix: str = "booking:cache:"):
+        self.prefix = prefix
+        self._redis = redis_client(url)
+
+    async def get(self, key: str) -> Optional[dict]:
+        raw = await self._redis.get(self.prefix + key)
+        return json.loads(raw) if raw is not None else None
+
+    async def set(self, key: str, value: dict, ttl: float):
+        await self._redis.set(self.prefix + key, json.dumps(value), ex=max(int(ttl), 1))
+
+    async def delete(self, *keys: str):
+        if keys:
+            await self._redis.delete(*[self.prefix + key for key in keys])
+
+    def forget(self, *keys: str):
+        pass
+
+
+# Read-through cache for rarely changing entities such as offices and rooms.
+# Values are JSON-ready dicts. Writers call `invalidate`, which also tells the
+# other worker processes to drop their in-process copies. Concurrent misses
+# for one key share a single load.
+class EntityCache:
+    def __init__(self, backend, ttl: float):
+        self.backend = backend
+        self.ttl = ttl
+        # Bumped on invalidation so a load that raced with a write is not stored
+        self._generations: Dict[str, int] = {}
+        self._flights = SingleFlight()
+        self.hits = 0
+        self.misses = 0
+        broadcast.subscribe(INVALIDATION_CHANNEL, self._on_remote_invalidate)
+
+    async def get_or_load(
+        self, key: str, loader: Callable[[], Awaitable[Optional[dict]]]
+    ) -> Optional[dict]:
+        if self.backend is None:
+            return await self._flights.do(key, loader)
+
+        value = await self.backend.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        self.misses += 1
+        return await self._flights.do(key, lambda: self._load(key, loader))
+
+    async def _load(self, key: str, loader) -> Optional[dict]:
+        generation = self._generations.get(key, 0)
+        value = await loader()
+        if value is not None and self._generations.get(key, 0) == generation:
+            await self.backend.set(key, value, self.ttl)
+        return value
+
+    async def invalidate(self, *keys: str):
+        if self.backend is None or not keys:
+            return
+        for key in keys:
+            self._generations[key] = self._generations.get(key, 0) + 1
+        await self.backend.delete(*keys)
+        await broadcast.publish(INVALIDATION_CHANNEL, {"keys": list(keys)}, local=False)
+
+    def _on_remote_invalidate(self, message: dict):
+        keys = message.get("keys") or []
+        for key in keys:
+            self._generations[key] = self._generations.get(key, 0) + 1
+        if self.backend is not None:
+            self.backend.forget(*keys)
+
+    def stats(self) -> dict:
+        return {"hits": self.hits, "misses": self.misses, "coalesced": self._flights.shared}
+
+
+def make_backend():
+    if settings.CACHE_BACKEND == "redis" and settings.REDIS_URL:
+        return RedisBackend(settings.REDIS_URL)
+    if settings.CACHE_BACKEND == "memory":
+        return MemoryBackend(settings.CACHE_MAX_ENTRIES)
+    return None
+
+
+entity_cache = EntityCache(make_backend(), settings.CACHE_TTL)
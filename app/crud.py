@@ -1,105 +1,721 @@
+import asyncio
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy import DateTime, Integer, and_, delete, exists, func, insert, literal, or_, update
 from sqlalchemy.future import select
 from sqlalchemy.exc import IntegrityError
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, selectinload
+from collections import defaultdict
 from datetime import datetime
 
 
 from .models import Office, Room, Booking, User
+from .database import async_session_maker, upsert
 from .schemas import OfficeResponseCreate, RoomCreate, BookingCreate, UserCreate
-from .auth import get_password_hash, verify_password, create_access_token
-from typing import Optional
+from .schemas import BookingList, OfficeResponse, Room as RoomResponse
+from .serialization import columns_for
+from .cache import entity_cache
+from .etags import booking_keys, office_keys, room_keys, versions
+from .auth import password_hasher, create_access_token
+from .pagination import CursorParams, paginate_keyset
+from .interval_index import RoomIntervals, booking_index
+from .loaders import DataLoader
+from . import admission, analytics, events, partitions, settings
+from typing import Dict, List, Optional
+
+def office_key(office_id: int) -> str:
+    return f"office:{office_id}"
+
+
+def room_key(room_id: int) -> str:
+    return f"room:{room_id}"
+
+
+# By-id lookups from all concurrent requests are merged into one
+# WHERE id IN (...) per engine and event loop pass. They run in a session of
+# their own, on the engine of the session they are asked for from.
+def _by_id_loader(model, schema) -> DataLoader:
+    async def load(bind, ids):
+        async with async_session_maker(bind=bind) as db:
+            result = await db.execute(select(model).filter(model.id.in_(ids)))
+            return {
+                row.id: schema.model_validate(row).model_dump(mode="json")
+                for row in result.scalars()
+            }
+
+    return DataLoader(load, max_batch=settings.BATCH_MAX_IDS)
+
+
+office_loader = _by_id_loader(Office, OfficeResponse)
+room_loader = _by_id_loader(Room, RoomResponse)
+booking_loader = _by_id_loader(Booking, BookingList)
+
+
+# After a committed write: drop the cached entity and bump the ETag versions
+async def office_changed(office_id: int):
+    await entity_cache.invalidate(office_key(office_id))
+    await versions.publish(*office_keys(office_id))
+
+
+async def room_changed(room_id: int):
+    await entity_cache.invalidate(room_key(room_id))
+    await versions.publish(*room_keys(room_id))
+
 
 # Office CRUD
+async def get_office(db: AsyncSession, office_id: int) -> Optional[dict]:
+    return await entity_cache.get_or_load(
+        office_key(office_id), lambda: office_loader.load(db.bind, office_id)
+    )
+
+
+# Found offices in the order asked for, cache first
+async def get_offices_by_id(db: AsyncSession, office_ids: List[int]) -> List[dict]:
+    offices = await asyncio.gather(
+        *(get_office(db, office_id) for office_id in dict.fromkeys(office_ids))
+    )
+    return [office for office in offices if office is not None]
+
+
+# rows=True selects the columns of the response schema instead of entities,
+# for serialization.page_response (same for rooms and bookings below)
 async def get_offices(
-    db: AsyncSession, skip: int = 0, limit: int = 100, location: Optional[str] = None
+    db: AsyncSession,
+    params: CursorParams,
+    location: Optional[str] = None,
+    rows: bool = False,
 ):
-    query = select(Office).offset(skip).limit(limit)
+    query = select(*columns_for(Office, OfficeResponse)) if rows else select(Office)
     if location:
         query = query.filter(Office.location == location)
-    result = await db.execute(query)
-    return result.scalars().all()
+    return await paginate_keyset(db, query, [Office.id], params, scalars=not rows)
+
+
+# Offices with their rooms and each room's bookings overlapping [start, end),
+# in the order of `office_ids` (unknown ids are left out). Three queries
+# however many offices and rooms: the offices, their rooms (selectinload)
+# and one grouped count over all those rooms.
+async def get_office_details(
+    db: AsyncSession, office_ids: List[int], start: datetime, end: datetime
+) -> List[dict]:
+    result = await db.execute(
+        select(Office)
+        .filter(Office.id.in_(office_ids))
+        .options(selectinload(Office.rooms))
+    )
+    offices = {office.id: office for office in result.scalars().all()}
+    if not offices:
+        return []
+
+    counts = await db.execute(
+        select(Booking.room_id, func.count(Booking.id))
+        .join(Room, Room.id == Booking.room_id)
+        .filter(
+            Room.office_id.in_(list(offices)),
+            partitions.overlaps(Booking, start, end),
+        )
+        .group_by(Booking.room_id)
+    )
+    upcoming = dict(counts.all())
+
+    details = []
+    for office_id in dict.fromkeys(office_ids):
+        office = offices.get(office_id)
+        if office is None:
+            continue
+        rooms = [
+            {
+                "id": room.id,
+                "name": room.name,
+                "capacity": room.capacity,
+                "office_id": room.office_id,
+                "upcoming_bookings": upcoming.get(room.id, 0),
+            }
+            for room in sorted(office.rooms, key=lambda room: room.id)
+        ]
+        details.append(
+            {
+                "id": office.id,
+                "name": office.name,
+                "location": office.location,
+                "rooms": rooms,
+                "upcoming_bookings": sum(room["upcoming_bookings"] for room in rooms),
+                "start_time": start,
+                "end_time": end,
+            }
+        )
+    return details
 
 
+# Returns None when an office with the same name already exists
 async def create_office(db: AsyncSession, office: OfficeResponseCreate):
-    # Create a new office object
-    db_office = Office(name=office.name, location=office.location)
-    
-    # Add the new office to the session
-    db.add(db_office)
-    
-    # Commit the transaction asynchronously
+    # A single INSERT; the unique index on name settles concurrent creates
+    result = await db.execute(
+        upsert(db, Office)
+        .values(name=office.name, location=office.location)
+        .on_conflict_do_nothing(index_elements=[Office.name])
+        .returning(Office)
+    )
+    db_office = result.scalar_one_or_none()
     await db.commit()
-    
-    # Refresh the instance to retrieve its ID (after commit)
-    await db.refresh(db_office)
-    
+    if db_office is not None:
+        await office_changed(db_office.id)
     return db_office
 
 
+# Returns None when the office does not exist, raises ValueError on a name clash
+async def update_office(db: AsyncSession, office_id: int, office: OfficeResponseCreate):
+    try:
+        result = await db.execute(
+            update(Office)
+            .where(Office.id == office_id)
+            .values(name=office.name, location=office.location)
+            .returning(Office)
+        )
+        db_office = result.scalar_one_or_none()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise ValueError("Office with this name already exists.")
+    if db_office is not None:
+        await office_changed(office_id)
+    return db_office
+
+
+# Raises ValueError while rooms still belong to the office
+async def delete_office(db: AsyncSession, office_id: int) -> bool:
+    try:
+        result = await db.execute(
+            delete(Office).where(Office.id == office_id).returning(Office.id)
+        )
+        deleted = result.scalar_one_or_none()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise ValueError("Office still has rooms.")
+    if deleted is None:
+        return False
+    await office_changed(office_id)
+    return True
+
+
 # Room CRUD
+async def get_room(db: AsyncSession, room_id: int) -> Optional[dict]:
+    return await entity_cache.get_or_load(
+        room_key(room_id), lambda: room_loader.load(db.bind, room_id)
+    )
+
+
+async def get_rooms_by_id(db: AsyncSession, room_ids: List[int]) -> List[dict]:
+    rooms = await asyncio.gather(*(get_room(db, room_id) for room_id in dict.fromkeys(room_ids)))
+    return [room for room in rooms if room is not None]
+
+
 async def get_rooms(
-    db: AsyncSession, office_id: Optional[int] = None, capacity: Optional[int] = None
+    db: AsyncSession,
+    params: CursorParams,
+    office_id: Optional[int] = None,
+    capacity: Optional[int] = None,
+    rows: bool = False,
 ):
-    query = select(Room)
+    query = select(*columns_for(Room, RoomResponse)) if rows else select(Room)
     if office_id:
         query = query.filter(Room.office_id == office_id)
     if capacity:
         query = query.filter(Room.capacity == capacity)
-    result = await db.execute(query)
-    return result.scalars().all()
+    return await paginate_keyset(db, query, [Room.id], params, scalars=not rows)
 
 
 async def create_room(db: AsyncSession, room: RoomCreate):
-    db_room = Room(name=room.name, capacity=room.capacity, office_id=room.office_id)
-    db.add(db_room)
+    result = await db.execute(
+        insert(Room)
+        .values(name=room.name, capacity=room.capacity, office_id=room.office_id)
+        .returning(Room)
+    )
+    db_room = result.scalar_one()
     await db.commit()
+    await room_changed(db_room.id)
     return db_room
 
 
+async def update_room(db: AsyncSession, room_id: int, room: RoomCreate):
+    result = await db.execute(
+        update(Room)
+        .where(Room.id == room_id)
+        .values(name=room.name, capacity=room.capacity, office_id=room.office_id)
+        .returning(Room)
+    )
+    db_room = result.scalar_one_or_none()
+    await db.commit()
+    if db_room is not None:
+        await room_changed(room_id)
+    return db_room
+
+
+# Raises ValueError while bookings still reference the room
+async def delete_room(db: AsyncSession, room_id: int) -> bool:
+    try:
+        result = await db.execute(
+            delete(Room).where(Room.id == room_id).returning(Room.id)
+        )
+        deleted = result.scalar_one_or_none()
+        await db.commit()
+    except IntegrityError:
+        await db.rollback()
+        raise ValueError("Room still has bookings.")
+    if deleted is None:
+        return False
+    await room_changed(room_id)
+    return True
+
+
 # Booking CRUD
 async def get_bookings(
-    db: AsyncSession, user_id: Optional[int] = None, room_id: Optional[int] = None
+    db: AsyncSession,
+    params: CursorParams,
+    user_id: Optional[int] = None,
+    room_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+    rows: bool = False,
 ):
-    query = select(Booking).options(selectinload(Booking.room))
+    # BookingList has no nested room, so there is nothing to eager-load
+    query = select(*columns_for(Booking, BookingList)) if rows else select(Booking)
     if user_id:
         query = query.filter(Booking.user_id == user_id)
     if room_id:
         query = query.filter(Booking.room_id == room_id)
-    result = await db.execute(query)
-    return result.scalars().all()
+    # On the partition key: only the months in range are read
+    if start is not None:
+        query = query.filter(Booking.start_time >= start)
+    if end is not None:
+        query = query.filter(Booking.start_time < end)
+    return await paginate_keyset(
+        db, query, [Booking.start_time, Booking.id], params, scalars=not rows
+    )
+
+
+async def get_booking(db: AsyncSession, booking_id: int) -> Optional[dict]:
+    return await booking_loader.load(db.bind, booking_id)
+
+
+async def get_bookings_by_id(db: AsyncSession, booking_ids: List[int]) -> List[dict]:
+    bookings = await booking_loader.load_many(db.bind, dict.fromkeys(booking_ids))
+    return [booking for booking in bookings if booking is not None]
+
+
+# Condition matching bookings of `room_id` that overlap [start_time, end_time)
+def overlapping(room_id: int, start_time: datetime, end_time: datetime, model=Booking):
+    return and_(model.room_id == room_id, partitions.overlaps(model, start_time, end_time))
+
+
+# Most conflicts are caught by the in-memory index without a round trip
+async def _index_conflict(
+    db: AsyncSession,
+    room_id: int,
+    start_time: datetime,
+    end_time: datetime,
+    exclude_id: Optional[int] = None,
+) -> bool:
+    if not settings.BOOKING_INDEX_ENABLED:
+        return False
+    conflict = await booking_index.find_conflict(
+        db, room_id, start_time, end_time, exclude_id
+    )
+    return conflict is not None
+
+
+# Requests that are bound to fail are turned away before they queue for the
+# room's admission lock. Candidates are those the in-memory index (when
+# enabled) finds a conflict for and, while another write holds the room, all
+# of them; a plain overlap query confirms each one, since the index may still
+# hold bookings another worker has moved or deleted. Only a hint, the check
+# made under the lock is the one that counts. It runs in a session of its
+# own, closed before the request queues: the request's session must not hold
+# a pooled connection while it waits for the lock.
+async def _contended_conflict(
+    db: AsyncSession,
+    room_id: int,
+    start_time: datetime,
+    end_time: datetime,
+    exclude_id: Optional[int] = None,
+) -> bool:
+    async with async_session_maker(bind=db.bind) as session:
+        indexed = await _index_conflict(session, room_id, start_time, end_time, exclude_id)
+        busy = settings.BOOKING_ROOM_LOCKS and admission.room_locks.busy(room_id)
+        if not indexed and not busy:
+            return False
+        condition = overlapping(room_id, start_time, end_time)
+        if exclude_id is not None:
+            condition = and_(condition, Booking.id != exclude_id)
+        conflict = bool(await session.scalar(select(exists().where(condition))))
+        if indexed and not conflict:
+            # Stale: reloaded on next use
+            booking_index.invalidate(room_id)
+        return conflict
+
+
+def booking_event(booking: Booking) -> dict:
+    return BookingList.model_validate(booking).model_dump(mode="json")
+
+
+# Live events for the subscribers of the bookings' rooms and offices. The
+# offices come from the room cache, so this rarely costs a query.
+async def publish_booking_events(
+    db: AsyncSession,
+    kind: str,
+    bookings: List[dict],
+    previous_room_ids: Optional[Dict[int, int]] = None,
+):
+    if not settings.EVENTS_ENABLED or not bookings:
+        return
+    room_offices = {}
+    room_ids = {booking["room_id"] for booking in bookings}
+    room_ids.update((previous_room_ids or {}).values())
+    for room_id in room_ids:
+        room = await get_room(db, room_id)
+        if room is not None:
+            room_offices[room_id] = room["office_id"]
+    await events.publish(kind, bookings, room_offices, previous_room_ids)
 
 
 async def create_booking(db: AsyncSession, booking: BookingCreate):
-    # Check if room is already booked for the requested time
-    conflicting_booking = await db.execute(
-        select(Booking).filter(
-            Booking.room_id == booking.room_id,
-            Booking.start_time < booking.end_time,
-            Booking.end_time > booking.start_time,
+    partitions.check_duration(booking.start_time, booking.end_time)
+    if await _contended_conflict(db, booking.room_id, booking.start_time, booking.end_time):
+        raise ValueError("Room is already booked for this time.")
+
+    # One writer per room at a time (see admission.admit), so the check below
+    # cannot pass for two overlapping requests at once
+    async with admission.admit(db, booking.room_id):
+        # INSERT ... SELECT ... WHERE NOT EXISTS: the overlap check and the
+        # insert are one statement
+        values = select(
+            literal(booking.room_id, Integer),
+            literal(booking.user_id, Integer),
+            literal(booking.start_time, DateTime),
+            literal(booking.end_time, DateTime),
+        ).where(
+            ~exists().where(
+                overlapping(booking.room_id, booking.start_time, booking.end_time)
+            )
         )
-    )
-    if conflicting_booking.scalar():
+        result = await db.execute(
+            insert(Booking)
+            .from_select(["room_id", "user_id", "start_time", "end_time"], values)
+            .returning(Booking)
+        )
+        db_booking = result.scalar_one_or_none()
+        if db_booking is None:
+            await db.rollback()
+            raise ValueError("Room is already booked for this time.")
+
+        delta = analytics.UsageDelta()
+        delta.add_booking(db_booking.room_id, db_booking.start_time, db_booking.end_time)
+        await analytics.record(db, delta)
+        await db.commit()
+        booking_index.add(
+            db_booking.room_id, db_booking.id, db_booking.start_time, db_booking.end_time
+        )
+    await booking_index.publish_changes(db_booking.room_id)
+    await versions.publish(*booking_keys([db_booking.room_id], [db_booking.id]))
+    await publish_booking_events(db, "created", [booking_event(db_booking)])
+    return db_booking
+
+
+# Create many bookings at once, all or none: when an item is invalid or
+# overlaps an existing booking or an earlier item of the same request,
+# nothing is written and the results say which items failed ("skipped" for
+# the others). Returns the per-item results and whether they were created.
+# The rooms are locked together, in a fixed order, for one transaction; each
+# BULK_BOOKING_BATCH_SIZE rooms cost one conflict query, and each as many
+# items one multi-row INSERT.
+async def create_bookings_bulk(db: AsyncSession, bookings: List[BookingCreate]):
+    results = {}
+    valid = []
+    spans = {}
+    for index, item in enumerate(bookings):
+        if item.end_time <= item.start_time:
+            results[index] = {
+                "index": index,
+                "status": "invalid",
+                "detail": "end_time must be after start_time.",
+            }
+            continue
+        try:
+            partitions.check_duration(item.start_time, item.end_time)
+        except ValueError as e:
+            results[index] = {"index": index, "status": "invalid", "detail": str(e)}
+            continue
+        valid.append((index, item))
+        low, high = spans.get(item.room_id, (item.start_time, item.end_time))
+        spans[item.room_id] = (min(low, item.start_time), max(high, item.end_time))
+
+    batch_size = settings.BULK_BOOKING_BATCH_SIZE
+    async with admission.admit(db, *spans):
+        # The existing bookings of every room within its span of the request
+        rooms = defaultdict(RoomIntervals)
+        room_spans = list(spans.items())
+        for offset in range(0, len(room_spans), batch_size):
+            query = (
+                select(Booking.id, Booking.room_id, Booking.start_time, Booking.end_time)
+                .filter(
+                    or_(
+                        *[
+                            and_(
+                                Booking.room_id == room_id,
+                                partitions.overlaps(Booking, low, high),
+                            )
+                            for room_id, (low, high) in room_spans[offset : offset + batch_size]
+                        ]
+                    )
+                )
+                .order_by(Booking.room_id, Booking.start_time)
+            )
+            rows = defaultdict(list)
+            for booking_id, room_id, start_time, end_time in (await db.execute(query)).all():
+                rows[room_id].append((booking_id, start_time, end_time))
+            for room_id, room_rows in rows.items():
+                rooms[room_id] = RoomIntervals.from_sorted(room_rows)
+
+        # Accepted items are added under negative placeholder ids (-index - 1), so
+        # later items in the request are checked against them as well
+        accepted = []
+        for index, item in valid:
+            intervals = rooms[item.room_id]
+            conflict = intervals.find_conflict(item.start_time, item.end_time)
+            if conflict is None:
+                intervals.add(-index - 1, item.start_time, item.end_time)
+                accepted.append((index, item))
+            elif conflict < 0:
+                results[index] = {
+                    "index": index,
+                    "status": "conflict",
+                    "detail": f"Overlaps item {-conflict - 1} of this request.",
+                }
+            else:
+                results[index] = {
+                    "index": index,
+                    "status": "conflict",
+                    "detail": f"Room is already booked for this time (booking {conflict}).",
+                }
+
+        if results:
+            # Ends the transaction holding the locks
+            await db.rollback()
+            for index, _ in accepted:
+                results[index] = {
+                    "index": index,
+                    "status": "skipped",
+                    "detail": "Not created, other items of this request failed.",
+                }
+            return [results[index] for index in range(len(bookings))], False
+
+        delta = analytics.UsageDelta()
+        for offset in range(0, len(accepted), batch_size):
+            batch = accepted[offset : offset + batch_size]
+            created = await db.scalars(
+                insert(Booking).returning(Booking, sort_by_parameter_order=True),
+                [
+                    {
+                        "room_id": item.room_id,
+                        "user_id": item.user_id,
+                        "start_time": item.start_time,
+                        "end_time": item.end_time,
+                    }
+                    for _, item in batch
+                ],
+            )
+            for (index, _), db_booking in zip(batch, created.all()):
+                results[index] = {"index": index, "status": "created", "booking": db_booking}
+                delta.add_booking(db_booking.room_id, db_booking.start_time, db_booking.end_time)
+        await analytics.record(db, delta)
+        await db.commit()
+        created = [results[index]["booking"] for index, _ in accepted]
+        for db_booking in created:
+            booking_index.add(
+                db_booking.room_id,
+                db_booking.id,
+                db_booking.start_time,
+                db_booking.end_time,
+            )
+
+    if created:
+        await booking_index.publish_changes(*spans)
+        await versions.publish(
+            *booking_keys(spans, [db_booking.id for db_booking in created])
+        )
+        await publish_booking_events(
+            db, "created", [booking_event(db_booking) for db_booking in created]
+        )
+
+    return [results[index] for index in range(len(bookings))], True
+
+
+async def update_booking(db: AsyncSession, booking_id: int, booking: BookingCreate):
+    partitions.check_duration(booking.start_time, booking.end_time)
+    if await _contended_conflict(
+        db, booking.room_id, booking.start_time, booking.end_time, exclude_id=booking_id
+    ):
         raise ValueError("Room is already booked for this time.")
 
-    db_booking = Booking(
-        room_id=booking.room_id,
-        user_id=booking.user_id,
-        start_time=booking.start_time,
-        end_time=booking.end_time,
+    # Only the room booked into is locked: leaving a room cannot conflict
+    async with admission.admit(db, booking.room_id):
+        # The slot being given up, for the rollups and the room's list version;
+        # the row lock keeps it current until commit
+        found = await db.execute(
+            select(Booking.room_id, Booking.start_time, Booking.end_time)
+            .filter(Booking.id == booking_id)
+            .with_for_update()
+        )
+        old = found.one_or_none()
+        if old is None:
+            await db.rollback()
+            return None
+
+        other = aliased(Booking)
+        result = await db.execute(
+            update(Booking)
+            .where(
+                Booking.id == booking_id,
+                ~exists().where(
+                    overlapping(
+                        booking.room_id, booking.start_time, booking.end_time, model=other
+                    ),
+                    other.id != booking_id,
+                ),
+            )
+            .values(
+                room_id=booking.room_id,
+                user_id=booking.user_id,
+                start_time=booking.start_time,
+                end_time=booking.end_time,
+            )
+            .returning(Booking)
+        )
+        db_booking = result.scalar_one_or_none()
+        if db_booking is None:
+            await db.rollback()
+            raise ValueError("Room is already booked for this time.")
+
+        delta = analytics.UsageDelta()
+        delta.add_booking(old.room_id, old.start_time, old.end_time, sign=-1)
+        delta.add_booking(db_booking.room_id, db_booking.start_time, db_booking.end_time)
+        await analytics.record(db, delta)
+        await db.commit()
+        booking_index.remove(booking_id)
+        booking_index.add(
+            db_booking.room_id, db_booking.id, db_booking.start_time, db_booking.end_time
+        )
+    await booking_index.publish_changes(db_booking.room_id, booking_ids=[booking_id])
+    await versions.publish(*booking_keys([old.room_id, db_booking.room_id], [booking_id]))
+    await publish_booking_events(
+        db, "updated", [booking_event(db_booking)], {booking_id: old.room_id}
     )
-    db.add(db_booking)
-    await db.commit()
     return db_booking
 
 
+async def delete_booking(db: AsyncSession, booking_id: int) -> bool:
+    result = await db.execute(
+        delete(Booking)
+        .where(Booking.id == booking_id)
+        .returning(Booking.room_id, Booking.start_time, Booking.end_time)
+    )
+    deleted = result.one_or_none()
+    if deleted is None:
+        await db.commit()
+        return False
+
+    room_id, start_time, end_time = deleted
+    delta = analytics.UsageDelta()
+    delta.add_booking(room_id, start_time, end_time, sign=-1)
+    if start_time > datetime.utcnow():
+        delta.cancel(room_id, start_time)
+    await analytics.record(db, delta)
+    await db.commit()
+
+    booking_index.remove(booking_id)
+    await booking_index.publish_changes(room_id, booking_ids=[booking_id])
+    await versions.publish(*booking_keys([room_id], [booking_id]))
+    await publish_booking_events(
+        db,
+        "deleted",
+        [
+            {
+                "id": booking_id,
+                "room_id": room_id,
+                "start_time": start_time.isoformat(),
+                "end_time": end_time.isoformat(),
+            }
+        ],
+    )
+    return True
+
+
+# For bookings written outside the functions above (the admin views), after
+# the commit: the rollups, interval index, ETag versions and live events get
+# what create/update/delete_booking give them. `previous` is the booking's
+# (room id, start, end) before an update or delete, `booking` the row as
+# written (None once deleted).
+async def booking_changed(
+    kind: str,
+    booking_id: int,
+    booking: Optional[Booking] = None,
+    previous: Optional[tuple] = None,
+):
+    room_ids = []
+    delta = analytics.UsageDelta()
+    booking_index.remove(booking_id)
+    if previous is not None:
+        room_id, start_time, end_time = previous
+        room_ids.append(room_id)
+        delta.add_booking(room_id, start_time, end_time, sign=-1)
+        if kind == "deleted" and start_time > datetime.utcnow():
+            delta.cancel(room_id, start_time)
+        event = {
+            "id": booking_id,
+            "room_id": room_id,
+            "start_time": start_time.isoformat(),
+            "end_time": end_time.isoformat(),
+        }
+    if booking is not None:
+        room_ids.append(booking.room_id)
+        delta.add_booking(booking.room_id, booking.start_time, booking.end_time)
+        booking_index.add(booking.room_id, booking.id, booking.start_time, booking.end_time)
+        event = booking_event(booking)
+
+    async with async_session_maker() as db:
+        await analytics.record(db, delta)
+        await db.commit()
+        await booking_index.publish_changes(*room_ids, booking_ids=[booking_id])
+        await versions.publish(*booking_keys(room_ids, [booking_id]))
+        await publish_booking_events(
+            db,
+            kind,
+            [event],
+            {booking_id: previous[0]} if kind == "updated" else None,
+        )
+
+
 # User CRUD
+# Returns None when the username is taken. A taken name is found with the
+# unique index before any bcrypt work; ON CONFLICT covers concurrent
+# registrations of one name.
 async def create_user(db: AsyncSession, user_create: UserCreate):
-    hashed_password = auth.hash_password(user_create.password)
-    db_user = User(username=user_create.username, hashed_password=hashed_password)
-    db.add(db_user)
+    taken = await db.scalar(
+        select(exists().where(User.username == user_create.username))
+    )
+    # No connection held while the password is hashed
+    await db.rollback()
+    if taken:
+        return None
+    hashed_password = await password_hasher.hash(user_create.password)
+    result = await db.execute(
+        upsert(db, User)
+        .values(username=user_create.username, hashed_password=hashed_password)
+        .on_conflict_do_nothing(index_elements=[User.username])
+        .returning(User)
+    )
+    db_user = result.scalar_one_or_none()
     await db.commit()
-    await db.refresh(db_user)
     return db_user
 
 async def get_user_by_username(db: AsyncSession, username: str):
@@ -114,6 +730,15 @@ async def get_user(db: AsyncSession, username: str):
 
 async def authenticate_user(db: AsyncSession, username: str, password: str):
     user = await get_user(db, username)
-    if not user or not verify_password(password, user.hashed_password):
+    if not user:
+        return None
+    valid, new_hash = await password_hasher.verify_and_update(
+        password, user.hashed_password
+    )
+    if not valid:
         return None
+    # The bcrypt cost changed since this hash was made
+    if new_hash:
+        user.hashed_password = new_hash
+        await db.commit()
     return user
@@ -1,9 +1,105 @@
+import logging
+import random
+import time
+from sqlalchemy import and_, event, func, text
+from sqlalchemy.dialects import postgresql, sqlite
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
+from sqlalchemy.ext.compiler import compiles
 from sqlalchemy.ext.asyncio import create_async_engine, AsyncSession
 from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import AsyncAdaptedQueuePool
+from sqlalchemy.sql.functions import FunctionElement
+from app import settings
 from app.settings import DATABASE_URL
 
+slow_query_logger = logging.getLogger("app.sql.slow")
+
+
+# Queue pool that records how long checkouts wait for a free connection
+class InstrumentedPool(AsyncAdaptedQueuePool):
+    # Called with the wait of every checkout, e.g. to attribute it to a request
+    wait_listeners = []
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.checkouts = 0
+        self.timeouts = 0
+        self.wait_seconds_total = 0.0
+        self.wait_seconds_max = 0.0
+
+    def _do_get(self):
+        started = time.perf_counter()
+        try:
+            return super()._do_get()
+        except PoolTimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            wait = time.perf_counter() - started
+            self.checkouts += 1
+            self.wait_seconds_total += wait
+            self.wait_seconds_max = max(self.wait_seconds_max, wait)
+            for listener in self.wait_listeners:
+                listener(wait)
+
+
+def engine_options(url: str) -> dict:
+    options = {"echo": settings.DB_ECHO}
+    if url.startswith("sqlite"):
+        return options
+    options.update(
+        poolclass=InstrumentedPool,
+        pool_size=settings.DB_POOL_SIZE,
+        max_overflow=settings.DB_MAX_OVERFLOW,
+        pool_timeout=settings.DB_POOL_TIMEOUT,
+        pool_recycle=settings.DB_POOL_RECYCLE,
+        pool_pre_ping=settings.DB_POOL_PRE_PING,
+    )
+    if url.startswith("postgresql+asyncpg"):
+        options["connect_args"] = {
+            "prepared_statement_cache_size": settings.DB_STATEMENT_CACHE_SIZE
+        }
+    return options
+
+
+# Log statements slower than DB_SLOW_QUERY_MS instead of echoing every one
+def install_slow_query_log(engine):
+    if settings.DB_SLOW_QUERY_MS <= 0:
+        return
+
+    @event.listens_for(engine.sync_engine, "before_cursor_execute")
+    def start_timer(conn, cursor, statement, parameters, context, executemany):
+        conn.info.setdefault("query_started", []).append(time.perf_counter())
+
+    @event.listens_for(engine.sync_engine, "after_cursor_execute")
+    def log_slow_query(conn, cursor, statement, parameters, context, executemany):
+        elapsed_ms = (time.perf_counter() - conn.info["query_started"].pop()) * 1000
+        if (
+            elapsed_ms >= settings.DB_SLOW_QUERY_MS
+            and random.random() < settings.DB_SLOW_QUERY_SAMPLE_RATE
+        ):
+            slow_query_logger.warning(
+                "Slow query (%.1f ms): %s", elapsed_ms, " ".join(statement.split())[:1000]
+            )
+
+
+# SQLite only checks foreign keys on connections that ask for it; without
+# them deleting an office or room that is still referenced would go through
+def enable_sqlite_foreign_keys(engine):
+    if engine.dialect.name != "sqlite":
+        return
+
+    @event.listens_for(engine.sync_engine, "connect")
+    def set_foreign_keys(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
 # Create an asynchronous database engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, **engine_options(DATABASE_URL))
+install_slow_query_log(engine)
+enable_sqlite_foreign_keys(engine)
 
 # Create a sessionmaker that generates AsyncSession objects
 async_session_maker = sessionmaker(
@@ -17,3 +113,83 @@ async_session_maker = sessionmaker(
 async def get_db() -> AsyncSession:
     async with async_session_maker() as session:
         yield session
+
+
+# INSERT supporting ON CONFLICT for the dialect of the session
+def upsert(db: AsyncSession, model):
+    if db.bind.dialect.name == "sqlite":
+        return sqlite.insert(model)
+    return postgresql.insert(model)
+
+
+# [start_a, end_a) overlaps [start_b, end_b). PostgreSQL gets it as a tsrange
+# overlap, the shape the GiST index on bookings (room_id, tsrange(...))
+# serves; other databases get the two comparisons. tsrange raises on a row
+# ending before it starts, so PostgreSQL also gets the comparisons until the
+# bookings are known to have none (see detect_range_overlaps).
+class range_overlaps(FunctionElement):
+    inherit_cache = True
+    name = "range_overlaps"
+
+
+use_tsrange = False
+
+
+# Turns the tsrange form on when the bookings carry the CHECK constraint of
+# migration 0006. Called at startup, before any query is compiled.
+async def detect_range_overlaps(engine=engine) -> bool:
+    global use_tsrange
+    if engine.dialect.name != "postgresql":
+        return False
+    async with engine.connect() as conn:
+        use_tsrange = bool(
+            await conn.scalar(
+                text(
+                    "SELECT EXISTS (SELECT 1 FROM pg_constraint"
+                    " WHERE conrelid = to_regclass('bookings')"
+                    " AND conname = 'ck_bookings_time_order')"
+                )
+            )
+        )
+    return use_tsrange
+
+
+@compiles(range_overlaps)
+def _range_overlaps(element, compiler, **kw):
+    start_a, end_a, start_b, end_b = element.clauses
+    return compiler.process(and_(start_a < end_b, end_a > start_b), **kw)
+
+
+@compiles(range_overlaps, "postgresql")
+def _range_overlaps_postgresql(element, compiler, **kw):
+    if not use_tsrange:
+        return _range_overlaps(element, compiler, **kw)
+    start_a, end_a, start_b, end_b = element.clauses
+    return compiler.process(
+        func.tsrange(start_a, end_a).op("&&")(func.tsrange(start_b, end_b)), **kw
+    )
+
+
+# Pool size, saturation and checkout waits, for sizing workers against
+# Postgres max_connections
+def pool_status(engine=engine) -> dict:
+    pool = engine.pool
+    status = {"pool": type(pool).__name__}
+    if isinstance(pool, AsyncAdaptedQueuePool):
+        capacity = pool.size() + max(pool._max_overflow, 0)
+        status.update(
+            size=pool.size(),
+            max_overflow=pool._max_overflow,
+            checked_out=pool.checkedout(),
+            checked_in=pool.checkedin(),
+            overflow=max(pool.overflow(), 0),
+            saturation=pool.checkedout() / capacity if capacity else 0.0,
+        )
+    if isinstance(pool, InstrumentedPool):
+        status.update(
+            checkouts=pool.checkouts,
+            timeouts=pool.timeouts,
+            wait_seconds_total=pool.wait_seconds_total,
+            wait_seconds_max=pool.wait_seconds_max,
+        )
+    return status
@@ -0,0 +1,200 @@
+import hashlib
+import itertools
+import logging
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from email.utils import format_datetime
+from typing import Dict, List, Optional
+
+from fastapi import Request, Response, status
+
+from . import settings
+from .pubsub import broadcast
+
+INVALIDATION_CHANNEL = "versions.bump"
+
+logger = logging.getLogger(__name__)
+
+
+# Version counters for the data behind the cacheable GET endpoints, e.g.
+# "bookings" for the whole table or "bookings:room:5" for one room's
+# bookings. Writers bump them after commit and tell the other processes,
+# so answering a conditional GET rarely needs a round trip at all.
+# With Redis the counters live there, so every worker hands out the same
+# ETag for the same data and a client gets its 304 whichever worker it
+# reaches: a worker reads a key once, then follows the bumps it is sent.
+# Without Redis they are counted per process, under a per-process epoch.
+class Versions:
+    def __init__(self, max_keys: int = 100_000, prefix: str = "booking:versions"):
+        # Tokens restart in a new process, so its ETags never match older ones
+        self.epoch = f"{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.max_keys = max_keys
+        self.prefix = prefix
+        # One sequence for all keys: a key dropped to save memory comes back
+        # with a number no client has seen
+        self._sequence = itertools.count(1)
+        self._versions: Dict[str, int] = {}
+        self._modified: Dict[str, float] = {}
+        # The Redis client the versions were last read from
+        self._shared = None
+
+    def _store(self, key: str, version: int, modified: float):
+        self._versions.pop(key, None)
+        self._versions[key] = version
+        self._modified[key] = modified
+        while len(self._versions) > self.max_keys:
+            oldest = next(iter(self._versions))
+            del self._versions[oldest]
+            del self._modified[oldest]
+
+    def _set(self, key: str, now: float):
+        self._store(key, next(self._sequence), now)
+
+    # Redis keeps the epoch too: it is set once for the deployment, and a
+    # fresh one after the counters are lost
+    async def _share(self, redis):
+        if self._shared is redis:
+            return
+        await redis.set(f"{self.prefix}:epoch", uuid.uuid4().hex[:8], nx=True)
+        self.epoch = await redis.get(f"{self.prefix}:epoch")
+        self._versions.clear()
+        self._modified.clear()
+        self._shared = redis
+
+    async def _entry(self, key: str):
+        now = time.time()
+        redis = broadcast.redis
+        if redis is not None:
+            await self._share(redis)
+            if key not in self._versions:
+                async with redis.pipeline(transaction=False) as pipe:
+                    pipe.hget(self.prefix, key)
+                    # First seen now, by whichever worker asks first
+                    pipe.hsetnx(f"{self.prefix}:modified", key, now)
+                    pipe.hget(f"{self.prefix}:modified", key)
+                    version, _, modified = await pipe.execute()
+                # A bump may have arrived while the values were read
+                if key not in self._versions:
+                    self._store(key, int(version or 0), float(modified))
+        elif key not in self._versions:
+            self._set(key, now)
+        elif now - self._modified[key] > settings.ETAG_TTL:
+            # Without Redis, writes in other processes go unnoticed; roll the
+            # version every ETAG_TTL seconds to bound how stale a 304 can be
+            self._set(key, now)
+        return self._versions[key], self._modified[key]
+
+    async def token(self, key: str) -> str:
+        version, _ = await self._entry(key)
+        return f"{self.epoch}.{version}"
+
+    async def last_modified(self, key: str) -> float:
+        return (await self._entry(key))[1]
+
+    def bump(self, *keys: str):
+        now = time.time()
+        for key in keys:
+            self._set(key, now)
+
+    async def publish(self, *keys: str):
+        if not keys:
+            return
+        redis = broadcast.redis
+        if redis is None:
+            self.bump(*keys)
+            return
+        now = time.time()
+        try:
+            await self._share(redis)
+            async with redis.pipeline(transaction=False) as pipe:
+                for key in keys:
+                    pipe.hincrby(self.prefix, key, 1)
+                pipe.hset(f"{self.prefix}:modified", mapping={key: now for key in keys})
+                *numbers, _ = await pipe.execute()
+        except Exception:
+            # The write is committed already; this worker reads the keys
+            # again, the others may answer 304 until Redis is back
+            logger.exception("Could not bump the versions of %s", ", ".join(keys))
+            for key in keys:
+                self._versions.pop(key, None)
+                self._modified.pop(key, None)
+            return
+        bumped = {key: [number, now] for key, number in zip(keys, numbers)}
+        self._on_remote_bump({"keys": bumped})
+        await broadcast.publish(INVALIDATION_CHANNEL, {"keys": bumped}, local=False)
+
+    # Bumps come with their new versions; an older one arriving late is
+    # ignored
+    def _on_remote_bump(self, message: dict):
+        keys = message.get("keys") or {}
+        for key, (version, modified) in keys.items():
+            if version > self._versions.get(key, 0):
+                self._store(key, version, modified)
+
+
+versions = Versions()
+broadcast.subscribe(INVALIDATION_CHANNEL, versions._on_remote_bump)
+
+
+def office_keys(*office_ids: int) -> List[str]:
+    return ["offices"] + [f"office:{office_id}" for office_id in office_ids]
+
+
+# Room lists depend on the whole table: an update can move a room to
+# another office, and rooms change rarely enough for that to be cheap
+def room_keys(*room_ids: int) -> List[str]:
+    return ["rooms"] + [f"room:{room_id}" for room_id in room_ids]
+
+
+def booking_keys(room_ids=(), booking_ids=()) -> List[str]:
+    return (
+        ["bookings"]
+        + [f"bookings:room:{room_id}" for room_id in set(room_ids)]
+        + [f"booking:{booking_id}" for booking_id in booking_ids]
+    )
+
+
+def _matches(header: str, etag: str) -> bool:
+    if header.strip() == "*":
+        return True
+    opaque = etag.removeprefix("W/")
+    return any(tag.strip().removeprefix("W/") == opaque for tag in header.split(","))
+
+
+# Conditional GET for an endpoint whose response depends only on `keys` and
+# the request URL. Returns a ready 304 when If-None-Match holds the current
+# ETag; otherwise sets the validators on `response` and returns None.
+# Last-Modified is informational: several writes can share a second, so
+# If-Modified-Since alone is not trusted for a 304.
+# Right after a write no validator is handed out for ETAG_SETTLE_SECONDS, so
+# a read served by a lagging replica cannot be cached under the new version.
+# Without the versions (Redis unreachable), no validator is handed out.
+async def check(request: Request, response: Response, *keys: str) -> Optional[Response]:
+    try:
+        tokens = [await versions.token(key) for key in keys]
+        modified = max([await versions.last_modified(key) for key in keys])
+    except Exception:
+        logger.exception("Could not read the versions of %s", ", ".join(keys))
+        return None
+    if time.time() - modified < settings.ETAG_SETTLE_SECONDS:
+        return None
+
+    digest = hashlib.blake2b(
+        "|".join([*tokens, request.url.path, str(request.url.query)]).encode(),
+        digest_size=12,
+    ).hexdigest()
+    etag = f'W/"{digest}"'
+    last_modified = format_datetime(
+        datetime.fromtimestamp(int(modified), timezone.utc), usegmt=True
+    )
+    headers = {"ETag": etag, "Last-Modified": last_modified, "Cache-Control": "no-cache"}
+
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None and _matches(if_none_match, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers=headers)
+
+    response.headers.update(headers)
+    return None
+
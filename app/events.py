@@ -0,0 +1,181 @@
+import asyncio
+import json
+from collections import defaultdict
+from typing import AsyncIterator, Dict, Iterable, List, Optional, Set
+
+from . import settings
+from .pubsub import broadcast
+
+EVENTS_CHANNEL = "bookings.events"
+
+
+# One connected client. Its queue is bounded: the broker never waits for a
+# slow client, and a client that falls QUEUE_SIZE events behind loses them
+# and gets a single "resync" event instead, telling it to reload through
+# GET /bookings/ before it carries on.
+class Subscription:
+    def __init__(self, room_ids: Iterable[int], office_ids: Iterable[int], queue_size: int):
+        self.room_ids = frozenset(room_ids)
+        self.office_ids = frozenset(office_ids)
+        self.queue: asyncio.Queue = asyncio.Queue(max(queue_size, 1))
+        self.dropped = 0
+        self.closed = False
+
+    def offer(self, event: dict) -> bool:
+        try:
+            self.queue.put_nowait(event)
+            return True
+        except asyncio.QueueFull:
+            self.dropped += self.queue.qsize() + 1
+            while not self.queue.empty():
+                self.queue.get_nowait()
+            self.queue.put_nowait({"type": "resync"})
+            return False
+
+    # Events as they come, None after `heartbeat` seconds without any so the
+    # caller can send a keepalive (and notice a client that went away)
+    async def stream(self, heartbeat: float) -> AsyncIterator[Optional[dict]]:
+        while True:
+            try:
+                yield await asyncio.wait_for(self.queue.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield None
+
+
+# In-process fan-out of booking events to the subscriptions of this worker.
+# Events from the other workers come in over the Redis broadcast; each
+# worker only delivers to its own clients.
+class EventBroker:
+    def __init__(self, max_subscribers: int, queue_size: int):
+        self.max_subscribers = max_subscribers
+        self.queue_size = queue_size
+        self._by_room: Dict[int, Set[Subscription]] = defaultdict(set)
+        self._by_office: Dict[int, Set[Subscription]] = defaultdict(set)
+        self.subscribers = 0
+        self.delivered = 0
+        self.overflows = 0
+
+    # None when the worker already serves max_subscribers connections
+    def subscribe(
+        self, room_ids: Iterable[int], office_ids: Iterable[int]
+    ) -> Optional[Subscription]:
+        if self.subscribers >= self.max_subscribers:
+            return None
+        subscription = Subscription(room_ids, office_ids, self.queue_size)
+        for room_id in subscription.room_ids:
+            self._by_room[room_id].add(subscription)
+        for office_id in subscription.office_ids:
+            self._by_office[office_id].add(subscription)
+        self.subscribers += 1
+        return subscription
+
+    def unsubscribe(self, subscription: Subscription):
+        if subscription.closed:
+            return
+        subscription.closed = True
+        for index, keys in (
+            (self._by_room, subscription.room_ids),
+            (self._by_office, subscription.office_ids),
+        ):
+            for key in keys:
+                subscribers = index.get(key)
+                if subscribers is None:
+                    continue
+                subscribers.discard(subscription)
+                if not subscribers:
+                    del index[key]
+        self.subscribers -= 1
+
+    def dispatch(self, event: dict):
+        targets: Set[Subscription] = set()
+        for room_id in event.get("room_ids", ()):
+            targets |= self._by_room.get(room_id, set())
+        for office_id in event.get("office_ids", ()):
+            targets |= self._by_office.get(office_id, set())
+        for subscription in targets:
+            if subscription.offer(event):
+                self.delivered += 1
+            else:
+                self.overflows += 1
+
+    def _on_message(self, message: dict):
+        for event in message.get("events") or []:
+            self.dispatch(event)
+
+    def stats(self) -> dict:
+        return {
+            "subscribers": self.subscribers,
+            "delivered": self.delivered,
+            "overflows": self.overflows,
+        }
+
+
+broker = EventBroker(settings.EVENTS_MAX_SUBSCRIBERS, settings.EVENTS_QUEUE_SIZE)
+broadcast.subscribe(EVENTS_CHANNEL, broker._on_message)
+
+
+# "booking.created", "booking.updated" or "booking.deleted" for each booking
+# (JSON-ready dicts with at least id and room_id), routed to the subscribers
+# of its room and of that room's office. `room_offices` maps room id to
+# office id; `previous_room_ids` (booking id -> room id) lets the
+# subscribers of the room a booking moved away from hear about it as well.
+# One broadcast message per call, however many bookings.
+async def publish(
+    kind: str,
+    bookings: List[dict],
+    room_offices: Dict[int, int],
+    previous_room_ids: Optional[Dict[int, int]] = None,
+):
+    if not settings.EVENTS_ENABLED or not bookings:
+        return
+    events = []
+    for booking in bookings:
+        room_ids = {booking["room_id"]}
+        previous = (previous_room_ids or {}).get(booking["id"])
+        if previous is not None:
+            room_ids.add(previous)
+        events.append(
+            {
+                "type": f"booking.{kind}",
+                "booking": booking,
+                "room_ids": sorted(room_ids),
+                "office_ids": sorted(
+                    {room_offices[room_id] for room_id in room_ids if room_id in room_offices}
+                ),
+            }
+        )
+    await broadcast.publish(EVENTS_CHANNEL, {"events": events})
+
+
+# Server-sent events: one "event:"/"data:" block per event and a comment line
+# as keepalive
+async def sse_stream(subscription: Subscription) -> AsyncIterator[str]:
+    try:
+        yield "retry: 5000\n\n"
+        async for event in subscription.stream(settings.EVENTS_HEARTBEAT_SECONDS):
+            if event is None:
+                yield ": keepalive\n\n"
+            else:
+                data = json.dumps(event, separators=(",", ":"))
+                yield f"event: {event['type']}\ndata: {data}\n\n"
+    finally:
+        broker.unsubscribe(subscription)
+
+
+# WebSocket: events are sent from a task of their own while this one waits
+# for the client to close, so a closed connection is let go at once rather
+# than at the next keepalive. Messages from the client are ignored.
+async def websocket_stream(websocket, subscription: Subscription):
+    async def forward():
+        async for event in subscription.stream(settings.EVENTS_HEARTBEAT_SECONDS):
+            await websocket.send_json(event or {"type": "ping"})
+
+    sender = asyncio.create_task(forward())
+    try:
+        while not sender.done():
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+    finally:
+        sender.cancel()
+        broker.unsubscribe(subscription)
@@ -0,0 +1,97 @@
+import csv
+import io
+import json
+from datetime import datetime
+from typing import AsyncIterator, Optional
+
+from sqlalchemy import union_all
+from sqlalchemy.future import select
+
+from . import settings
+from .database import async_session_maker
+from .models import Booking, BookingArchive, Room
+from .replicas import replica_router
+
+COLUMNS = ("id", "room_id", "office_id", "user_id", "start_time", "end_time", "series_id")
+MEDIA_TYPES = {"ndjson": "application/x-ndjson", "csv": "text/csv"}
+
+
+# Plain columns rather than ORM objects: nothing is tracked by a session and
+# the room's office comes from the join instead of a lazy load per row.
+# Archived months (see app/partitions.py) are read as well, so the export
+# covers the whole history; with a start date after the archive cutoff, the
+# archive side finds nothing to read (PostgreSQL prunes all its partitions).
+def _bookings(
+    model,
+    room_id: Optional[int],
+    user_id: Optional[int],
+    office_id: Optional[int],
+    start: Optional[datetime],
+    end: Optional[datetime],
+):
+    query = select(
+        model.id,
+        model.room_id,
+        Room.office_id,
+        model.user_id,
+        model.start_time,
+        model.end_time,
+        model.series_id,
+    ).outerjoin(Room, Room.id == model.room_id)
+    if room_id is not None:
+        query = query.filter(model.room_id == room_id)
+    if user_id is not None:
+        query = query.filter(model.user_id == user_id)
+    if office_id is not None:
+        query = query.filter(Room.office_id == office_id)
+    if start is not None:
+        query = query.filter(model.start_time >= start)
+    if end is not None:
+        query = query.filter(model.start_time < end)
+    return query
+
+
+def export_query(
+    room_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    office_id: Optional[int] = None,
+    start: Optional[datetime] = None,
+    end: Optional[datetime] = None,
+):
+    filters = (room_id, user_id, office_id, start, end)
+    rows = union_all(_bookings(BookingArchive, *filters), _bookings(Booking, *filters)).subquery()
+    return select(*[rows.c[column] for column in COLUMNS]).order_by(rows.c.start_time, rows.c.id)
+
+
+def _value(value):
+    return value.isoformat() if isinstance(value, datetime) else value
+
+
+def _ndjson(rows) -> str:
+    return "".join(
+        json.dumps(dict(zip(COLUMNS, map(_value, row))), separators=(",", ":")) + "\n"
+        for row in rows
+    )
+
+
+def _csv(rows) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer).writerows([_value(value) for value in row] for row in rows)
+    return buffer.getvalue()
+
+
+# Stream the result through a server-side cursor, one chunk per fetched batch.
+# The session is opened here rather than taken from a dependency: the
+# response body is sent after the endpoint has returned and its
+# dependencies have been closed.
+async def stream_bookings(query, fmt: str) -> AsyncIterator[str]:
+    encode = _csv if fmt == "csv" else _ndjson
+    if fmt == "csv":
+        yield _csv([COLUMNS])
+
+    async with async_session_maker(bind=replica_router.choose()) as db:
+        result = await db.stream(
+            query.execution_options(yield_per=settings.EXPORT_BATCH_SIZE)
+        )
+        async for rows in result.partitions():
+            yield encode(rows)
@@ -1,21 +1,16 @@
 import asyncio
-from sqlalchemy.ext.asyncio import create_async_engine
-from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.future import select
 import sys
 import os
 
 sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
-from database import engine  
-from models import Base 
+from app.database import engine
+from app.migrations import upgrade
 
 # Function to initialize the database
 async def init_db():
-    # Create all tables in the database
-    async with engine.begin() as conn:
-        # Create all tables defined in the Base metadata
-        await conn.run_sync(Base.metadata.create_all)
-    print("Database initialized!")
+    # Apply the migrations not applied yet (app/migrations)
+    applied = await upgrade(engine)
+    print(f"Database initialized! Migrations applied: {', '.join(applied) or 'none'}")
 
 # Run the initialization
 if __name__ == "__main__":
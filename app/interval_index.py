@@ -0,0 +1,201 @@
+import asyncio
+import time
+from bisect import bisect_left, bisect_right
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from .models import Booking
+from .partitions import overlaps
+from .pubsub import broadcast
+from .settings import BOOKING_INDEX_TTL
+
+INVALIDATION_CHANNEL = "booking-index.invalidate"
+
+
+# Intervals of a single room kept sorted by start time.
+# `max_ends[i]` is the latest end among the first i + 1 intervals, which lets
+# an overlap query answer in O(log n) even if legacy rows overlap each other.
+class RoomIntervals:
+    def __init__(self):
+        self.starts: List[datetime] = []
+        self.ends: List[datetime] = []
+        self.ids: List[int] = []
+        self.max_ends: List[datetime] = []
+
+    # Build from rows that are already ordered by start time
+    @classmethod
+    def from_sorted(cls, rows):
+        intervals = cls()
+        for booking_id, start, end in rows:
+            intervals.starts.append(start)
+            intervals.ends.append(end)
+            intervals.ids.append(booking_id)
+            if intervals.max_ends and intervals.max_ends[-1] > end:
+                intervals.max_ends.append(intervals.max_ends[-1])
+            else:
+                intervals.max_ends.append(end)
+        return intervals
+
+    def __len__(self):
+        return len(self.starts)
+
+    def _refresh_max_ends(self, position: int):
+        del self.max_ends[position:]
+        current = self.max_ends[-1] if self.max_ends else None
+        for end in self.ends[position:]:
+            if current is None or end > current:
+                current = end
+            self.max_ends.append(current)
+
+    def add(self, booking_id: int, start: datetime, end: datetime):
+        position = bisect_right(self.starts, start)
+        self.starts.insert(position, start)
+        self.ends.insert(position, end)
+        self.ids.insert(position, booking_id)
+        self._refresh_max_ends(position)
+
+    def remove(self, booking_id: int, start: datetime) -> bool:
+        position = bisect_left(self.starts, start)
+        while position < len(self.starts) and self.starts[position] == start:
+            if self.ids[position] == booking_id:
+                del self.starts[position]
+                del self.ends[position]
+                del self.ids[position]
+                self._refresh_max_ends(position)
+                return True
+            position += 1
+        return False
+
+    # Return the id of an interval overlapping [start, end), if any.
+    # Ids are opaque here; callers may use placeholders for rows not yet inserted.
+    def find_conflict(
+        self, start: datetime, end: datetime, exclude_id: Optional[int] = None
+    ) -> Optional[int]:
+        position = bisect_left(self.starts, end) - 1
+        while position >= 0 and self.max_ends[position] > start:
+            if self.ends[position] > start and (
+                exclude_id is None or self.ids[position] != exclude_id
+            ):
+                return self.ids[position]
+            position -= 1
+        return None
+
+
+# Per-room interval index in front of the overlap query in crud.
+# Rooms are loaded lazily and reloaded after BOOKING_INDEX_TTL seconds. Writers
+# also announce changed rooms to the other worker processes (when Redis is
+# configured), which drop them at once. Without Redis a room may be stale for
+# up to the TTL, so a conflict found here is only a hint: crud confirms it
+# with the database before turning a request away.
+class BookingIntervalIndex:
+    def __init__(self, ttl: float = BOOKING_INDEX_TTL):
+        self.ttl = ttl
+        self._rooms: Dict[int, RoomIntervals] = {}
+        self._loaded_at: Dict[int, float] = {}
+        # Bookings that ended before the floor were not loaded
+        self._floors: Dict[int, datetime] = {}
+        # booking id -> (room id, start time) for every indexed booking
+        self._locations: Dict[int, Tuple[int, datetime]] = {}
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+
+    def _is_fresh(self, room_id: int) -> bool:
+        loaded_at = self._loaded_at.get(room_id)
+        return loaded_at is not None and time.monotonic() - loaded_at < self.ttl
+
+    async def _get_room(self, db: AsyncSession, room_id: int) -> RoomIntervals:
+        if self._is_fresh(room_id):
+            return self._rooms[room_id]
+
+        lock = self._locks.setdefault(room_id, asyncio.Lock())
+        async with lock:
+            if self._is_fresh(room_id):
+                return self._rooms[room_id]
+            floor = datetime.utcnow()
+            result = await db.execute(
+                select(Booking.id, Booking.start_time, Booking.end_time)
+                .filter(Booking.room_id == room_id, overlaps(Booking, floor))
+                .order_by(Booking.start_time)
+            )
+            self._forget_room(room_id)
+            room = RoomIntervals.from_sorted(result.all())
+            for booking_id, start in zip(room.ids, room.starts):
+                self._locations[booking_id] = (room_id, start)
+            self._rooms[room_id] = room
+            self._floors[room_id] = floor
+            self._loaded_at[room_id] = time.monotonic()
+            return self._rooms[room_id]
+
+    async def find_conflict(
+        self,
+        db: AsyncSession,
+        room_id: int,
+        start: datetime,
+        end: datetime,
+        exclude_id: Optional[int] = None,
+    ) -> Optional[int]:
+        room = await self._get_room(db, room_id)
+        if start < self._floors[room_id]:
+            # Older bookings are not indexed, let the database decide
+            return None
+        conflict = room.find_conflict(start, end, exclude_id)
+        if conflict is None:
+            self.misses += 1
+        else:
+            self.hits += 1
+        return conflict
+
+    # Write hooks: only rooms that are already loaded need to be kept current
+    def add(self, room_id: int, booking_id: int, start: datetime, end: datetime):
+        room = self._rooms.get(room_id)
+        if room is not None and end > self._floors[room_id]:
+            room.add(booking_id, start, end)
+            self._locations[booking_id] = (room_id, start)
+
+    def remove(self, booking_id: int):
+        location = self._locations.pop(booking_id, None)
+        if location is None:
+            return
+        room_id, start = location
+        room = self._rooms.get(room_id)
+        if room is not None:
+            room.remove(booking_id, start)
+
+    def _forget_room(self, room_id: int):
+        room = self._rooms.pop(room_id, None)
+        if room is not None:
+            for booking_id in room.ids:
+                self._locations.pop(booking_id, None)
+        self._loaded_at.pop(room_id, None)
+        self._floors.pop(room_id, None)
+
+    def invalidate(self, room_id: Optional[int] = None):
+        if room_id is None:
+            self._rooms.clear()
+            self._loaded_at.clear()
+            self._floors.clear()
+            self._locations.clear()
+        else:
+            self._forget_room(room_id)
+
+    # Tell the other processes to reload these rooms and drop these bookings
+    async def publish_changes(self, *room_ids: int, booking_ids=()):
+        await broadcast.publish(
+            INVALIDATION_CHANNEL,
+            {"room_ids": sorted(set(room_ids)), "booking_ids": list(booking_ids)},
+            local=False,
+        )
+
+    def _on_remote_changes(self, message: dict):
+        for booking_id in message.get("booking_ids") or []:
+            self.remove(booking_id)
+        for room_id in message.get("room_ids") or []:
+            self.invalidate(room_id)
+
+
+booking_index = BookingIntervalIndex()
+broadcast.subscribe(INVALIDATION_CHANNEL, booking_index._on_remote_changes)
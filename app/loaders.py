@@ -0,0 +1,124 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Dict, Hashable, Iterable, Optional, Set
+
+
+def _fail(future: asyncio.Future, error: BaseException):
+    if not future.done():
+        future.set_exception(error)
+        # Marks the error as retrieved, nobody may be waiting for it
+        future.exception()
+
+
+# Concurrent calls with the same key share one execution: the first caller
+# runs `fn`, the others wait for its result. If the first caller is
+# cancelled (client gone), a waiting caller takes over and runs it again.
+class SingleFlight:
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        self.calls += 1
+        while key in self._calls:
+            future = self._calls[key]
+            self.shared += 1
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                if not future.cancelled():
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._calls[key] = future
+        try:
+            result = await fn()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except Exception as e:
+            _fail(future, e)
+            raise
+        else:
+            future.set_result(result)
+            return result
+        finally:
+            if self._calls.get(key) is future:
+                del self._calls[key]
+
+
+# Batches lookups by key: every load() made during one pass of the event loop
+# ends up in a single call of batch_fn(group, keys), which returns a dict of
+# the values found (missing keys load as None). The group, e.g. the engine
+# to read from, keeps lookups that cannot share a query apart. A key that is
+# already being fetched joins that fetch instead of starting another one.
+class DataLoader:
+    def __init__(
+        self,
+        batch_fn: Callable[[Any, list], Awaitable[Dict[Any, Any]]],
+        max_batch: int = 500,
+    ):
+        self.batch_fn = batch_fn
+        self.max_batch = max_batch
+        self._queued: Dict[Any, Dict[Any, asyncio.Future]] = {}
+        self._in_flight: Dict[Any, Dict[Any, asyncio.Future]] = {}
+        self._tasks: Set[asyncio.Task] = set()
+        self._scheduled = False
+        self.loads = 0
+        self.batches = 0
+        self.keys = 0
+
+    async def load(self, group: Any, key: Any) -> Optional[Any]:
+        self.loads += 1
+        future = self._in_flight.get(group, {}).get(key)
+        if future is None:
+            queued = self._queued.setdefault(group, {})
+            future = queued.get(key)
+            if future is None:
+                future = queued[key] = asyncio.get_running_loop().create_future()
+            if not self._scheduled:
+                self._scheduled = True
+                asyncio.get_running_loop().call_soon(self._dispatch)
+        # Shielded: one caller giving up must not cancel the others' lookup
+        return await asyncio.shield(future)
+
+    async def load_many(self, group: Any, keys: Iterable[Any]) -> list:
+        return list(await asyncio.gather(*(self.load(group, key) for key in keys)))
+
+    def _dispatch(self):
+        self._scheduled = False
+        queued, self._queued = self._queued, {}
+        for group, futures in queued.items():
+            keys = list(futures)
+            for start in range(0, len(keys), self.max_batch):
+                batch = {key: futures[key] for key in keys[start : start + self.max_batch]}
+                self._in_flight.setdefault(group, {}).update(batch)
+                task = asyncio.ensure_future(self._run(group, batch))
+                self._tasks.add(task)
+                task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, group: Any, futures: Dict[Any, asyncio.Future]):
+        self.batches += 1
+        self.keys += len(futures)
+        try:
+            values = await self.batch_fn(group, list(futures))
+        except Exception as e:
+            for future in futures.values():
+                _fail(future, e)
+        else:
+            for key, future in futures.items():
+                if not future.done():
+                    future.set_result(values.get(key))
+        finally:
+            in_flight = self._in_flight.get(group, {})
+            for key, future in futures.items():
+                if in_flight.get(key) is future:
+                    del in_flight[key]
+            if not in_flight:
+                self._in_flight.pop(group, None)
+            for future in futures.values():
+                if not future.done():
+                    future.cancel()
+
+    def stats(self) -> dict:
+        return {"loads": self.loads, "batches": self.batches, "keys": self.keys}
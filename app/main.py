@@ -1,19 +1,41 @@
-from fastapi import FastAPI, Depends, HTTPException, status
+from contextlib import asynccontextmanager
+from datetime import date, datetime, timedelta
+from itertools import islice
+from fastapi import FastAPI, Depends, HTTPException, Query, Request, Response, WebSocket, status
+from fastapi.responses import PlainTextResponse, StreamingResponse
 from sqlalchemy.ext.asyncio import AsyncSession
-from fastapi_pagination import Page, paginate
-from app import database, schemas, crud, auth
-from typing import Optional, Union
-from sqlalchemy.future import select
-from fastapi_pagination import add_pagination
-from app.schemas import DeleteResponse
+from app import database, schemas, crud, auth, settings, recurrence, availability, metrics, tracing, export, analytics, etags, serialization, events, shedding
+from typing import List, Literal, Optional, Union
+from app.pagination import CursorParams
+from app.pubsub import broadcast
+from app.replicas import ReadYourWritesMiddleware, get_read_db, replica_router
+from app.schemas import CursorPage, DeleteResponse
 from app.database import get_db
 from app.models import Office, Room, Booking
 from .admin import init_admin
-from app.models import User
-import sentry_sdk
+from app.models import User, get_current_user_record, oauth2_scheme
 from app.settings import SENTRY_DSN
 
-app = FastAPI()
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # Redis links the worker processes for cache and index invalidation
+    if settings.REDIS_URL:
+        await broadcast.connect(settings.REDIS_URL)
+    await database.detect_range_overlaps()
+    replica_router.start()
+    yield
+    await replica_router.stop()
+    await broadcast.disconnect()
+
+
+app = FastAPI(lifespan=lifespan)
+app.add_middleware(ReadYourWritesMiddleware)
+app.add_middleware(tracing.TailSamplingMiddleware)
+# Inside the metrics middleware, so shed requests are counted with their 503
+app.add_middleware(shedding.SheddingMiddleware)
+# Outermost, so its latency covers the other middleware too
+app.add_middleware(metrics.MetricsMiddleware)
+metrics.install_sql_hooks(database.engine, *replica_router.replicas)
 
 # Setup admin panel
 init_admin(app)
@@ -22,79 +44,175 @@ init_admin(app)
 async def create_office(
     office: schemas.OfficeResponseCreate, db: AsyncSession = Depends(database.get_db)
 ):
-
-    query = select(Office).filter(Office.name == office.name)
-    result = await db.execute(query)
-
-    # Fetch all matching offices
-    existing_offices = result.scalars().all()
-
-    if existing_offices:
+    db_office = await crud.create_office(db=db, office=office)
+    if db_office is None:
         # If any office with the same name exists, raise a 409 Conflict error
         raise HTTPException(
             status_code=status.HTTP_409_CONFLICT,
             detail="Office with this name already exists.",
         )
-    return await crud.create_office(db=db, office=office)
+    return db_office
+
+
+def check_ids(ids: List[int]) -> List[int]:
+    if len(ids) > settings.BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BATCH_MAX_IDS} ids per request.",
+        )
+    return ids
 
 
-@app.get("/offices/", response_model=Page[schemas.OfficeResponse])
+# ?ids=1&ids=2 on a list endpoint: the entities found, in the order asked for,
+# as a single page. Lookups of concurrent requests are batched together.
+def id_page(items: list) -> dict:
+    return {"items": items, "size": len(items), "next_cursor": None, "total": None}
+
+
+@app.get("/offices/", response_model=CursorPage[schemas.OfficeResponse])
 async def get_offices(
-    skip: int = 0,
-    limit: int = 100,
+    request: Request,
+    response: Response,
     location: Optional[str] = None,
-    db: AsyncSession = Depends(database.get_db),
+    ids: Optional[List[int]] = Query(None),
+    params: CursorParams = Depends(),
+    db: AsyncSession = Depends(get_read_db),
+    primary: AsyncSession = Depends(get_db),
 ):
-    return paginate(
-        await crud.get_offices(db=db, skip=skip, limit=limit, location=location)
-    )
+    not_modified = await etags.check(request, response, "offices")
+    if not_modified:
+        return not_modified
+    if ids:
+        # Cached, so read from the primary like GET /offices/{office_id}
+        return id_page(await crud.get_offices_by_id(db=primary, office_ids=check_ids(ids)))
+    if settings.FAST_LIST_SERIALIZATION:
+        page = await crud.get_offices(db=db, params=params, location=location, rows=True)
+        return serialization.page_response(page, schemas.OfficeResponse, response)
+    return await crud.get_offices(db=db, params=params, location=location)
+
+
 
 
+def detail_window(start_time: Optional[datetime], end_time: Optional[datetime]):
+    start = schemas.naive_utc(start_time) or datetime.utcnow()
+    end = schemas.naive_utc(end_time) or start + timedelta(days=settings.OFFICE_DETAIL_DAYS)
+    if end <= start:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_time must be after start_time.",
+        )
+    return start, end
 
 
-# Retrieve an office by its ID
+# Several offices with their rooms and booking counts: /offices/detail?ids=1&ids=2
+# Declared before /offices/{office_id} so "detail" is not taken for an id.
+@app.get("/offices/detail", response_model=List[schemas.OfficeDetail])
+async def get_office_details(
+    ids: List[int] = Query(...),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    start, end = detail_window(start_time, end_time)
+    return await crud.get_office_details(
+        db=db, office_ids=check_ids(ids), start=start, end=end
+    )
+
+
+# Retrieve an office by its ID. Cached, and loaded from the primary so that a
+# lagging replica cannot put stale rows into the cache.
 @app.get("/offices/{office_id}", response_model=schemas.OfficeResponse)
-async def get_office(office_id: int, db: AsyncSession = Depends(get_db)) -> Office:
-    query = select(Office).filter(Office.id == office_id)
-    result = await db.execute(query)
-    office = result.scalar_one_or_none()
+async def get_office(
+    office_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)
+):
+    not_modified = await etags.check(request, response, f"office:{office_id}")
+    if not_modified:
+        return not_modified
+    office = await crud.get_office(db=db, office_id=office_id)
     if office is None:
         raise HTTPException(status_code=404, detail="Office not found")
     return office
 
 
+# The office, its rooms and the number of bookings of each room overlapping
+# the window (the next OFFICE_DETAIL_DAYS days by default)
+@app.get("/offices/{office_id}/detail", response_model=schemas.OfficeDetail)
+async def get_office_detail(
+    office_id: int,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    start, end = detail_window(start_time, end_time)
+    details = await crud.get_office_details(
+        db=db, office_ids=[office_id], start=start, end=end
+    )
+    if not details:
+        raise HTTPException(status_code=404, detail="Office not found")
+    return details[0]
+
+
+# Free windows of the office's rooms between start_time and end_time
+@app.get("/offices/{office_id}/availability", response_model=schemas.OfficeAvailability)
+async def get_office_availability(
+    office_id: int,
+    start_time: datetime,
+    end_time: datetime,
+    min_capacity: Optional[int] = None,
+    duration_minutes: Optional[int] = Query(None, ge=1),
+    db: AsyncSession = Depends(get_read_db),
+):
+    start_time, end_time = schemas.naive_utc(start_time), schemas.naive_utc(end_time)
+    if end_time <= start_time:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="end_time must be after start_time.",
+        )
+    if end_time - start_time > timedelta(days=settings.AVAILABILITY_MAX_DAYS):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"The search window is limited to {settings.AVAILABILITY_MAX_DAYS} days.",
+        )
+
+    duration = timedelta(minutes=duration_minutes) if duration_minutes else None
+    result = await availability.get_office_availability(
+        db=db,
+        office_id=office_id,
+        start=start_time,
+        end=end_time,
+        min_capacity=min_capacity,
+        duration=duration,
+    )
+    if result is None:
+        raise HTTPException(status_code=404, detail="Office not found")
+    return result
+
+
 # Update an office by its ID
 @app.put("/offices/{office_id}", response_model=schemas.OfficeResponse)
 async def update_office(
     office_id: int, office: schemas.OfficeResponseCreate, db: AsyncSession = Depends(get_db)
 ):
-    query = select(Office).filter(Office.id == office_id)
-    result = await db.execute(query)
-    db_office = result.scalar_one_or_none()
+    try:
+        db_office = await crud.update_office(db=db, office_id=office_id, office=office)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
 
     if db_office is None:
         raise HTTPException(status_code=404, detail="Office not found")
-
-    db_office.name = office.name
-    db_office.location = office.location
-
-    await db.commit()
-    await db.refresh(db_office)
     return db_office
 
 
 # Delete an office by its ID
 @app.delete("/offices/{office_id}", response_model=DeleteResponse)
 async def delete_office(office_id: int, db: AsyncSession = Depends(get_db)):
-    query = select(Office).filter(Office.id == office_id)
-    result = await db.execute(query)
-    db_office = result.scalar_one_or_none()
+    try:
+        deleted = await crud.delete_office(db=db, office_id=office_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
 
-    if db_office is None:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Office not found")
-
-    await db.delete(db_office)
-    await db.commit()
     return DeleteResponse(message="Office successfully deleted")
 
 
@@ -105,21 +223,41 @@ async def create_room(
     return await crud.create_room(db=db, room=room)
 
 
-@app.get("/rooms/", response_model=Page[schemas.Room])
+@app.get("/rooms/", response_model=CursorPage[schemas.Room])
 async def get_rooms(
+    request: Request,
+    response: Response,
     office_id: Optional[int] = None,
     capacity: Optional[int] = None,
-    db: AsyncSession = Depends(database.get_db),
+    ids: Optional[List[int]] = Query(None),
+    params: CursorParams = Depends(),
+    db: AsyncSession = Depends(get_read_db),
+    primary: AsyncSession = Depends(get_db),
 ):
-    return paginate(await crud.get_rooms(db=db, office_id=office_id, capacity=capacity))
+    not_modified = await etags.check(request, response, "rooms")
+    if not_modified:
+        return not_modified
+    if ids:
+        return id_page(await crud.get_rooms_by_id(db=primary, room_ids=check_ids(ids)))
+    if settings.FAST_LIST_SERIALIZATION:
+        page = await crud.get_rooms(
+            db=db, params=params, office_id=office_id, capacity=capacity, rows=True
+        )
+        return serialization.page_response(page, schemas.Room, response)
+    return await crud.get_rooms(
+        db=db, params=params, office_id=office_id, capacity=capacity
+    )
 
 
-# Retrieve a room by its ID
+# Retrieve a room by its ID (cached, loaded from the primary)
 @app.get("/rooms/{room_id}", response_model=Union[schemas.Room, dict, None])
-async def get_room(room_id: int, db: AsyncSession = Depends(get_db)):
-    query = select(Room).filter(Room.id == room_id)
-    result = await db.execute(query)
-    room = result.scalar_one_or_none()
+async def get_room(
+    room_id: int, request: Request, response: Response, db: AsyncSession = Depends(get_db)
+):
+    not_modified = await etags.check(request, response, f"room:{room_id}")
+    if not_modified:
+        return not_modified
+    room = await crud.get_room(db=db, room_id=room_id)
     if room is None:
         raise HTTPException(status_code=404, detail="Room not found")
     return room
@@ -130,34 +268,22 @@ async def get_room(room_id: int, db: AsyncSession = Depends(get_db)):
 async def update_room(
     room_id: int, room: schemas.RoomCreate, db: AsyncSession = Depends(get_db)
 ):
-    query = select(Room).filter(Room.id == room_id)
-    result = await db.execute(query)
-    db_room = result.scalar_one_or_none()
-
+    db_room = await crud.update_room(db=db, room_id=room_id, room=room)
     if db_room is None:
         raise HTTPException(status_code=404, detail="Room not found")
-
-    db_room.name = room.name
-    db_room.capacity = room.capacity
-    db_room.office_id = room.office_id
-
-    await db.commit()
-    await db.refresh(db_room)
     return db_room
 
 
 # Delete a room by its ID
 @app.delete("/rooms/{room_id}", response_model=DeleteResponse)
 async def delete_room(room_id: int, db: AsyncSession = Depends(get_db)):
-    query = select(Room).filter(Room.id == room_id)
-    result = await db.execute(query)
-    db_room = result.scalar_one_or_none()
+    try:
+        deleted = await crud.delete_room(db=db, room_id=room_id)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_409_CONFLICT, detail=str(e))
 
-    if db_room is None:
+    if not deleted:
         raise HTTPException(status_code=404, detail="Room not found")
-
-    await db.delete(db_room)
-    await db.commit()
     return DeleteResponse(message="Room successfully deleted")
 
 
@@ -172,24 +298,158 @@ async def create_booking(
         raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
 
-@app.get("/bookings/", response_model=Page[schemas.BookingList])
+# All or none: a 409 lists the items that failed when any did
+@app.post("/bookings/bulk", response_model=schemas.BulkBookingResponse)
+async def create_bookings_bulk(
+    bookings: List[schemas.BookingCreate], db: AsyncSession = Depends(database.get_db)
+):
+    if len(bookings) > settings.BULK_BOOKING_MAX_ITEMS:
+        raise HTTPException(
+            status_code=status.HTTP_413_REQUEST_ENTITY_TOO_LARGE,
+            detail=f"At most {settings.BULK_BOOKING_MAX_ITEMS} bookings per request.",
+        )
+    results, created = await crud.create_bookings_bulk(db=db, bookings=bookings)
+    if not created:
+        failed = sum(1 for result in results if result["status"] != "skipped")
+        raise HTTPException(
+            status_code=status.HTTP_409_CONFLICT,
+            detail={"created": 0, "failed": failed, "results": results},
+        )
+    return {"created": len(results), "failed": 0, "results": results}
+
+
+# Bookings by start time. start_time/end_time bound the start time, within
+# [start_time, end_time), and keep the query to the months in range.
+@app.get("/bookings/", response_model=CursorPage[schemas.BookingList])
 async def get_bookings(
+    request: Request,
+    response: Response,
     user_id: Optional[int] = None,
     room_id: Optional[int] = None,
-    db: AsyncSession = Depends(database.get_db),
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+    ids: Optional[List[int]] = Query(None),
+    params: CursorParams = Depends(),
+    db: AsyncSession = Depends(get_read_db),
 ):
-    return paginate(await crud.get_bookings(db=db, user_id=user_id, room_id=room_id))
+    # Polling one room's list only depends on that room's bookings
+    key = f"bookings:room:{room_id}" if room_id else "bookings"
+    not_modified = await etags.check(request, response, key)
+    if not_modified:
+        return not_modified
+    if ids:
+        return id_page(await crud.get_bookings_by_id(db=db, booking_ids=check_ids(ids)))
+    start_time, end_time = schemas.naive_utc(start_time), schemas.naive_utc(end_time)
+    if settings.FAST_LIST_SERIALIZATION:
+        page = await crud.get_bookings(
+            db=db,
+            params=params,
+            user_id=user_id,
+            room_id=room_id,
+            start=start_time,
+            end=end_time,
+            rows=True,
+        )
+        return serialization.page_response(page, schemas.BookingList, response)
+    return await crud.get_bookings(
+        db=db, params=params, user_id=user_id, room_id=room_id, start=start_time, end=end_time
+    )
+
+
+# Stream every matching booking as NDJSON or CSV, oldest first, archived
+# months included. Dates filter on the start time, within [start_time, end_time).
+@app.get("/bookings/export")
+async def export_bookings(
+    format: Literal["ndjson", "csv"] = "ndjson",
+    room_id: Optional[int] = None,
+    user_id: Optional[int] = None,
+    office_id: Optional[int] = None,
+    start_time: Optional[datetime] = None,
+    end_time: Optional[datetime] = None,
+):
+    query = export.export_query(
+        room_id=room_id,
+        user_id=user_id,
+        office_id=office_id,
+        start=schemas.naive_utc(start_time),
+        end=schemas.naive_utc(end_time),
+    )
+    return StreamingResponse(
+        export.stream_bookings(query, format),
+        media_type=export.MEDIA_TYPES[format],
+        headers={"Content-Disposition": f'attachment; filename="bookings.{format}"'},
+    )
+
+
+def subscribe_events(room_ids: List[int], office_ids: List[int]):
+    if not room_ids and not office_ids:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Subscribe to at least one room or office.",
+        )
+    if len(room_ids) + len(office_ids) > settings.BATCH_MAX_IDS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"At most {settings.BATCH_MAX_IDS} rooms and offices per subscription.",
+        )
+    subscription = events.broker.subscribe(room_ids, office_ids)
+    if subscription is None:
+        raise HTTPException(
+            status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+            detail="Too many event subscribers, try again later.",
+            headers={"Retry-After": "5"},
+        )
+    return subscription
+
+
+# Booking created/updated/deleted events of some rooms or whole offices as
+# server-sent events: /bookings/events?room_ids=1&office_ids=2. A "resync"
+# event means events were dropped and the list should be reloaded.
+@app.get("/bookings/events")
+async def booking_events(
+    room_ids: List[int] = Query([]),
+    office_ids: List[int] = Query([]),
+):
+    subscription = subscribe_events(room_ids, office_ids)
+    return StreamingResponse(
+        events.sse_stream(subscription),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# The same events over a WebSocket, one JSON message each, with
+# {"type": "ping"} as keepalive
+@app.websocket("/bookings/events/ws")
+async def booking_events_ws(
+    websocket: WebSocket,
+    room_ids: List[int] = Query([]),
+    office_ids: List[int] = Query([]),
+):
+    try:
+        subscription = subscribe_events(room_ids, office_ids)
+    except HTTPException as e:
+        await websocket.close(code=1013 if e.status_code == 503 else 1008, reason=e.detail)
+        return
+    await websocket.accept()
+    await events.websocket_stream(websocket, subscription)
 
 
 # Retrieve a booking by its ID
 @app.get("/bookings/{booking_id}", response_model=Union[schemas.Booking, dict, None])
-async def get_booking(booking_id: int, db: AsyncSession = Depends(get_db)):
-    query = select(Booking).filter(Booking.id == booking_id)
-    result = await db.execute(query)
-    booking = result.scalar_one_or_none()
+async def get_booking(
+    booking_id: int,
+    request: Request,
+    response: Response,
+    db: AsyncSession = Depends(get_read_db),
+):
+    not_modified = await etags.check(request, response, f"booking:{booking_id}")
+    if not_modified:
+        return not_modified
+    booking = await crud.get_booking(db=db, booking_id=booking_id)
     if booking is None:
         raise HTTPException(status_code=404, detail="Booking not found")
-    return booking
+    return schemas.Booking(**booking)
 
 
 # Update a booking by its ID
@@ -197,62 +457,165 @@ async def get_booking(booking_id: int, db: AsyncSession = Depends(get_db)):
 async def update_booking(
     booking_id: int, booking: schemas.BookingCreate, db: AsyncSession = Depends(get_db)
 ):
-    query = select(Booking).filter(Booking.id == booking_id)
-    result = await db.execute(query)
-    db_booking = result.scalar_one_or_none()
+    try:
+        db_booking = await crud.update_booking(db=db, booking_id=booking_id, booking=booking)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
 
     if db_booking is None:
         raise HTTPException(status_code=404, detail="Booking not found")
-
-    db_booking.room_id = booking.room_id
-    db_booking.user_id = booking.user_id
-    db_booking.start_time = booking.start_time
-    db_booking.end_time = booking.end_time
-
-    await db.commit()
-    await db.refresh(db_booking)
     return db_booking
 
 
 # Delete a booking by its ID
 @app.delete("/bookings/{booking_id}", response_model=DeleteResponse)
 async def delete_booking(booking_id: int, db: AsyncSession = Depends(get_db)):
-    query = select(Booking).filter(Booking.id == booking_id)
-    result = await db.execute(query)
-    db_booking = result.scalar_one_or_none()
-
-    if db_booking is None:
+    if not await crud.delete_booking(db=db, booking_id=booking_id):
         raise HTTPException(status_code=404, detail="Booking not found")
-
-    await db.delete(db_booking)
-    await db.commit()
     return DeleteResponse(message="Booking successfully deleted")
 
 
 
-@app.post("/auth/register", response_model=schemas.User)
-async def register_user(
-    user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)
+@app.post("/recurring-bookings/", response_model=schemas.RecurringBookingCreated)
+async def create_recurring_booking(
+    series: schemas.RecurringBookingCreate, db: AsyncSession = Depends(get_db)
 ):
-    # Check if user already exists
-    query = select(User).filter(User.username == user.username)
-    result = await db.execute(query)
-    existing_user = result.scalars().first()
+    try:
+        db_series, total, materialized = await recurrence.create_series(db=db, data=series)
+    except ValueError as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=str(e))
+
+    response = schemas.RecurringBooking.model_validate(db_series, from_attributes=True)
+    return schemas.RecurringBookingCreated(
+        **response.model_dump(), occurrences=total, materialized=materialized
+    )
+
+
+@app.get("/recurring-bookings/{series_id}", response_model=schemas.RecurringBooking)
+async def get_recurring_booking(series_id: int, db: AsyncSession = Depends(get_read_db)):
+    series = await recurrence.get_series(db=db, series_id=series_id)
+    if series is None:
+        raise HTTPException(status_code=404, detail="Recurring booking not found")
+    return series
+
+
+# Occurrences are expanded on the fly, including those beyond the horizon
+@app.get(
+    "/recurring-bookings/{series_id}/occurrences",
+    response_model=List[schemas.Occurrence],
+)
+async def get_recurring_booking_occurrences(
+    series_id: int,
+    after: Optional[datetime] = None,
+    limit: int = Query(100, ge=1, le=1000),
+    db: AsyncSession = Depends(get_read_db),
+):
+    series = await recurrence.get_series(db=db, series_id=series_id)
+    if series is None:
+        raise HTTPException(status_code=404, detail="Recurring booking not found")
+    occurrences = islice(recurrence.iter_occurrences(series, after=schemas.naive_utc(after)), limit)
+    return [{"start_time": start, "end_time": end} for start, end in occurrences]
+
+
+@app.delete("/recurring-bookings/{series_id}", response_model=DeleteResponse)
+async def delete_recurring_booking(series_id: int, db: AsyncSession = Depends(get_db)):
+    if not await recurrence.delete_series(db=db, series_id=series_id):
+        raise HTTPException(status_code=404, detail="Recurring booking not found")
+    return DeleteResponse(message="Recurring booking successfully deleted")
 
-    if existing_user:
+
+def report_range(start_date: date, end_date: date):
+    if end_date < start_date:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
-            detail="Username already registered",
+            detail="end_date must not be before start_date.",
+        )
+    if (end_date - start_date).days + 1 > settings.ANALYTICS_MAX_DAYS:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail=f"Reports are limited to {settings.ANALYTICS_MAX_DAYS} days.",
         )
 
-    # Hash password before saving
-    hashed_password = auth.hash_password(user.password)
 
-    # Create the user and add to the database
-    new_user = User(username=user.username, hashed_password=hashed_password)
-    db.add(new_user)
-    await db.commit()
+# Booked hours and utilization per day or week, with per-room totals.
+# Both dates are inclusive.
+@app.get(
+    "/analytics/offices/{office_id}/utilization", response_model=schemas.UtilizationReport
+)
+async def get_office_utilization(
+    office_id: int,
+    start_date: date,
+    end_date: date,
+    granularity: Literal["day", "week"] = "day",
+    room_id: Optional[int] = None,
+    db: AsyncSession = Depends(get_read_db),
+):
+    report_range(start_date, end_date)
+    report = await analytics.utilization_report(
+        db=db,
+        office_id=office_id,
+        start=start_date,
+        end=end_date,
+        granularity=granularity,
+        room_id=room_id,
+    )
+    if report is None:
+        raise HTTPException(status_code=404, detail="Office not found")
+    return report
+
+
+@app.get("/analytics/offices/{office_id}/peak-hours", response_model=schemas.PeakHours)
+async def get_office_peak_hours(
+    office_id: int,
+    start_date: date,
+    end_date: date,
+    db: AsyncSession = Depends(get_read_db),
+):
+    report_range(start_date, end_date)
+    report = await analytics.peak_hours(
+        db=db, office_id=office_id, start=start_date, end=end_date
+    )
+    if report is None:
+        raise HTTPException(status_code=404, detail="Office not found")
+    return report
+
+
+# Rooms with the highest share of bookings cancelled before they started
+@app.get(
+    "/analytics/offices/{office_id}/cancellations", response_model=List[schemas.RoomUsage]
+)
+async def get_office_cancellations(
+    office_id: int,
+    start_date: date,
+    end_date: date,
+    min_bookings: int = Query(5, ge=1),
+    limit: int = Query(10, ge=1, le=100),
+    db: AsyncSession = Depends(get_read_db),
+):
+    report_range(start_date, end_date)
+    rooms = await analytics.cancellation_prone_rooms(
+        db=db,
+        office_id=office_id,
+        start=start_date,
+        end=end_date,
+        min_bookings=min_bookings,
+        limit=limit,
+    )
+    if rooms is None:
+        raise HTTPException(status_code=404, detail="Office not found")
+    return rooms
+
 
+@app.post("/auth/register", response_model=schemas.User)
+async def register_user(
+    user: schemas.UserCreate, db: AsyncSession = Depends(database.get_db)
+):
+    new_user = await crud.create_user(db=db, user_create=user)
+    if new_user is None:
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST,
+            detail="Username already registered",
+        )
     return new_user
 
 
@@ -269,10 +632,22 @@ async def login_for_access_token(
             detail="Incorrect username or password",
             headers={"WWW-Authenticate": "Bearer"},
         )
-    access_token = auth.create_access_token(data={"sub": user.id})
+    # JWT requires "sub" to be a string
+    access_token = auth.create_access_token(data={"sub": str(user.id)})
     return {"access_token": access_token, "token_type": "bearer"}
 
 
+@app.get("/auth/me", response_model=schemas.User)
+async def read_current_user(user: schemas.User = Depends(get_current_user_record)):
+    return user
+
+
+@app.post("/auth/logout", response_model=DeleteResponse)
+async def logout(token: str = Depends(oauth2_scheme)):
+    await auth.revoke_token(token)
+    return DeleteResponse(message="Token revoked")
+
+
 # @app.get("/items/")
 # async def read_items(db: AsyncSession = Depends(get_db_session)):
 #     result = await db.execute("SELECT * FROM items")
@@ -280,18 +655,19 @@ async def login_for_access_token(
 #     return {"items": items}
 
 
-add_pagination(app)
+# Sampled tracing, see app/tracing.py and the SENTRY_* settings
+tracing.init_sentry(SENTRY_DSN)
+
+@app.get("/metrics/pool")
+async def get_pool_metrics():
+    return database.pool_status()
+
+
+# Prometheus scrape endpoint
+@app.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def get_metrics():
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
 
-sentry_sdk.init(
-    dsn=SENTRY_DSN,
-    # Set traces_sample_rate to 1.0 to capture 100%
-    # of transactions for tracing.
-    traces_sample_rate=1.0,
-    # Set profiles_sample_rate to 1.0 to profile 100%
-    # of sampled transactions.
-    # We recommend adjusting this value in production.
-    profiles_sample_rate=1.0,
-)
 
 @app.get("/sentry-debug")
 async def trigger_error():
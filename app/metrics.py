@@ -0,0 +1,290 @@
+import logging
+import time
+from collections import Counter
+from contextvars import ContextVar
+from typing import Dict, List, Optional, Tuple
+
+from sqlalchemy import event
+
+from app import settings
+from app.database import InstrumentedPool
+
+debug_logger = logging.getLogger("app.sql.debug")
+
+DEBUG_HEADER = "x-debug-queries"
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+STATEMENT_BUCKETS = (1, 2, 5, 10, 20, 50, 100)
+
+
+# What the database did on behalf of one request
+class RequestStats:
+    __slots__ = ("statements", "db_seconds", "rows", "pool_wait_seconds", "queries")
+
+    def __init__(self, debug: bool = False):
+        self.statements = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.pool_wait_seconds = 0.0
+        # (statement, seconds) of every query, only kept for the debug header
+        self.queries: Optional[List[Tuple[str, float]]] = [] if debug else None
+
+
+current_request: ContextVar[Optional[RequestStats]] = ContextVar(
+    "current_request", default=None
+)
+
+
+class Histogram:
+    __slots__ = ("buckets", "counts", "sum", "count")
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.counts = [0] * len(buckets)
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        for i, bound in enumerate(self.buckets):
+            if value <= bound:
+                self.counts[i] += 1
+                break
+        self.sum += value
+        self.count += 1
+
+
+# Per-route aggregates. Every update happens on the event loop thread (the
+# SQL hooks run in SQLAlchemy's greenlets on that same thread), so plain
+# integers and floats are enough, no locks needed.
+class RouteMetrics:
+    __slots__ = ("latency", "statements", "statements_total", "db_seconds", "rows",
+                 "pool_wait_seconds", "responses")
+
+    def __init__(self):
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.statements = Histogram(STATEMENT_BUCKETS)
+        self.statements_total = 0
+        self.db_seconds = 0.0
+        self.rows = 0
+        self.pool_wait_seconds = 0.0
+        self.responses: Counter = Counter()
+
+
+routes: Dict[Tuple[str, str], RouteMetrics] = {}
+
+
+def record_request(method: str, route: str, status: int, seconds: float, stats: RequestStats):
+    metrics = routes.get((method, route))
+    if metrics is None:
+        metrics = routes[(method, route)] = RouteMetrics()
+    metrics.latency.observe(seconds)
+    metrics.statements.observe(stats.statements)
+    metrics.statements_total += stats.statements
+    metrics.db_seconds += stats.db_seconds
+    metrics.rows += stats.rows
+    metrics.pool_wait_seconds += stats.pool_wait_seconds
+    metrics.responses[status] += 1
+
+
+# The async drivers buffer the whole result of a plain execute, so the row
+# count of a SELECT is known once the statement returns. Server-side cursors
+# (stream / yield_per) are not counted.
+def _row_count(cursor) -> int:
+    rows = getattr(cursor, "_rows", None)
+    if cursor.description is not None and rows is not None:
+        return len(rows)
+    return max(cursor.rowcount or 0, 0)
+
+
+def install_sql_hooks(*engines):
+    for engine in engines:
+
+        @event.listens_for(engine.sync_engine, "before_cursor_execute")
+        def start_timer(conn, cursor, statement, parameters, context, executemany):
+            if current_request.get() is not None:
+                conn.info.setdefault("metrics_started", []).append(time.perf_counter())
+
+        @event.listens_for(engine.sync_engine, "after_cursor_execute")
+        def count_statement(conn, cursor, statement, parameters, context, executemany):
+            stats = current_request.get()
+            if stats is None or not conn.info.get("metrics_started"):
+                return
+            elapsed = time.perf_counter() - conn.info["metrics_started"].pop()
+            stats.statements += 1
+            stats.db_seconds += elapsed
+            stats.rows += _row_count(cursor)
+            if stats.queries is not None:
+                stats.queries.append((" ".join(statement.split()), elapsed))
+
+
+def _record_pool_wait(seconds: float):
+    stats = current_request.get()
+    if stats is not None:
+        stats.pool_wait_seconds += seconds
+
+
+InstrumentedPool.wait_listeners.append(_record_pool_wait)
+
+
+# Statements grouped by text, most repeated first. An N+1 pattern shows up
+# as one statement with a count close to the number of rows listed.
+def query_breakdown(stats: RequestStats, limit: int = 10) -> List[Tuple[int, float, str]]:
+    grouped: Dict[str, List[float]] = {}
+    for statement, seconds in stats.queries or []:
+        grouped.setdefault(statement, []).append(seconds)
+    breakdown = [(len(times), sum(times), statement) for statement, times in grouped.items()]
+    breakdown.sort(key=lambda item: (-item[0], -item[1]))
+    return breakdown[:limit]
+
+
+def _debug_headers(stats: RequestStats) -> List[Tuple[bytes, bytes]]:
+    breakdown = query_breakdown(stats)
+    summary = "; ".join(
+        f"{count}x {seconds * 1000:.1f}ms {statement[:150]}"
+        for count, seconds, statement in breakdown
+    )
+    debug_logger.info(
+        "%d statements, %.1f ms: %s", stats.statements, stats.db_seconds * 1000, summary
+    )
+    return [
+        (b"x-query-count", str(stats.statements).encode()),
+        (b"x-db-time-ms", f"{stats.db_seconds * 1000:.1f}".encode()),
+        (b"x-query-breakdown", summary.encode("latin-1", "replace")),
+    ]
+
+
+# Times every HTTP request and files it, with the SQL counters collected
+# through the context variable, under its route template
+class MetricsMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.METRICS_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        debug = settings.METRICS_DEBUG_HEADER and any(
+            name == DEBUG_HEADER.encode() for name, _ in scope["headers"]
+        )
+        stats = RequestStats(debug)
+        token = current_request.set(stats)
+        status = 500
+        started = time.perf_counter()
+
+        async def send_with_stats(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                if debug:
+                    headers = list(message.get("headers", [])) + _debug_headers(stats)
+                    message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_stats)
+        finally:
+            current_request.reset(token)
+            route = scope.get("route")
+            record_request(
+                scope["method"],
+                route.path if route is not None else "unmatched",
+                status,
+                time.perf_counter() - started,
+                stats,
+            )
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(**labels) -> str:
+    return ",".join(f'{name}="{_escape(value)}"' for name, value in labels.items())
+
+
+def _histogram_lines(name: str, histogram: Histogram, labels: str) -> List[str]:
+    lines = []
+    cumulative = 0
+    for bound, count in zip(histogram.buckets, histogram.counts):
+        cumulative += count
+        lines.append(f'{name}_bucket{{{labels},le="{bound}"}} {cumulative}')
+    lines.append(f'{name}_bucket{{{labels},le="+Inf"}} {histogram.count}')
+    lines.append(f"{name}_sum{{{labels}}} {histogram.sum}")
+    lines.append(f"{name}_count{{{labels}}} {histogram.count}")
+    return lines
+
+
+# Numeric stats of the in-process components, exported as gauges
+def _component_stats() -> Dict[str, dict]:
+    from app.admission import room_locks
+    from app.auth import password_hasher
+    from app.cache import entity_cache
+    from app.crud import booking_loader, office_loader, room_loader
+    from app.database import pool_status
+    from app.events import broker
+    from app.interval_index import booking_index
+    from app.shedding import shedder
+    from app.token_cache import token_cache
+
+    return {
+        "password_hasher": password_hasher.stats(),
+        "token_cache": token_cache.stats(),
+        "entity_cache": entity_cache.stats(),
+        "office_loader": office_loader.stats(),
+        "room_loader": room_loader.stats(),
+        "booking_loader": booking_loader.stats(),
+        "booking_index": {"hits": booking_index.hits, "misses": booking_index.misses},
+        "db_pool": pool_status(),
+        "room_locks": room_locks.stats(),
+        "events": broker.stats(),
+        "shedding": shedder.stats(),
+    }
+
+
+# Everything above in the Prometheus text exposition format
+def render() -> str:
+    families = {
+        "http_request_duration_seconds": ("histogram", "Request latency by route."),
+        "http_responses_total": ("counter", "Responses by route and status code."),
+        "db_statements_per_request": ("histogram", "SQL statements issued per request."),
+        "db_statements_total": ("counter", "SQL statements issued by route."),
+        "db_seconds_total": ("counter", "Time spent in SQL statements by route."),
+        "db_rows_total": ("counter", "Rows returned or affected by route."),
+        "db_pool_wait_seconds_total": ("counter", "Time spent waiting for a pooled connection by route."),
+    }
+    samples: Dict[str, List[str]] = {name: [] for name in families}
+    for (method, route), metrics in sorted(routes.items()):
+        labels = _labels(method=method, route=route)
+        samples["http_request_duration_seconds"] += _histogram_lines(
+            "http_request_duration_seconds", metrics.latency, labels
+        )
+        for status, count in sorted(metrics.responses.items()):
+            samples["http_responses_total"].append(
+                f"http_responses_total{{{labels},status=\"{status}\"}} {count}"
+            )
+        samples["db_statements_per_request"] += _histogram_lines(
+            "db_statements_per_request", metrics.statements, labels
+        )
+        samples["db_statements_total"].append(f"db_statements_total{{{labels}}} {metrics.statements_total}")
+        samples["db_seconds_total"].append(f"db_seconds_total{{{labels}}} {metrics.db_seconds}")
+        samples["db_rows_total"].append(f"db_rows_total{{{labels}}} {metrics.rows}")
+        samples["db_pool_wait_seconds_total"].append(
+            f"db_pool_wait_seconds_total{{{labels}}} {metrics.pool_wait_seconds}"
+        )
+
+    lines = []
+    for name, (kind, description) in families.items():
+        lines.append(f"# HELP {name} {description}")
+        lines.append(f"# TYPE {name} {kind}")
+        lines.extend(samples[name])
+
+    for component, stats in _component_stats().items():
+        for key, value in stats.items():
+            if isinstance(value, bool):
+                value = int(value)
+            if not isinstance(value, (int, float)):
+                continue
+            name = f"{component}_{key}"
+            lines.append(f"# TYPE {name} gauge")
+            lines.append(f"{name} {value}")
+    return "\n".join(lines) + "\n"
@@ -0,0 +1,143 @@
+from contextlib import asynccontextmanager
+from datetime import datetime
+from typing import Dict, List, Optional
+
+from sqlalchemy import Column, DateTime, MetaData, String, Table, delete, func, insert, select
+from sqlalchemy.ext.asyncio import AsyncConnection, AsyncEngine
+
+from . import (
+    v0001_initial,
+    v0002_recurring_bookings,
+    v0003_unique_office_names,
+    v0004_usage_and_archive,
+    v0005_booking_indexes,
+    v0006_booking_time_order,
+)
+
+# Schema changes, applied in order and recorded in schema_migrations. A step
+# is a module vNNNN_name.py with upgrade(conn) and downgrade(conn), run in a
+# transaction of its own unless it sets `transactional = False` (CREATE INDEX
+# CONCURRENTLY cannot run in one); such a step is run with autocommit and
+# must be safe to run again after failing halfway (see ops.py).
+STEPS = [
+    v0001_initial,
+    v0002_recurring_bookings,
+    v0003_unique_office_names,
+    v0004_usage_and_archive,
+    v0005_booking_indexes,
+    v0006_booking_time_order,
+]
+
+# Key of the advisory lock making concurrent deploys migrate one at a time
+MIGRATION_LOCK = 4243
+
+schema_migrations = Table(
+    "schema_migrations",
+    MetaData(),
+    Column("version", String, primary_key=True),
+    Column("name", String, nullable=False),
+    Column("applied_at", DateTime, nullable=False),
+)
+
+
+def version_of(step) -> str:
+    return step.__name__.rsplit(".", 1)[-1][1:].split("_", 1)[0]
+
+
+def name_of(step) -> str:
+    return step.__name__.rsplit(".", 1)[-1].split("_", 1)[1]
+
+
+async def applied_versions(engine: AsyncEngine) -> Dict[str, datetime]:
+    async with engine.begin() as conn:
+        await conn.run_sync(schema_migrations.create, checkfirst=True)
+        result = await conn.execute(
+            select(schema_migrations.c.version, schema_migrations.c.applied_at)
+        )
+        return dict(result.all())
+
+
+@asynccontextmanager
+async def _locked(engine: AsyncEngine):
+    if engine.dialect.name != "postgresql":
+        yield
+        return
+    async with engine.connect() as conn:
+        await conn.execute(select(func.pg_advisory_lock(MIGRATION_LOCK)))
+        await conn.commit()
+        try:
+            yield
+        finally:
+            await conn.execute(select(func.pg_advisory_unlock(MIGRATION_LOCK)))
+            await conn.commit()
+
+
+async def _record(conn: AsyncConnection, step, direction: str):
+    if direction == "upgrade":
+        await conn.execute(
+            insert(schema_migrations).values(
+                version=version_of(step), name=name_of(step), applied_at=datetime.utcnow()
+            )
+        )
+    else:
+        await conn.execute(
+            delete(schema_migrations).where(schema_migrations.c.version == version_of(step))
+        )
+
+
+async def _run(engine: AsyncEngine, step, direction: str):
+    run = getattr(step, direction)
+    if getattr(step, "transactional", True):
+        async with engine.begin() as conn:
+            await run(conn)
+            await _record(conn, step, direction)
+        return
+    async with engine.connect() as conn:
+        await conn.execution_options(isolation_level="AUTOCOMMIT")
+        await run(conn)
+    async with engine.begin() as conn:
+        await _record(conn, step, direction)
+
+
+# Applies the steps not applied yet, up to `target` included (all when None).
+# Returns the versions applied.
+async def upgrade(engine: AsyncEngine, target: Optional[str] = None) -> List[str]:
+    done = []
+    async with _locked(engine):
+        applied = await applied_versions(engine)
+        for step in STEPS:
+            version = version_of(step)
+            if target is not None and version > target:
+                break
+            if version not in applied:
+                await _run(engine, step, "upgrade")
+                done.append(version)
+    return done
+
+
+# Reverts the applied steps newer than `target`, newest first ("0" reverts
+# them all). Returns the versions reverted.
+async def downgrade(engine: AsyncEngine, target: str) -> List[str]:
+    done = []
+    async with _locked(engine):
+        applied = await applied_versions(engine)
+        for step in reversed(STEPS):
+            version = version_of(step)
+            if version <= target:
+                break
+            if version in applied:
+                await _run(engine, step, "downgrade")
+                done.append(version)
+    return done
+
+
+async def status(engine: AsyncEngine) -> List[dict]:
+    applied = await applied_versions(engine)
+    return [
+        {
+            "version": version_of(step),
+            "name": name_of(step),
+            "applied_at": applied.get(version_of(step)),
+        }
+        for step in STEPS
+    ]
@@ -0,0 +1,27 @@
+import asyncio
+import sys
+
+from ..database import engine
+from . import downgrade, status, upgrade
+
+USAGE = "python -m app.migrations [upgrade [VERSION] | downgrade VERSION | status]"
+
+
+async def main(argv):
+    command = argv[0] if argv else "upgrade"
+    if command == "upgrade" and len(argv) <= 2:
+        done = await upgrade(engine, argv[1] if len(argv) == 2 else None)
+        print(f"Applied: {', '.join(done) or 'nothing, up to date'}")
+    elif command == "downgrade" and len(argv) == 2:
+        done = await downgrade(engine, argv[1])
+        print(f"Reverted: {', '.join(done) or 'nothing'}")
+    elif command == "status" and len(argv) == 1:
+        for step in await status(engine):
+            applied = step["applied_at"].isoformat(" ", "seconds") if step["applied_at"] else "pending"
+            print(f"{step['version']}  {step['name']:<24} {applied}")
+    else:
+        raise SystemExit(USAGE)
+
+
+if __name__ == "__main__":
+    asyncio.run(main(sys.argv[1:]))
@@ -0,0 +1,165 @@
+from typing import List
+
+from sqlalchemy import inspect, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# Schema operations for the migration steps. Each one can be run again after
+# it failed halfway or already succeeded, which a step running outside a
+# transaction (CONCURRENTLY) needs, and which lets a database created by
+# create_all adopt the migrations.
+
+
+async def _index_state(conn: AsyncConnection, name: str):
+    result = await conn.execute(
+        text(
+            "SELECT c.relkind, x.indisvalid FROM pg_class c"
+            " JOIN pg_index x ON x.indexrelid = c.oid WHERE c.oid = to_regclass(:name)"
+        ),
+        {"name": name},
+    )
+    return result.one_or_none()
+
+
+async def _partitions(conn: AsyncConnection, table: str) -> List[str]:
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+        ),
+        {"table": table},
+    )
+    return list(result.scalars())
+
+
+# CREATE INDEX without blocking writes on PostgreSQL: CONCURRENTLY, which
+# needs a connection in autocommit mode. A partitioned table cannot be
+# indexed concurrently as a whole, so the parent index is created empty (ON
+# ONLY) and one index per partition is built concurrently and attached.
+# An invalid index left by a failed concurrent build is dropped and redone.
+# `concurrently=False` is for tables nothing writes to during the migration.
+async def create_index(
+    conn: AsyncConnection,
+    name: str,
+    table: str,
+    columns: str,
+    method: str = "btree",
+    concurrently: bool = True,
+):
+    if conn.dialect.name != "postgresql":
+        await conn.execute(text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} ({columns})"))
+        return
+
+    state = await _index_state(conn, name)
+    if state is not None and state.indisvalid:
+        return
+    if state is not None and state.relkind == "i":
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+    if not concurrently:
+        await conn.execute(
+            text(f"CREATE INDEX IF NOT EXISTS {name} ON {table} USING {method} ({columns})")
+        )
+        return
+
+    partitions = await _partitions(conn, table)
+    if not partitions:
+        await conn.execute(
+            text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {name}"
+                f" ON {table} USING {method} ({columns})"
+            )
+        )
+        return
+
+    await conn.execute(
+        text(f"CREATE INDEX IF NOT EXISTS {name} ON ONLY {table} USING {method} ({columns})")
+    )
+    suffix = name.removeprefix(f"ix_{table}_")
+    for partition in partitions:
+        child = f"{partition}_{suffix}"[:63]
+        child_state = await _index_state(conn, child)
+        if child_state is not None and not child_state.indisvalid:
+            await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {child}"))
+        await conn.execute(
+            text(
+                f"CREATE INDEX CONCURRENTLY IF NOT EXISTS {child}"
+                f" ON {partition} USING {method} ({columns})"
+            )
+        )
+        attached = await conn.scalar(
+            text("SELECT EXISTS (SELECT 1 FROM pg_inherits WHERE inhrelid = to_regclass(:child))"),
+            {"child": child},
+        )
+        if not attached:
+            await conn.execute(text(f"ALTER INDEX {name} ATTACH PARTITION {child}"))
+
+
+# DROP INDEX, concurrently where PostgreSQL allows it (not for the index of a
+# partitioned table, which takes its partitions' indexes along)
+async def drop_index(conn: AsyncConnection, name: str):
+    if conn.dialect.name != "postgresql":
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        return
+    state = await _index_state(conn, name)
+    if state is None:
+        return
+    if state.relkind == "I":
+        await conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+    else:
+        await conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {name}"))
+
+
+async def _columns(conn: AsyncConnection, table: str) -> List[str]:
+    return await conn.run_sync(
+        lambda sync_conn: [column["name"] for column in inspect(sync_conn).get_columns(table)]
+    )
+
+
+# ALTER TABLE ADD COLUMN, unless the table has it already
+async def add_column(conn: AsyncConnection, table: str, column: str, definition: str):
+    if column not in await _columns(conn, table):
+        await conn.execute(text(f"ALTER TABLE {table} ADD COLUMN {column} {definition}"))
+
+
+async def drop_column(conn: AsyncConnection, table: str, column: str):
+    if column in await _columns(conn, table):
+        await conn.execute(text(f"ALTER TABLE {table} DROP COLUMN {column}"))
+
+
+async def index_is_unique(conn: AsyncConnection, table: str, name: str) -> bool:
+    indexes = await conn.run_sync(lambda sync_conn: inspect(sync_conn).get_indexes(table))
+    return any(index["name"] == name and index["unique"] for index in indexes)
+
+
+async def _check_constraints(conn: AsyncConnection, table: str) -> List[str]:
+    return await conn.run_sync(
+        lambda sync_conn: [
+            check["name"] for check in inspect(sync_conn).get_check_constraints(table)
+        ]
+    )
+
+
+# ALTER TABLE ADD CONSTRAINT ... CHECK, unless the table has it already. SQLite
+# cannot add constraints to an existing table; it is left without.
+async def add_check(conn: AsyncConnection, table: str, name: str, condition: str):
+    if conn.dialect.name == "sqlite" or name in await _check_constraints(conn, table):
+        return
+    await conn.execute(text(f"ALTER TABLE {table} ADD CONSTRAINT {name} CHECK ({condition})"))
+
+
+async def drop_check(conn: AsyncConnection, table: str, name: str):
+    if conn.dialect.name == "sqlite" or name not in await _check_constraints(conn, table):
+        return
+    await conn.execute(text(f"ALTER TABLE {table} DROP CONSTRAINT {name}"))
+
+
+# The baseline stored bookings without checking their times: those ending
+# before they start get the two swapped. tsrange(start_time, end_time), in
+# the GiST index and the overlap predicate, raises on them.
+async def order_booking_times(conn: AsyncConnection):
+    await conn.execute(
+        text(
+            "UPDATE bookings SET start_time = end_time, end_time = start_time"
+            " WHERE end_time < start_time"
+        )
+    )
@@ -0,0 +1,47 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# The schema as it was before there were migrations, frozen here: later model
+# changes are steps of their own, so that they also reach a database created
+# back then. Tables that already exist (such a database) are left as they are.
+metadata = MetaData()
+
+Table(
+    "offices",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, index=True, nullable=False),
+    Column("location", String, index=True, nullable=False),
+)
+Table(
+    "rooms",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("name", String, nullable=False),
+    Column("capacity", Integer, nullable=True),
+    Column("office_id", Integer, ForeignKey("offices.id")),
+)
+Table(
+    "bookings",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("room_id", Integer, ForeignKey("rooms.id")),
+    Column("user_id", Integer, nullable=False),
+    Column("start_time", DateTime, nullable=False),
+    Column("end_time", DateTime, nullable=False),
+)
+Table(
+    "users",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("username", String, unique=True, index=True),
+    Column("hashed_password", String),
+)
+
+
+async def upgrade(conn: AsyncConnection):
+    await conn.run_sync(metadata.create_all)
+
+
+async def downgrade(conn: AsyncConnection):
+    await conn.run_sync(metadata.drop_all)
@@ -0,0 +1,40 @@
+from sqlalchemy import Column, DateTime, ForeignKey, Integer, MetaData, String, Table
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .ops import add_column, drop_column
+
+# Recurring series, and the link from a booking to the series it belongs to
+metadata = MetaData()
+
+# Only what the foreign key below needs to know; the table exists already
+Table("rooms", metadata, Column("id", Integer, primary_key=True))
+
+recurring_bookings = Table(
+    "recurring_bookings",
+    metadata,
+    Column("id", Integer, primary_key=True, index=True),
+    Column("room_id", Integer, ForeignKey("rooms.id"), index=True),
+    Column("user_id", Integer, nullable=False),
+    Column("start_time", DateTime, nullable=False),
+    Column("end_time", DateTime, nullable=False),
+    Column("frequency", String, nullable=False),
+    Column("interval", Integer, nullable=False, default=1),
+    Column("count", Integer, nullable=True),
+    Column("until", DateTime, nullable=True),
+    Column("weekdays", String, nullable=True),
+    Column("materialized_until", DateTime, nullable=True),
+    Column("skipped_occurrences", Integer, nullable=False, default=0),
+)
+
+
+async def upgrade(conn: AsyncConnection):
+    await conn.run_sync(recurring_bookings.create, checkfirst=True)
+    # SQLite cannot drop a column that has a foreign key, and does not
+    # enforce them by default anyway: the constraint is PostgreSQL's only
+    references = " REFERENCES recurring_bookings (id)" if conn.dialect.name == "postgresql" else ""
+    await add_column(conn, "bookings", "series_id", f"INTEGER{references}")
+
+
+async def downgrade(conn: AsyncConnection):
+    await drop_column(conn, "bookings", "series_id")
+    await conn.run_sync(recurring_bookings.drop, checkfirst=True)
@@ -0,0 +1,28 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .ops import index_is_unique
+
+# Office names become unique: create_office settles concurrent creates of
+# one name with ON CONFLICT (name), which needs the unique index. Offices
+# sharing a name keep their rows and rooms; all but the oldest get their id
+# appended to the name, so the index can be built.
+
+
+async def upgrade(conn: AsyncConnection):
+    if await index_is_unique(conn, "offices", "ix_offices_name"):
+        return
+    await conn.execute(
+        text(
+            "UPDATE offices SET name = name || ' (' || CAST(id AS VARCHAR) || ')'"
+            " WHERE EXISTS (SELECT 1 FROM offices AS older"
+            " WHERE older.name = offices.name AND older.id < offices.id)"
+        )
+    )
+    await conn.execute(text("DROP INDEX IF EXISTS ix_offices_name"))
+    await conn.execute(text("CREATE UNIQUE INDEX ix_offices_name ON offices (name)"))
+
+
+async def downgrade(conn: AsyncConnection):
+    await conn.execute(text("DROP INDEX IF EXISTS ix_offices_name"))
+    await conn.execute(text("CREATE INDEX ix_offices_name ON offices (name)"))
@@ -0,0 +1,45 @@
+from sqlalchemy import Column, Date, DateTime, Index, Integer, MetaData, Table
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+# The analytics rollups (app/analytics.py) and the archive of past bookings
+# (app/partitions.py). New and empty, so their indexes are built with them.
+metadata = MetaData()
+
+Table(
+    "room_usage_daily",
+    metadata,
+    Column("room_id", Integer, primary_key=True),
+    Column("day", Date, primary_key=True),
+    Column("booked_seconds", Integer, nullable=False, default=0),
+    Column("bookings", Integer, nullable=False, default=0),
+    Column("cancellations", Integer, nullable=False, default=0),
+)
+Table(
+    "room_usage_hourly",
+    metadata,
+    Column("room_id", Integer, primary_key=True),
+    Column("day", Date, primary_key=True),
+    Column("hour", Integer, primary_key=True),
+    Column("booked_seconds", Integer, nullable=False, default=0),
+)
+Table(
+    "bookings_archive",
+    metadata,
+    Column("id", Integer, primary_key=True, autoincrement=False),
+    Column("room_id", Integer, nullable=True),
+    Column("user_id", Integer, nullable=False),
+    Column("start_time", DateTime, primary_key=True),
+    Column("end_time", DateTime, nullable=False),
+    Column("series_id", Integer, nullable=True),
+    Index("ix_bookings_archive_start_time_id", "start_time", "id"),
+    Index("ix_bookings_archive_room_id_start_time_end_time", "room_id", "start_time", "end_time"),
+    Index("ix_bookings_archive_user_id_start_time_id", "user_id", "start_time", "id"),
+)
+
+
+async def upgrade(conn: AsyncConnection):
+    await conn.run_sync(metadata.create_all)
+
+
+async def downgrade(conn: AsyncConnection):
+    await conn.run_sync(metadata.drop_all)
@@ -0,0 +1,41 @@
+from sqlalchemy import text
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .ops import create_index, drop_index, order_booking_times
+
+# Indexes for the booking queries of crud.py, built without blocking writes
+transactional = False
+
+BOOKING_INDEXES = [
+    # Sort key of the keyset-paginated /bookings/ listing
+    ("ix_bookings_start_time_id", "start_time, id"),
+    # Overlap checks of a room (room_id = ? AND start_time in a bounded range
+    # AND end_time > ?), the room's listing and its free windows
+    ("ix_bookings_room_id_start_time_end_time", "room_id, start_time, end_time"),
+    # GET /bookings/?user_id=, in keyset order
+    ("ix_bookings_user_id_start_time_id", "user_id, start_time, id"),
+    # Occurrences of a series, deleted from a point in time on
+    ("ix_bookings_series_id_start_time", "series_id, start_time"),
+]
+# PostgreSQL: the overlap check as the planner sees it there,
+# tsrange(start_time, end_time) && tsrange(?, ?) for one room
+# (database.range_overlaps). btree_gist lets room_id share the index.
+GIST_INDEX = ("ix_bookings_room_id_during", "room_id, tsrange(start_time, end_time)")
+
+
+async def upgrade(conn: AsyncConnection):
+    for name, columns in BOOKING_INDEXES:
+        await create_index(conn, name, "bookings", columns)
+    if conn.dialect.name == "postgresql":
+        # The GiST build fails on a row ending before it starts
+        await order_booking_times(conn)
+        await conn.execute(text("CREATE EXTENSION IF NOT EXISTS btree_gist"))
+        name, columns = GIST_INDEX
+        await create_index(conn, name, "bookings", columns, method="gist")
+
+
+async def downgrade(conn: AsyncConnection):
+    if conn.dialect.name == "postgresql":
+        await drop_index(conn, GIST_INDEX[0])
+    for name, _ in BOOKING_INDEXES:
+        await drop_index(conn, name)
@@ -0,0 +1,18 @@
+from sqlalchemy.ext.asyncio import AsyncConnection
+
+from .ops import add_check, drop_check, order_booking_times
+
+# Bookings may no longer end before they start; those stored so far are
+# fixed first, as 0005 does before its GiST build. Once the constraint is in
+# place, database.range_overlaps uses tsrange on PostgreSQL (see
+# database.detect_range_overlaps).
+CHECK = ("ck_bookings_time_order", "start_time <= end_time")
+
+
+async def upgrade(conn: AsyncConnection):
+    await order_booking_times(conn)
+    await add_check(conn, "bookings", *CHECK)
+
+
+async def downgrade(conn: AsyncConnection):
+    await drop_check(conn, "bookings", CHECK[0])
@@ -1,8 +1,10 @@
-from sqlalchemy import Column, Integer, String, ForeignKey, DateTime
+from sqlalchemy import CheckConstraint, Column, Integer, String, ForeignKey, Date, DateTime, Index
 from sqlalchemy.orm import declarative_base
 from sqlalchemy.orm import relationship
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
+from sqlalchemy.ext.asyncio import AsyncSession
+from .database import get_db
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="login")
 
@@ -13,7 +15,7 @@ class Office(Base):
     __tablename__ = "offices"  # The name of the table in the database
 
     id = Column(Integer, primary_key=True, index=True)  # Primary key column
-    name = Column(String, index=True, nullable=False)
+    name = Column(String, unique=True, index=True, nullable=False)
     location = Column(String, index=True, nullable=False)
     rooms = relationship("Room", back_populates="office")
 
@@ -35,8 +37,85 @@ class Booking(Base):
     user_id = Column(Integer, nullable=False)
     start_time = Column(DateTime, nullable=False)
     end_time = Column(DateTime, nullable=False)
+    # Set when the booking is an occurrence of a recurring series
+    series_id = Column(Integer, ForeignKey("recurring_bookings.id"), nullable=True)
     room = relationship("Room", back_populates="bookings")
 
+    # Built by app/migrations on existing databases, together with a GiST
+    # index on (room_id, tsrange(start_time, end_time)) on PostgreSQL
+    __table_args__ = (
+        # Sort key of the keyset-paginated /bookings/ listing
+        Index("ix_bookings_start_time_id", "start_time", "id"),
+        # Overlap checks of a room, and its listing
+        Index("ix_bookings_room_id_start_time_end_time", "room_id", "start_time", "end_time"),
+        # One user's listing, in keyset order
+        Index("ix_bookings_user_id_start_time_id", "user_id", "start_time", "id"),
+        # Occurrences of a series
+        Index("ix_bookings_series_id_start_time", "series_id", "start_time"),
+        # tsrange(start_time, end_time) raises otherwise (migration 0006)
+        CheckConstraint("start_time <= end_time", name="ck_bookings_time_order"),
+    )
+
+
+# Bookings of past months moved out of the bookings table by
+# app/partitions.py; read by the export only. No foreign keys: history may
+# outlive a deleted room or series.
+class BookingArchive(Base):
+    __tablename__ = "bookings_archive"
+    id = Column(Integer, primary_key=True, autoincrement=False)
+    room_id = Column(Integer, nullable=True)
+    user_id = Column(Integer, nullable=False)
+    start_time = Column(DateTime, primary_key=True)
+    end_time = Column(DateTime, nullable=False)
+    series_id = Column(Integer, nullable=True)
+
+    __table_args__ = (
+        Index("ix_bookings_archive_start_time_id", "start_time", "id"),
+        # Same columns as the indexes of bookings, so the partitions moved
+        # over on PostgreSQL bring theirs along
+        Index("ix_bookings_archive_room_id_start_time_end_time", "room_id", "start_time", "end_time"),
+        Index("ix_bookings_archive_user_id_start_time_id", "user_id", "start_time", "id"),
+    )
+
+
+class RecurringBooking(Base):
+    __tablename__ = "recurring_bookings"
+    id = Column(Integer, primary_key=True, index=True)
+    room_id = Column(Integer, ForeignKey("rooms.id"), index=True)
+    user_id = Column(Integer, nullable=False)
+    # First occurrence; later ones keep the same duration
+    start_time = Column(DateTime, nullable=False)
+    end_time = Column(DateTime, nullable=False)
+    frequency = Column(String, nullable=False)  # daily, weekly or monthly
+    interval = Column(Integer, nullable=False, default=1)
+    count = Column(Integer, nullable=True)
+    until = Column(DateTime, nullable=True)
+    weekdays = Column(String, nullable=True)  # comma separated, 0 = Monday
+    # Occurrences starting before this point exist as Booking rows
+    materialized_until = Column(DateTime, nullable=True)
+    skipped_occurrences = Column(Integer, nullable=False, default=0)
+
+
+# Analytics rollups, kept current by the booking write paths (app/analytics.py).
+# No foreign key to rooms: rollups may outlive a deleted room.
+class RoomUsageDaily(Base):
+    __tablename__ = "room_usage_daily"
+    room_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    booked_seconds = Column(Integer, nullable=False, default=0)
+    # Bookings starting on this day
+    bookings = Column(Integer, nullable=False, default=0)
+    # Bookings of this day deleted before they started
+    cancellations = Column(Integer, nullable=False, default=0)
+
+
+class RoomUsageHourly(Base):
+    __tablename__ = "room_usage_hourly"
+    room_id = Column(Integer, primary_key=True)
+    day = Column(Date, primary_key=True)
+    hour = Column(Integer, primary_key=True)  # 0-23, UTC
+    booked_seconds = Column(Integer, nullable=False, default=0)
+
 
 class User(Base):
     __tablename__ = "users"
@@ -46,12 +125,35 @@ class User(Base):
 
 
 def get_current_user(token: str = Depends(oauth2_scheme)):
-    from .auth import verify_token
+    from .auth import get_token_entry
 
-    payload = verify_token(token)
-    user_id: int = payload.get("sub")
+    payload = get_token_entry(token)["claims"]
+    user_id = payload.get("sub")
     if user_id is None:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
         )
-    return user_id
+    return int(user_id)
+
+
+# Resolve the authenticated user; cached next to the token's claims
+async def get_current_user_record(
+    token: str = Depends(oauth2_scheme), db: AsyncSession = Depends(get_db)
+):
+    from .auth import get_token_entry
+    from .schemas import User as UserSchema
+    from .token_cache import token_cache
+
+    entry = get_token_entry(token)
+    if entry["user"] is not None:
+        return entry["user"]
+
+    user_id = entry["claims"].get("sub")
+    user = await db.get(User, int(user_id)) if user_id is not None else None
+    if user is None:
+        raise HTTPException(
+            status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid token"
+        )
+    resolved = UserSchema(id=user.id, username=user.username)
+    token_cache.set_user(token, resolved)
+    return resolved
@@ -0,0 +1,103 @@
+import base64
+import json
+from datetime import datetime
+from typing import Optional, Sequence
+
+from fastapi import HTTPException, Query, status
+from sqlalchemy import func, select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
+
+DEFAULT_PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+# Query parameters shared by every keyset-paginated list endpoint
+class CursorParams:
+    def __init__(
+        self,
+        cursor: Optional[str] = None,
+        size: int = Query(DEFAULT_PAGE_SIZE, ge=1, le=MAX_PAGE_SIZE),
+        include_total: bool = False,
+    ):
+        self.cursor = cursor
+        self.size = size
+        self.include_total = include_total
+
+
+# Cursors are opaque to clients: base64 of the sort-key values of the last row
+def encode_cursor(values: Sequence) -> str:
+    payload = [v.isoformat() if isinstance(v, datetime) else v for v in values]
+    raw = json.dumps(payload, separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str, columns: Sequence) -> list:
+    try:
+        padded = cursor + "=" * (-len(cursor) % 4)
+        payload = json.loads(base64.urlsafe_b64decode(padded.encode()))
+        if not isinstance(payload, list) or len(payload) != len(columns):
+            raise ValueError
+        values = []
+        for column, value in zip(columns, payload):
+            if column.type.python_type is datetime:
+                values.append(datetime.fromisoformat(value))
+            else:
+                values.append(column.type.python_type(value))
+        return values
+    except (ValueError, TypeError):
+        raise HTTPException(
+            status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor"
+        )
+
+
+# Row estimate from the planner instead of a COUNT(*) over the whole filter
+async def estimate_count(db: AsyncSession, query) -> int:
+    dialect = db.bind.dialect
+    if dialect.name != "postgresql":
+        count_query = select(func.count()).select_from(query.order_by(None).subquery())
+        return (await db.execute(count_query)).scalar_one()
+
+    compiled = query.order_by(None).compile(
+        dialect=dialect, compile_kwargs={"literal_binds": True}
+    )
+    conn = await db.connection()
+    result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {compiled}")
+    plan = result.scalar()
+    if isinstance(plan, str):
+        plan = json.loads(plan)
+    return int(plan[0]["Plan"]["Plan Rows"])
+
+
+# Fetch one page of `query` ordered by `keys`, resuming after the cursor.
+# Only `size + 1` rows are read, so deep pages cost the same as the first one.
+# Items are ORM objects, or result rows with scalars=False for a query that
+# selects columns (the key columns must be among them).
+async def paginate_keyset(
+    db: AsyncSession, query, keys: Sequence, params: CursorParams, scalars: bool = True
+) -> dict:
+    total = await estimate_count(db, query) if params.include_total else None
+
+    page_query = query
+    if params.cursor:
+        values = decode_cursor(params.cursor, keys)
+        if len(keys) == 1:
+            page_query = page_query.filter(keys[0] > values[0])
+        else:
+            page_query = page_query.filter(tuple_(*keys) > tuple_(*values))
+    page_query = page_query.order_by(*keys).limit(params.size + 1)
+
+    result = await db.execute(page_query)
+    items = result.scalars().all() if scalars else result.all()
+
+    next_cursor = None
+    if len(items) > params.size:
+        items = items[: params.size]
+        last = items[-1]
+        next_cursor = encode_cursor([getattr(last, key.key) for key in keys])
+
+    return {
+        "items": items,
+        "size": params.size,
+        "next_cursor": next_cursor,
+        "total": total,
+    }
@@ -0,0 +1,339 @@
+import asyncio
+from datetime import date, datetime, timedelta
+from typing import List, Optional, Set
+
+from sqlalchemy import and_, delete, func, insert, text
+from sqlalchemy.ext.asyncio import AsyncConnection
+from sqlalchemy.future import select
+
+from . import settings
+from .database import range_overlaps
+from .models import Booking, BookingArchive
+
+BOOKINGS = "bookings"
+ARCHIVE = "bookings_archive"
+COLUMNS = ("id", "room_id", "user_id", "start_time", "end_time", "series_id")
+
+
+def max_duration() -> Optional[timedelta]:
+    if settings.BOOKING_MAX_DAYS <= 0:
+        return None
+    return timedelta(days=settings.BOOKING_MAX_DAYS)
+
+
+def check_duration(start_time: datetime, end_time: datetime):
+    if end_time <= start_time:
+        raise ValueError("end_time must be after start_time.")
+    limit = max_duration()
+    if limit is not None and end_time - start_time > limit:
+        raise ValueError(f"A booking can last at most {settings.BOOKING_MAX_DAYS} days.")
+
+
+# Condition matching the rows of `model` that overlap [start, end) (no upper
+# bound when `end` is None). Bookings cannot last longer than max_duration(),
+# so one overlapping `start` began less than that before it: that lower
+# bound on the partition key lets the planner skip older months entirely.
+def overlaps(model, start: datetime, end: Optional[datetime] = None):
+    if end is None:
+        conditions = [model.end_time > start]
+    else:
+        conditions = [range_overlaps(model.start_time, model.end_time, start, end)]
+    limit = max_duration()
+    if limit is not None:
+        conditions.append(model.start_time > start - limit)
+    return and_(*conditions)
+
+
+def month_start(day: date) -> date:
+    return date(day.year, day.month, 1)
+
+
+def add_months(month: date, months: int) -> date:
+    index = month.year * 12 + month.month - 1 + months
+    return date(index // 12, index % 12 + 1, 1)
+
+
+def partition_name(table: str, month: date) -> str:
+    return f"{table}_{month:%Y_%m}"
+
+
+def _bounds(month: date) -> str:
+    return f"FOR VALUES FROM ('{month.isoformat()}') TO ('{add_months(month, 1).isoformat()}')"
+
+
+def archive_cutoff(today: Optional[date] = None) -> Optional[date]:
+    if settings.BOOKING_ARCHIVE_AFTER_MONTHS <= 0:
+        return None
+    today = today or datetime.utcnow().date()
+    return add_months(month_start(today), -settings.BOOKING_ARCHIVE_AFTER_MONTHS)
+
+
+# PostgreSQL: bookings and bookings_archive are both partitioned by month of
+# start_time. Creating a month and archiving one are catalog operations
+# (CREATE/ATTACH/DETACH), no rows are copied, and an index or a query only
+# ever touches the months it needs, so the current months stay small however
+# much history is kept. A default partition catches bookings beyond the
+# months created so far; they move to their own month when it is created.
+# Other databases keep plain tables and archiving moves rows.
+
+
+async def _exists(conn: AsyncConnection, name: str) -> bool:
+    return await conn.scalar(text("SELECT to_regclass(:name) IS NOT NULL"), {"name": name})
+
+
+async def is_partitioned(conn: AsyncConnection, table: str) -> bool:
+    return await conn.scalar(
+        text(
+            "SELECT EXISTS (SELECT 1 FROM pg_partitioned_table"
+            " WHERE partrelid = to_regclass(:table))"
+        ),
+        {"table": table},
+    )
+
+
+async def partitions(conn: AsyncConnection, table: str) -> List[str]:
+    result = await conn.execute(
+        text(
+            "SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid"
+            " WHERE i.inhparent = to_regclass(:table) ORDER BY c.relname"
+        ),
+        {"table": table},
+    )
+    return list(result.scalars())
+
+
+# Months of a table's partitions, default partition left out
+async def partition_months(conn: AsyncConnection, table: str) -> List[date]:
+    months = []
+    for name in await partitions(conn, table):
+        suffix = name[len(table) + 1 :]
+        try:
+            months.append(datetime.strptime(suffix, "%Y_%m").date())
+        except ValueError:
+            continue
+    return months
+
+
+async def create_partition(conn: AsyncConnection, table: str, month: date) -> bool:
+    name = partition_name(table, month)
+    if await _exists(conn, name):
+        return False
+    default = f"{table}_default"
+    if not await _exists(conn, default):
+        await conn.execute(text(f"CREATE TABLE {name} PARTITION OF {table} {_bounds(month)}"))
+        return True
+
+    # Bookings of this month may sit in the default partition; attaching the
+    # month fails while they do, so they move over first
+    low, high = month, add_months(month, 1)
+    within = "start_time >= :low AND start_time < :high"
+    # Attaching needs the CHECK constraints of the parent
+    await conn.execute(
+        text(f"CREATE TABLE {name} (LIKE {table} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)")
+    )
+    await conn.execute(
+        text(f"INSERT INTO {name} SELECT * FROM {default} WHERE {within}"),
+        {"low": low, "high": high},
+    )
+    await conn.execute(text(f"DELETE FROM {default} WHERE {within}"), {"low": low, "high": high})
+    await conn.execute(text(f"ALTER TABLE {table} ATTACH PARTITION {name} {_bounds(month)}"))
+    return True
+
+
+# Turns a plain table into one partitioned by month, keeping its rows,
+# indexes, foreign keys and id sequence. The primary key becomes
+# (id, start_time): a unique constraint must include the partition key.
+async def partition_table(conn: AsyncConnection, table: str, default: bool) -> bool:
+    if await is_partitioned(conn, table):
+        return False
+    legacy = f"{table}_unpartitioned"
+    await conn.execute(text(f"LOCK TABLE {table} IN ACCESS EXCLUSIVE MODE"))
+
+    indexes = await conn.execute(
+        text(
+            "SELECT i.relname, pg_get_indexdef(i.oid), x.indisprimary FROM pg_index x"
+            " JOIN pg_class i ON i.oid = x.indexrelid WHERE x.indrelid = to_regclass(:table)"
+        ),
+        {"table": table},
+    )
+    indexes = indexes.all()
+    foreign_keys = await conn.execute(
+        text(
+            "SELECT pg_get_constraintdef(oid) FROM pg_constraint"
+            " WHERE conrelid = to_regclass(:table) AND contype = 'f'"
+        ),
+        {"table": table},
+    )
+    foreign_keys = list(foreign_keys.scalars())
+    sequence = await conn.scalar(
+        text("SELECT pg_get_serial_sequence(:table, 'id')"), {"table": table}
+    )
+
+    await conn.execute(text(f"ALTER TABLE {table} RENAME TO {legacy}"))
+    for name, _, _ in indexes:
+        await conn.execute(text(f"ALTER INDEX {name} RENAME TO {name}_unpartitioned"))
+    await conn.execute(
+        text(
+            f"CREATE TABLE {table} (LIKE {legacy} INCLUDING DEFAULTS INCLUDING CONSTRAINTS)"
+            " PARTITION BY RANGE (start_time)"
+        )
+    )
+
+    # The live table gets every month from its first booking to the months
+    # ahead; the archive only the months it holds, later ones come attached
+    starts = await conn.execute(
+        text(f"SELECT DISTINCT date_trunc('month', start_time) FROM {legacy}")
+    )
+    months = {start.date() for start in starts.scalars()}
+    if default:
+        this_month = month_start(datetime.utcnow().date())
+        month = min(months, default=this_month)
+        last = add_months(this_month, settings.BOOKING_PARTITION_MONTHS_AHEAD)
+        while month <= last:
+            months.add(month)
+            month = add_months(month, 1)
+    for month in sorted(months):
+        await create_partition(conn, table, month)
+    if default:
+        await conn.execute(text(f"CREATE TABLE {table}_default PARTITION OF {table} DEFAULT"))
+
+    await conn.execute(text(f"INSERT INTO {table} SELECT * FROM {legacy}"))
+    # Indexes after the rows, built once per partition
+    await conn.execute(text(f"ALTER TABLE {table} ADD PRIMARY KEY (id, start_time)"))
+    for name, definition, primary in indexes:
+        if not primary:
+            await conn.execute(text(definition))
+    for definition in foreign_keys:
+        await conn.execute(text(f"ALTER TABLE {table} ADD {definition}"))
+    if sequence:
+        await conn.execute(text(f"ALTER SEQUENCE {sequence} OWNED BY {table}.id"))
+    await conn.execute(text(f"DROP TABLE {legacy}"))
+    return True
+
+
+# Overlap queries only look back max_duration() from the start of the
+# range: a longer booking already stored would go unseen, so setup refuses
+# to go on while there is one
+async def setup(conn: AsyncConnection) -> List[str]:
+    limit = max_duration()
+    if limit is not None:
+        longest = await conn.scalar(select(func.max(Booking.end_time - Booking.start_time)))
+        if longest is not None and longest > limit:
+            raise ValueError(
+                f"A stored booking lasts {longest.days} days, longer than"
+                f" BOOKING_MAX_DAYS={settings.BOOKING_MAX_DAYS}; raise the limit first."
+            )
+    converted = []
+    if await partition_table(conn, BOOKINGS, default=True):
+        converted.append(BOOKINGS)
+    if await partition_table(conn, ARCHIVE, default=False):
+        converted.append(ARCHIVE)
+    return converted
+
+
+# A month of bookings moves to the archive as a whole partition: detached
+# from bookings, attached to bookings_archive under the same name. Its
+# foreign keys go, like the archive's own.
+async def archive_partition(conn: AsyncConnection, month: date) -> Set[int]:
+    name = partition_name(BOOKINGS, month)
+    room_ids = set((await conn.execute(text(f"SELECT DISTINCT room_id FROM {name}"))).scalars())
+    await conn.execute(text(f"ALTER TABLE {BOOKINGS} DETACH PARTITION {name}"))
+    constraints = await conn.execute(
+        text(
+            "SELECT conname FROM pg_constraint"
+            " WHERE conrelid = to_regclass(:name) AND contype = 'f'"
+        ),
+        {"name": name},
+    )
+    for constraint in constraints.scalars():
+        await conn.execute(text(f'ALTER TABLE {name} DROP CONSTRAINT "{constraint}"'))
+    await conn.execute(text(f"ALTER TABLE {ARCHIVE} ATTACH PARTITION {name} {_bounds(month)}"))
+    return room_ids
+
+
+# Without partitions, the rows starting before `cutoff` are copied over and
+# deleted in the same transaction
+async def archive_rows(conn: AsyncConnection, cutoff: date) -> Set[int]:
+    cutoff = datetime.combine(cutoff, datetime.min.time())
+    room_ids = await conn.execute(
+        select(Booking.room_id).filter(Booking.start_time < cutoff).distinct()
+    )
+    room_ids = set(room_ids.scalars())
+    if room_ids:
+        columns = [getattr(Booking, column) for column in COLUMNS]
+        await conn.execute(
+            insert(BookingArchive).from_select(
+                list(COLUMNS), select(*columns).filter(Booking.start_time < cutoff)
+            )
+        )
+        await conn.execute(delete(Booking).where(Booking.start_time < cutoff))
+    return room_ids
+
+
+# The periodic job: months ahead created, months past the retention moved to
+# the archive. Returns what was done, and the rooms whose bookings moved.
+async def maintain(conn: AsyncConnection, today: Optional[date] = None) -> dict:
+    today = today or datetime.utcnow().date()
+    cutoff = archive_cutoff(today)
+    report = {"created": [], "archived": [], "room_ids": set()}
+
+    if conn.dialect.name != "postgresql" or not await is_partitioned(conn, BOOKINGS):
+        if cutoff is not None:
+            report["room_ids"] = await archive_rows(conn, cutoff)
+            if report["room_ids"]:
+                report["archived"].append(f"before {cutoff.isoformat()}")
+        return report
+
+    this_month = month_start(today)
+    for months in range(settings.BOOKING_PARTITION_MONTHS_AHEAD + 1):
+        month = add_months(this_month, months)
+        if await create_partition(conn, BOOKINGS, month):
+            report["created"].append(partition_name(BOOKINGS, month))
+
+    if cutoff is not None and await is_partitioned(conn, ARCHIVE):
+        for month in await partition_months(conn, BOOKINGS):
+            if month < cutoff:
+                report["room_ids"] |= await archive_partition(conn, month)
+                report["archived"].append(partition_name(BOOKINGS, month))
+    return report
+
+
+# python -m app.partitions [setup]: `setup` partitions the tables once
+# (PostgreSQL, takes an exclusive lock while the rows are copied); without it,
+# the maintenance job, meant to run daily from cron
+async def main(argv: Optional[List[str]] = None):
+    import sys
+
+    from .database import engine
+    from .etags import booking_keys, versions
+    from .pubsub import broadcast
+
+    argv = sys.argv[1:] if argv is None else argv
+    if argv[:1] == ["setup"]:
+        if engine.dialect.name != "postgresql" or not settings.BOOKING_PARTITIONING:
+            print("Partitioning needs PostgreSQL and BOOKING_PARTITIONING=true; bookings stay a plain table")
+            return
+        try:
+            async with engine.begin() as conn:
+                converted = await setup(conn)
+        except ValueError as e:
+            raise SystemExit(str(e))
+        print(f"Partitioned: {', '.join(converted) or 'nothing to do'}")
+        return
+
+    async with engine.begin() as conn:
+        report = await maintain(conn)
+    print(f"Created partitions: {', '.join(report['created']) or 'none'}")
+    print(f"Archived: {', '.join(report['archived']) or 'nothing'}")
+
+    # Lists that showed the archived bookings must not be answered with a 304
+    if report["room_ids"] and settings.REDIS_URL:
+        await broadcast.connect(settings.REDIS_URL)
+        try:
+            await versions.publish(*booking_keys(report["room_ids"] - {None}))
+        finally:
+            await broadcast.disconnect()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,96 @@
+import asyncio
+import json
+import logging
+import os
+import uuid
+from collections import defaultdict
+from typing import Callable, Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def redis_client(url: str):
+    # redis-py ships the former aioredis API as redis.asyncio; aioredis itself
+    # does not import on Python 3.11+
+    try:
+        from redis import asyncio as redis
+    except ImportError:
+        import aioredis as redis
+    return redis.from_url(url, decode_responses=True)
+
+
+# Small JSON messages between the worker processes of one deployment.
+# Handlers are plain callables registered per channel. Without a Redis URL
+# messages only reach the current process.
+class Broadcast:
+    def __init__(self, prefix: str = "booking"):
+        self.prefix = prefix
+        self.origin = f"{os.getpid()}-{uuid.uuid4().hex[:8]}"
+        self._handlers: Dict[str, List[Callable[[dict], None]]] = defaultdict(list)
+        self._redis = None
+        self._listener: Optional[asyncio.Task] = None
+
+    # Whether messages reach the other processes
+    @property
+    def connected(self) -> bool:
+        return self._redis is not None
+
+    # The Redis client, for state the processes share (None when not connected)
+    @property
+    def redis(self):
+        return self._redis
+
+    def subscribe(self, channel: str, handler: Callable[[dict], None]):
+        self._handlers[channel].append(handler)
+
+    def unsubscribe(self, channel: str, handler: Callable[[dict], None]):
+        if handler in self._handlers.get(channel, []):
+            self._handlers[channel].remove(handler)
+
+    def _deliver(self, channel: str, message: dict):
+        for handler in list(self._handlers.get(channel, [])):
+            try:
+                handler(message)
+            except Exception:
+                logger.exception("Handler for %s failed", channel)
+
+    # With local=False only the other processes receive the message
+    async def publish(self, channel: str, message: dict, local: bool = True):
+        if local:
+            self._deliver(channel, message)
+        if self._redis is not None:
+            payload = json.dumps({"origin": self.origin, "data": message}, default=str)
+            try:
+                await self._redis.publish(f"{self.prefix}:{channel}", payload)
+            except Exception:
+                logger.exception("Could not publish to %s", channel)
+
+    async def connect(self, url: str):
+        self._redis = redis_client(url)
+        pubsub = self._redis.pubsub()
+        await pubsub.psubscribe(f"{self.prefix}:*")
+        self._listener = asyncio.create_task(self._listen(pubsub))
+
+    async def _listen(self, pubsub):
+        async for raw in pubsub.listen():
+            if raw.get("type") != "pmessage":
+                continue
+            try:
+                payload = json.loads(raw["data"])
+            except (TypeError, ValueError):
+                continue
+            if payload.get("origin") == self.origin:
+                continue
+            channel = raw["channel"].split(":", 1)[1]
+            self._deliver(channel, payload.get("data") or {})
+
+    async def disconnect(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            self._listener = None
+        if self._redis is not None:
+            await self._redis.close()
+            self._redis = None
+
+
+broadcast = Broadcast()
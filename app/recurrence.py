@@ -0,0 +1,320 @@
+import asyncio
+from datetime import datetime, timedelta
+from itertools import islice
+from typing import Iterator, List, Optional, Tuple
+
+from dateutil.rrule import DAILY, MONTHLY, WEEKLY, rrule
+from sqlalchemy import delete, insert, or_, update
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.future import select
+
+from . import admission, analytics, crud, partitions, settings
+from .etags import booking_keys, versions
+from .interval_index import RoomIntervals, booking_index
+from .models import Booking, RecurringBooking
+from .schemas import RecurringBookingCreate
+
+FREQUENCIES = {"daily": DAILY, "weekly": WEEKLY, "monthly": MONTHLY}
+
+
+def horizon() -> datetime:
+    return datetime.utcnow() + timedelta(days=settings.RECURRING_HORIZON_DAYS)
+
+
+# Lazily yield (start, end) of the occurrences of a series starting at or after `after`
+def iter_occurrences(
+    series: RecurringBooking, after: Optional[datetime] = None
+) -> Iterator[Tuple[datetime, datetime]]:
+    weekdays = None
+    if series.weekdays:
+        weekdays = [int(day) for day in series.weekdays.split(",")]
+    rule = rrule(
+        FREQUENCIES[series.frequency],
+        dtstart=series.start_time,
+        interval=series.interval or 1,
+        until=series.until,
+        byweekday=weekdays,
+    )
+    duration = series.end_time - series.start_time
+    for start in islice(rule, series.count):
+        if after is None or start >= after:
+            yield start, start + duration
+
+
+def occurrence_batches(occurrences, size: int) -> Iterator[list]:
+    occurrences = iter(occurrences)
+    while batch := list(islice(occurrences, size)):
+        yield batch
+
+
+def count_occurrences(series: RecurringBooking) -> int:
+    limit = settings.RECURRING_MAX_OCCURRENCES
+    total = sum(1 for _ in islice(iter_occurrences(series), limit + 1))
+    if total > limit:
+        raise ValueError(f"A series can have at most {limit} occurrences.")
+    return total
+
+
+# Other series of the same room whose future occurrences are not stored yet
+async def _other_series(db: AsyncSession, series: RecurringBooking):
+    query = select(RecurringBooking).filter(
+        RecurringBooking.room_id == series.room_id,
+        or_(
+            RecurringBooking.until.is_(None),
+            RecurringBooking.until >= series.start_time,
+        ),
+    )
+    if series.id is not None:
+        query = query.filter(RecurringBooking.id != series.id)
+    result = await db.execute(query)
+    return result.scalars().all()
+
+
+# Busy intervals of a room within [low, high): stored bookings plus the
+# occurrences of `other_series` beyond their materialized horizon.
+# Stored bookings keep their id, series occurrences are reported as -series_id.
+async def _busy_intervals(
+    db: AsyncSession, room_id: int, low: datetime, high: datetime, other_series
+) -> RoomIntervals:
+    result = await db.execute(
+        select(Booking.id, Booking.start_time, Booking.end_time)
+        .filter(
+            Booking.room_id == room_id,
+            partitions.overlaps(Booking, low, high),
+        )
+        .order_by(Booking.start_time)
+    )
+    intervals = list(result.all())
+    for other in other_series:
+        for start, end in iter_occurrences(other, after=other.materialized_until):
+            if start >= high:
+                break
+            if end > low:
+                intervals.append((-other.id, start, end))
+    intervals.sort(key=lambda interval: interval[1])
+    return RoomIntervals.from_sorted(intervals)
+
+
+# Check every occurrence of a series, one range query per batch of occurrences
+async def find_series_conflicts(
+    db: AsyncSession, series: RecurringBooking, limit: int = 10
+) -> List[dict]:
+    other_series = await _other_series(db, series)
+    conflicts = []
+    batches = occurrence_batches(iter_occurrences(series), settings.RECURRING_BATCH_SIZE)
+    for batch in batches:
+        busy = await _busy_intervals(
+            db, series.room_id, batch[0][0], batch[-1][1], other_series
+        )
+        for start, end in batch:
+            conflict = busy.find_conflict(start, end)
+            if conflict is None:
+                continue
+            conflicts.append({"start_time": start, "end_time": end, "conflict": conflict})
+            if len(conflicts) >= limit:
+                return conflicts
+    return conflicts
+
+
+# Insert Booking rows for the occurrences starting before `until`.
+# With `check`, occurrences whose slot has been taken since the series was
+# created are skipped and counted instead of inserted.
+async def materialize(
+    db: AsyncSession, series: RecurringBooking, until: datetime, check: bool = True
+) -> List[Booking]:
+    occurrences = []
+    for start, end in iter_occurrences(series, after=series.materialized_until):
+        if start >= until:
+            break
+        occurrences.append((start, end))
+    if series.materialized_until is None or series.materialized_until < until:
+        series.materialized_until = until
+    if not occurrences:
+        return []
+
+    if check:
+        busy = await _busy_intervals(
+            db, series.room_id, occurrences[0][0], occurrences[-1][1], []
+        )
+        free = [
+            (start, end)
+            for start, end in occurrences
+            if busy.find_conflict(start, end) is None
+        ]
+        series.skipped_occurrences = (series.skipped_occurrences or 0) + len(
+            occurrences
+        ) - len(free)
+        occurrences = free
+        if not occurrences:
+            return []
+
+    result = await db.scalars(
+        insert(Booking).returning(Booking, sort_by_parameter_order=True),
+        [
+            {
+                "room_id": series.room_id,
+                "user_id": series.user_id,
+                "start_time": start,
+                "end_time": end,
+                "series_id": series.id,
+            }
+            for start, end in occurrences
+        ],
+    )
+    bookings = result.all()
+    delta = analytics.UsageDelta()
+    for booking in bookings:
+        delta.add_booking(booking.room_id, booking.start_time, booking.end_time)
+    await analytics.record(db, delta)
+    return bookings
+
+
+async def _index_bookings(db: AsyncSession, bookings: List[Booking]):
+    for booking in bookings:
+        booking_index.add(
+            booking.room_id, booking.id, booking.start_time, booking.end_time
+        )
+    if bookings:
+        await booking_index.publish_changes(*[booking.room_id for booking in bookings])
+        await versions.publish(
+            *booking_keys(
+                [booking.room_id for booking in bookings],
+                [booking.id for booking in bookings],
+            )
+        )
+        await crud.publish_booking_events(
+            db, "created", [crud.booking_event(booking) for booking in bookings]
+        )
+
+
+async def create_series(db: AsyncSession, data: RecurringBookingCreate):
+    partitions.check_duration(data.start_time, data.end_time)
+    series = RecurringBooking(
+        room_id=data.room_id,
+        user_id=data.user_id,
+        start_time=data.start_time,
+        end_time=data.end_time,
+        frequency=data.frequency,
+        interval=data.interval,
+        count=data.count,
+        until=data.until,
+        weekdays=",".join(str(day) for day in data.weekdays) if data.weekdays else None,
+        skipped_occurrences=0,
+    )
+    total = count_occurrences(series)
+    if total == 0:
+        raise ValueError("The series has no occurrences.")
+
+    # Checked and inserted under the room's admission lock, like single bookings
+    async with admission.admit(db, series.room_id):
+        conflicts = await find_series_conflicts(db, series)
+        if conflicts:
+            await db.rollback()
+            raise ValueError(
+                "Room is already booked for an occurrence of this series "
+                f"starting at {conflicts[0]['start_time'].isoformat()}."
+            )
+
+        db.add(series)
+        await db.flush()
+        bookings = await materialize(db, series, horizon(), check=False)
+        await db.commit()
+    await _index_bookings(db, bookings)
+    return series, total, len(bookings)
+
+
+async def get_series(db: AsyncSession, series_id: int) -> Optional[RecurringBooking]:
+    result = await db.execute(
+        select(RecurringBooking).filter(RecurringBooking.id == series_id)
+    )
+    return result.scalar_one_or_none()
+
+
+# Remove a series with its upcoming occurrences; past ones stay as plain bookings
+async def delete_series(db: AsyncSession, series_id: int) -> bool:
+    series = await get_series(db, series_id)
+    if series is None:
+        return False
+
+    result = await db.execute(
+        delete(Booking)
+        .where(Booking.series_id == series_id, Booking.start_time >= datetime.utcnow())
+        .returning(Booking.id, Booking.room_id, Booking.start_time, Booking.end_time)
+    )
+    deleted = result.all()
+    # Ending a series is not counted as cancelling its occurrences
+    delta = analytics.UsageDelta()
+    for _, room_id, start_time, end_time in deleted:
+        delta.add_booking(room_id, start_time, end_time, sign=-1)
+    await analytics.record(db, delta)
+    await db.execute(
+        update(Booking).where(Booking.series_id == series_id).values(series_id=None)
+    )
+    await db.delete(series)
+    await db.commit()
+    for booking_id, *_ in deleted:
+        booking_index.remove(booking_id)
+    if deleted:
+        await booking_index.publish_changes(*[row.room_id for row in deleted])
+        await versions.publish(
+            *booking_keys([row.room_id for row in deleted], [row.id for row in deleted])
+        )
+        await crud.publish_booking_events(
+            db,
+            "deleted",
+            [
+                {
+                    "id": row.id,
+                    "room_id": row.room_id,
+                    "start_time": row.start_time.isoformat(),
+                    "end_time": row.end_time.isoformat(),
+                }
+                for row in deleted
+            ],
+        )
+    return True
+
+
+# Periodic job: roll every series forward to the current horizon. Each room
+# goes through the same admission as single bookings, its series read and
+# their occurrences checked and inserted under the lock, one transaction per
+# room, so a booking created meanwhile cannot take the same slot.
+async def extend_horizons(db: AsyncSession) -> int:
+    until = horizon()
+    due = or_(
+        RecurringBooking.materialized_until.is_(None),
+        RecurringBooking.materialized_until < until,
+    )
+    room_ids = (
+        await db.scalars(select(RecurringBooking.room_id).filter(due).distinct())
+    ).all()
+    # Not holding a connection while queuing for the first room
+    await db.rollback()
+
+    bookings = []
+    for room_id in room_ids:
+        async with admission.admit(db, room_id):
+            result = await db.execute(
+                select(RecurringBooking)
+                .filter(RecurringBooking.room_id == room_id, due)
+                .execution_options(populate_existing=True)
+            )
+            created = []
+            for series in result.scalars().all():
+                created.extend(await materialize(db, series, until))
+            await db.commit()
+        bookings.extend(created)
+    await _index_bookings(db, bookings)
+    return len(bookings)
+
+
+async def main():
+    from .database import async_session_maker
+
+    async with async_session_maker() as db:
+        created = await extend_horizons(db)
+    print(f"Materialized {created} recurring booking occurrences")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,156 @@
+import asyncio
+import itertools
+import logging
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from http.cookies import SimpleCookie
+from typing import List, Optional
+
+from fastapi import Request
+from sqlalchemy import Delete, Insert, Update, text
+from sqlalchemy.ext.asyncio import AsyncSession, create_async_engine
+from sqlalchemy.orm import Session, sessionmaker
+
+from app import settings
+from app.database import async_session_maker, engine, engine_options, install_slow_query_log
+
+logger = logging.getLogger(__name__)
+
+PIN_COOKIE = "db_primary_until"
+
+
+# Picks a replica engine for read-only work. Replicas that fail the periodic
+# health check are skipped; with none left, reads go to the primary.
+class ReplicaRouter:
+    def __init__(self, urls: List[str], strategy: str):
+        self.strategy = strategy
+        self.replicas = []
+        for url in urls:
+            replica = create_async_engine(url, **engine_options(url))
+            install_slow_query_log(replica)
+            self.replicas.append(replica)
+        self.healthy = set(range(len(self.replicas)))
+        self._round_robin = itertools.count()
+        self._health_task: Optional[asyncio.Task] = None
+
+    def choose(self):
+        candidates = [
+            replica for i, replica in enumerate(self.replicas) if i in self.healthy
+        ]
+        if not candidates:
+            return engine
+        if self.strategy == "least_connections":
+            return min(candidates, key=lambda replica: replica.pool.checkedout())
+        return candidates[next(self._round_robin) % len(candidates)]
+
+    async def check_health(self):
+        for i, replica in enumerate(self.replicas):
+            try:
+                async with replica.connect() as conn:
+                    await asyncio.wait_for(conn.execute(text("SELECT 1")), timeout=2)
+            except Exception:
+                if i in self.healthy:
+                    logger.warning("Replica %s failed its health check", replica.url)
+                self.healthy.discard(i)
+            else:
+                if i not in self.healthy:
+                    logger.info("Replica %s is healthy again", replica.url)
+                self.healthy.add(i)
+
+    async def _run_health_checks(self):
+        while True:
+            await self.check_health()
+            await asyncio.sleep(settings.DB_REPLICA_HEALTH_INTERVAL)
+
+    def start(self):
+        if self.replicas and self._health_task is None:
+            self._health_task = asyncio.create_task(self._run_health_checks())
+
+    async def stop(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+        for replica in self.replicas:
+            await replica.dispose()
+
+
+replica_router = ReplicaRouter(settings.DATABASE_REPLICA_URLS, settings.DB_REPLICA_STRATEGY)
+
+
+def is_pinned_to_primary(request: Request) -> bool:
+    if settings.READ_YOUR_WRITES_SECONDS <= 0:
+        return False
+    try:
+        return float(request.cookies.get(PIN_COOKIE, 0)) > time.time()
+    except ValueError:
+        return False
+
+
+# Dependency for read-only endpoints: a session bound to a replica
+async def get_read_db(request: Request) -> AsyncSession:
+    bind = engine if is_pinned_to_primary(request) else replica_router.choose()
+    async with async_session_maker(bind=bind) as session:
+        yield session
+
+
+# Sets the pin cookie on successful writes so that the client's next reads
+# see its own changes even while the replicas lag behind
+class ReadYourWritesMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or scope["method"] in ("GET", "HEAD", "OPTIONS")
+            or settings.READ_YOUR_WRITES_SECONDS <= 0
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_pin(message):
+            if message["type"] == "http.response.start" and message["status"] < 400:
+                cookie = SimpleCookie()
+                cookie[PIN_COOKIE] = str(int(time.time() + settings.READ_YOUR_WRITES_SECONDS))
+                cookie[PIN_COOKIE]["max-age"] = int(settings.READ_YOUR_WRITES_SECONDS)
+                cookie[PIN_COOKIE]["path"] = "/"
+                cookie[PIN_COOKIE]["httponly"] = True
+                headers = list(message.get("headers", []))
+                headers.append(
+                    (b"set-cookie", cookie.output(header="").strip().encode("latin-1"))
+                )
+                message = {**message, "headers": headers}
+            await send(message)
+
+        await self.app(scope, receive, send_with_pin)
+
+
+_use_primary = ContextVar("use_primary", default=False)
+
+
+# Sends every query of the routing sessions opened within to the primary
+@contextmanager
+def use_primary():
+    token = _use_primary.set(True)
+    try:
+        yield
+    finally:
+        _use_primary.reset(token)
+
+
+# Session for the admin views: queries go to a replica, flushes to the primary.
+# Objects loaded to be changed must come from the primary too, or stale
+# replica columns would be written back: the views wrap those in use_primary.
+class RoutingSession(Session):
+    def get_bind(self, mapper=None, clause=None, **kwargs):
+        if _use_primary.get() or self._flushing or isinstance(clause, (Insert, Update, Delete)):
+            return engine.sync_engine
+        return replica_router.choose().sync_engine
+
+
+routing_session_maker = sessionmaker(
+    class_=AsyncSession,
+    sync_session_class=RoutingSession,
+    expire_on_commit=False,
+)
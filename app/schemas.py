@@ -1,6 +1,16 @@
-from pydantic import BaseModel
-from datetime import datetime
-from typing import Optional, List
+from pydantic import BaseModel, ConfigDict, Field, field_validator, model_validator
+from datetime import date, datetime, timezone
+from typing import Generic, Literal, Optional, List, TypeVar
+
+T = TypeVar("T")
+
+
+# The database stores naive UTC datetimes; aware input ("...Z", "+05:00") is
+# converted to that before it is compared with them
+def naive_utc(value: Optional[datetime]) -> Optional[datetime]:
+    if value is None or value.tzinfo is None:
+        return value
+    return value.astimezone(timezone.utc).replace(tzinfo=None)
 
 
 class RoomBase(BaseModel):
@@ -16,8 +26,7 @@ class Room(RoomBase):
     id: int
     office_id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 
@@ -30,27 +39,43 @@ class OfficeBase(BaseModel):
 class OfficeResponse(OfficeBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class UpdateOfficeResponse(OfficeBase):
     id: int
     rooms: List[Room]
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 class OfficeResponseCreate(OfficeBase):
     pass
 
 
+class RoomDetail(Room):
+    # Bookings overlapping the requested window
+    upcoming_bookings: int = 0
+
+
+class OfficeDetail(UpdateOfficeResponse):
+    rooms: List[RoomDetail]
+    upcoming_bookings: int = 0
+    start_time: datetime
+    end_time: datetime
+
+
 class BookingBase(BaseModel):
     user_id: int
     start_time: datetime
     end_time: datetime
 
+    # Compared with stored bookings, and with each other in bulk requests
+    @field_validator("start_time", "end_time")
+    @classmethod
+    def to_naive_utc(cls, value):
+        return naive_utc(value)
+
 
 class BookingCreate(BookingBase):
     room_id: int
@@ -59,22 +84,149 @@ class BookingCreate(BookingBase):
 class Booking(BookingBase):
     id: int
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
         
 class BookingList(BookingBase):
     id: int
     room_id: int
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+class BulkBookingResult(BaseModel):
+    # Position of the item in the request body
+    index: int
+    status: str  # "created", "conflict", "invalid" or "skipped"
+    booking: Optional[BookingList] = None
+    detail: Optional[str] = None
+
+
+class BulkBookingResponse(BaseModel):
+    created: int
+    failed: int
+    results: List[BulkBookingResult]
+
+
+class RecurringBookingCreate(BookingCreate):
+    frequency: Literal["daily", "weekly", "monthly"]
+    interval: int = Field(1, ge=1)
+    # A series must end, either after `count` occurrences or at `until`
+    count: Optional[int] = Field(None, ge=1)
+    until: Optional[datetime] = None
+    # Weekly series only, 0 = Monday
+    weekdays: Optional[List[int]] = None
+
+    # The series is expanded and compared with the horizon in naive UTC
+    @field_validator("until")
+    @classmethod
+    def until_to_naive_utc(cls, value):
+        return naive_utc(value)
+
+    @field_validator("weekdays", mode="before")
+    @classmethod
+    def split_weekdays(cls, value):
+        if isinstance(value, str):
+            return [int(day) for day in value.split(",") if day]
+        return value
+
+    @field_validator("weekdays")
+    @classmethod
+    def check_weekdays(cls, value):
+        if value is not None and any(day < 0 or day > 6 for day in value):
+            raise ValueError("weekdays must be between 0 (Monday) and 6 (Sunday)")
+        return value
+
+    @model_validator(mode="after")
+    def check_series(self):
+        if self.count is None and self.until is None:
+            raise ValueError("Either count or until is required")
+        if self.end_time <= self.start_time:
+            raise ValueError("end_time must be after start_time")
+        return self
+
+
+class RecurringBooking(RecurringBookingCreate):
+    id: int
+    materialized_until: Optional[datetime] = None
+    skipped_occurrences: int = 0
+
+    model_config = ConfigDict(from_attributes=True)
+
+
+class RecurringBookingCreated(RecurringBooking):
+    occurrences: int
+    materialized: int
+
+
+class Occurrence(BaseModel):
+    start_time: datetime
+    end_time: datetime
+
+
+class TimeWindow(BaseModel):
+    start_time: datetime
+    end_time: datetime
+
+
+class AvailableSlot(TimeWindow):
+    room_id: int
+
+
+class RoomAvailability(BaseModel):
+    room_id: int
+    name: str
+    capacity: Optional[int] = None
+    free: List[TimeWindow]
+
+
+class OfficeAvailability(TimeWindow):
+    office_id: int
+    rooms: List[RoomAvailability]
+    # Earliest slot of the requested duration, if one was asked for
+    next_slot: Optional[AvailableSlot] = None
+
+
+class UsagePeriod(BaseModel):
+    # The day, or the Monday of the week
+    period_start: date
+    booked_hours: float
+    bookings: int
+    cancellations: int
+    utilization: float
+
+
+class RoomUsage(BaseModel):
+    room_id: int
+    name: str
+    booked_hours: float
+    bookings: int
+    cancellations: int
+    utilization: float
+    # Share of bookings cancelled before they started
+    cancellation_rate: float
+
+
+class UtilizationReport(BaseModel):
+    office_id: int
+    start_date: date
+    end_date: date
+    granularity: str
+    periods: List[UsagePeriod]
+    rooms: List[RoomUsage]
+
+
+class PeakHours(BaseModel):
+    office_id: int
+    start_date: date
+    end_date: date
+    # hours[weekday][hour]: booked hours, Monday first, UTC hours
+    hours: List[List[float]]
 
 
 # DeleteResponse
 class DeleteResponse(BaseModel):
     message: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
 
 
 # User schemas
@@ -90,8 +242,16 @@ class User(BaseModel):
     id: int
     username: str
 
-    class Config:
-        orm_mode = True
+    model_config = ConfigDict(from_attributes=True)
+
+
+# Keyset-paginated list response
+class CursorPage(BaseModel, Generic[T]):
+    items: List[T]
+    size: int
+    next_cursor: Optional[str] = None
+    # Planner estimate, only filled in when include_total=true
+    total: Optional[int] = None
 
 
 class Token(BaseModel):
@@ -0,0 +1,221 @@
+import asyncio
+import heapq
+import itertools
+import json
+import time
+from collections import Counter
+from typing import Dict, List, Optional
+
+from . import settings
+from .database import InstrumentedPool
+from .tracing import parse_route_rates
+
+HIGH, NORMAL, LOW = 0, 1, 2
+PRIORITY_NAMES = {HIGH: "high", NORMAL: "normal", LOW: "low"}
+
+# Never queued: scrapes must work when the service is overloaded, and event
+# streams stay open for as long as the client listens
+EXEMPT_PREFIXES = ("/metrics", "/bookings/events", "/docs", "/openapi.json")
+
+# Pool waits older than this no longer say anything about the pool
+POOL_WAIT_STALE_SECONDS = 5.0
+
+_sequence = itertools.count()
+
+
+# A number of slots, and a queue of the requests waiting for one: a freed
+# slot goes to the waiter of the best priority, first come first served
+# within a priority. A waiter gives up after its timeout, so nothing waits
+# unboundedly and the queue cannot grow past `max_waiting`.
+class Gate:
+    def __init__(self, capacity: int, max_waiting: Optional[int] = None):
+        self.capacity = max(capacity, 1)
+        self.max_waiting = max_waiting
+        self.in_flight = 0
+        self.waiting = 0
+        self._waiters: list = []
+
+    async def acquire(self, priority: int, timeout: float) -> bool:
+        if self.in_flight < self.capacity and not self.waiting:
+            self.in_flight += 1
+            return True
+        if timeout <= 0 or (self.max_waiting is not None and self.waiting >= self.max_waiting):
+            return False
+
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (priority, next(_sequence), future))
+        self.waiting += 1
+        try:
+            await asyncio.wait_for(asyncio.shield(future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            # Handed a slot just as the deadline passed: keep it
+            if future.done():
+                return True
+            self._give_up(future)
+            return False
+        except asyncio.CancelledError:
+            if future.done():
+                self.release()
+            else:
+                self._give_up(future)
+            raise
+
+    def _give_up(self, future: asyncio.Future):
+        future.cancel()
+        self.waiting -= 1
+
+    # The slot passes straight to the next waiter, if any
+    def release(self):
+        while self._waiters:
+            _, _, future = heapq.heappop(self._waiters)
+            if not future.done():
+                self.waiting -= 1
+                future.set_result(True)
+                return
+        self.in_flight -= 1
+
+
+class Shedder:
+    def __init__(
+        self,
+        max_in_flight: int,
+        max_queue: int,
+        deadlines: Dict[str, float],
+        route_limits: Dict[str, float],
+        low_priority_prefixes: List[str],
+    ):
+        self.gate = Gate(max_in_flight, max_queue)
+        self.deadlines = {
+            priority: deadlines.get(name, 1.0) for priority, name in PRIORITY_NAMES.items()
+        }
+        # Longest prefix first, so the most specific cap applies
+        self.route_gates = {
+            prefix: Gate(int(limit), max_queue)
+            for prefix, limit in sorted(route_limits.items(), key=lambda item: -len(item[0]))
+        }
+        self.low_priority_prefixes = tuple(low_priority_prefixes)
+        self.pool_wait = 0.0
+        self._pool_wait_at = 0.0
+        self.admitted: Counter = Counter()
+        self.shed: Counter = Counter()
+        self.queue_wait_seconds_total = 0.0
+        self.queue_wait_seconds_max = 0.0
+
+    def priority(self, method: str, path: str) -> int:
+        if method not in ("GET", "HEAD", "OPTIONS"):
+            return HIGH
+        if path.startswith(self.low_priority_prefixes):
+            return LOW
+        return NORMAL
+
+    def route_gate(self, path: str) -> Optional[Gate]:
+        for prefix, gate in self.route_gates.items():
+            if path.startswith(prefix):
+                return gate
+        return None
+
+    # Moving average of pool checkout waits (database.InstrumentedPool)
+    def observe_pool_wait(self, seconds: float):
+        self.pool_wait = 0.8 * self.pool_wait + 0.2 * seconds
+        self._pool_wait_at = time.monotonic()
+
+    def pool_saturated(self) -> bool:
+        if time.monotonic() - self._pool_wait_at > POOL_WAIT_STALE_SECONDS:
+            return False
+        return self.pool_wait * 1000 > settings.SHED_POOL_WAIT_MS
+
+    # The gates held by an admitted request, to hand back to leave(), or None
+    # when it is shed. The route's cap is taken first, so a request queued
+    # behind it does not sit on one of the shared slots meanwhile.
+    async def enter(self, method: str, path: str) -> Optional[List[Gate]]:
+        priority = self.priority(method, path)
+        name = PRIORITY_NAMES[priority]
+        if priority == LOW and self.pool_saturated():
+            self.shed[f"{name}_pool_wait"] += 1
+            return None
+
+        started = time.perf_counter()
+        deadline = started + self.deadlines[priority]
+        held = []
+        for gate in (self.route_gate(path), self.gate):
+            if gate is None:
+                continue
+            if not await gate.acquire(priority, deadline - time.perf_counter()):
+                self.leave(held)
+                self.shed[name] += 1
+                return None
+            held.append(gate)
+
+        waited = time.perf_counter() - started
+        self.queue_wait_seconds_total += waited
+        self.queue_wait_seconds_max = max(self.queue_wait_seconds_max, waited)
+        self.admitted[name] += 1
+        return held
+
+    def leave(self, held: List[Gate]):
+        for gate in reversed(held):
+            gate.release()
+
+    def stats(self) -> dict:
+        stats = {
+            "in_flight": self.gate.in_flight,
+            "waiting": self.gate.waiting,
+            "pool_wait_ms": self.pool_wait * 1000,
+            "queue_wait_seconds_total": self.queue_wait_seconds_total,
+            "queue_wait_seconds_max": self.queue_wait_seconds_max,
+        }
+        for name in PRIORITY_NAMES.values():
+            stats[f"admitted_{name}"] = self.admitted[name]
+            stats[f"shed_{name}"] = self.shed[name]
+        stats["shed_low_pool_wait"] = self.shed["low_pool_wait"]
+        return stats
+
+
+shedder = Shedder(
+    settings.SHED_MAX_IN_FLIGHT,
+    settings.SHED_MAX_QUEUE,
+    parse_route_rates(settings.SHED_DEADLINES),
+    parse_route_rates(settings.SHED_ROUTE_LIMITS),
+    settings.SHED_LOW_PRIORITY_PREFIXES,
+)
+InstrumentedPool.wait_listeners.append(shedder.observe_pool_wait)
+
+
+# Admission control in front of the app: when the database slows down,
+# requests queue here, a bounded number of them for a bounded time, instead
+# of every one of them holding memory and waiting on the connection pool.
+# A request that cannot be admitted in time gets a 503 with Retry-After
+# without having touched the database.
+class SheddingMiddleware:
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if (
+            scope["type"] != "http"
+            or not settings.SHED_ENABLED
+            or scope["path"].startswith(EXEMPT_PREFIXES)
+        ):
+            await self.app(scope, receive, send)
+            return
+
+        held = await shedder.enter(scope["method"], scope["path"])
+        if held is None:
+            await send(
+                {
+                    "type": "http.response.start",
+                    "status": 503,
+                    "headers": [
+                        (b"content-type", b"application/json"),
+                        (b"retry-after", str(settings.SHED_RETRY_AFTER_SECONDS).encode()),
+                    ],
+                }
+            )
+            body = json.dumps({"detail": "Service overloaded, retry later."}).encode()
+            await send({"type": "http.response.body", "body": body})
+            return
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            shedder.leave(held)
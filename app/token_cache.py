@@ -0,0 +1,112 @@
+import hashlib
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional
+
+from app.pubsub import broadcast
+from app.settings import TOKEN_CACHE_SIZE, TOKEN_CACHE_TTL
+
+REVOCATION_CHANNEL = "tokens.revoke"
+
+
+# Revoked tokens are known by a digest, which is also what goes over Redis:
+# a bearer token itself never leaves the process
+def token_digest(token: str) -> str:
+    return hashlib.sha256(token.encode()).hexdigest()
+
+
+# Bounded LRU of verified bearer tokens. An entry holds the decoded claims and,
+# once resolved, the authenticated user, and lives until the token's `exp` or
+# `ttl` seconds, whichever comes first. Revoked tokens are remembered until
+# they would have expired anyway, in every worker (see auth.revoke_token).
+class TokenCache:
+    def __init__(self, maxsize: int = TOKEN_CACHE_SIZE, ttl: float = TOKEN_CACHE_TTL):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._revoked: Dict[str, float] = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    def get(self, token: str) -> Optional[Dict[str, Any]]:
+        entry = self._entries.get(token)
+        if entry is None:
+            self.misses += 1
+            return None
+        if entry["expires_at"] <= time.time():
+            del self._entries[token]
+            self.misses += 1
+            return None
+        self._entries.move_to_end(token)
+        self.hits += 1
+        return entry
+
+    def put(self, token: str, claims: dict, user: Any = None) -> Dict[str, Any]:
+        expires_at = time.time() + self.ttl
+        if claims.get("exp"):
+            expires_at = min(expires_at, float(claims["exp"]))
+        entry = {"claims": claims, "user": user, "expires_at": expires_at}
+        self._entries[token] = entry
+        self._entries.move_to_end(token)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+            self.evictions += 1
+        return entry
+
+    def set_user(self, token: str, user: Any):
+        entry = self._entries.get(token)
+        if entry is not None:
+            entry["user"] = user
+
+    def is_revoked(self, token: str) -> bool:
+        digest = token_digest(token)
+        expires_at = self._revoked.get(digest)
+        if expires_at is None:
+            return False
+        if expires_at <= time.time():
+            del self._revoked[digest]
+            return False
+        return True
+
+    # Revocation hook, e.g. on logout: the token is refused until `expires_at`,
+    # its `exp` (for good when it has none)
+    def revoke(self, token: str, expires_at: Optional[float] = None):
+        self._entries.pop(token, None)
+        self._revoke_digest(token_digest(token), expires_at)
+
+    def _revoke_digest(self, digest: str, expires_at: Optional[float]):
+        self._revoked[digest] = float("inf") if expires_at is None else float(expires_at)
+        now = time.time()
+        for revoked, revoked_until in list(self._revoked.items()):
+            if revoked_until <= now:
+                del self._revoked[revoked]
+
+    # A token revoked in another worker. Its cache entry, if any, is left to
+    # expire: is_revoked is checked first.
+    def _on_remote_revoke(self, message: dict):
+        if message.get("digest"):
+            self._revoke_digest(message["digest"], message.get("expires_at"))
+
+    # Invalidation hook for when a user's data changes: their tokens stay
+    # valid, but the user is looked up again on the next request
+    def invalidate_user(self, user_id: int):
+        for entry in self._entries.values():
+            if entry["user"] is not None and entry["user"].id == user_id:
+                entry["user"] = None
+
+    def clear(self):
+        self._entries.clear()
+
+    def stats(self) -> dict:
+        return {
+            "size": len(self._entries),
+            "revoked": len(self._revoked),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
+
+
+token_cache = TokenCache()
+broadcast.subscribe(REVOCATION_CHANNEL, token_cache._on_remote_revoke)
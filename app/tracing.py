@@ -0,0 +1,150 @@
+import random
+import time
+from datetime import datetime, timedelta, timezone
+from typing import Dict, Optional
+
+import sentry_sdk
+
+from app import settings
+
+
+# "/metrics=0,/bookings/=0.2" -> {"/metrics": 0.0, "/bookings/": 0.2}
+def parse_route_rates(value: str) -> Dict[str, float]:
+    rates = {}
+    for item in value.split(","):
+        prefix, _, rate = item.strip().partition("=")
+        if prefix and rate:
+            rates[prefix.strip()] = float(rate)
+    return rates
+
+
+# Head sampling for Sentry transactions. Every request gets the base rate,
+# or the rate of the longest matching route prefix, and the traces started
+# in any one second are capped by the budget. The sampler rolls the dice
+# itself and returns 0 or 1 so that the budget counts real decisions.
+class TracesSampler:
+    def __init__(self, base_rate: float, route_rates: Dict[str, float], per_second: int):
+        self.base_rate = base_rate
+        # Longest prefix first
+        self.route_rates = sorted(route_rates.items(), key=lambda item: -len(item[0]))
+        self.per_second = per_second
+        self._second = 0
+        self._used = 0
+        self.sampled = 0
+        self.dropped_by_budget = 0
+
+    def rate_for(self, path: str) -> float:
+        for prefix, rate in self.route_rates:
+            if path.startswith(prefix):
+                return rate
+        return self.base_rate
+
+    def _take_budget(self) -> bool:
+        if self.per_second <= 0:
+            return True
+        second = int(time.monotonic())
+        if second != self._second:
+            self._second = second
+            self._used = 0
+        if self._used >= self.per_second:
+            self.dropped_by_budget += 1
+            return False
+        self._used += 1
+        return True
+
+    def __call__(self, sampling_context: dict) -> float:
+        # Continue the decision of an upstream service
+        parent_sampled = sampling_context.get("parent_sampled")
+        if parent_sampled is not None:
+            return float(parent_sampled)
+
+        scope = sampling_context.get("asgi_scope") or {}
+        rate = self.rate_for(scope.get("path", ""))
+        if rate <= 0 or random.random() >= rate:
+            return 0.0
+        if not self._take_budget():
+            return 0.0
+        self.sampled += 1
+        return 1.0
+
+
+traces_sampler = TracesSampler(
+    settings.SENTRY_TRACES_SAMPLE_RATE,
+    parse_route_rates(settings.SENTRY_TRACES_ROUTE_RATES),
+    settings.SENTRY_TRACES_PER_SECOND,
+)
+
+
+# Tail sampling for what head sampling missed: a request that was not traced
+# but turned out slow or failed is sent as a bare transaction (timing, route
+# and status, no spans) after the fact, so the latency tail stays visible at
+# the cost of one event per such request.
+class TailSamplingMiddleware:
+    def __init__(self, app):
+        self.app = app
+        self.kept_slow = 0
+        self.kept_errors = 0
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not sentry_sdk.get_client().is_active():
+            await self.app(scope, receive, send)
+            return
+
+        status = 500
+        # Event streams stay open for as long as the client listens; their
+        # duration says nothing about latency
+        streaming = False
+        started_at = datetime.now(timezone.utc)
+        started = time.perf_counter()
+
+        async def send_with_status(message):
+            nonlocal status, streaming
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                streaming = any(
+                    name == b"content-type" and value.startswith(b"text/event-stream")
+                    for name, value in message.get("headers", [])
+                )
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_status)
+        finally:
+            elapsed = time.perf_counter() - started
+            reason = None
+            if status >= 500:
+                reason = "error"
+            elif elapsed * 1000 >= settings.SENTRY_SLOW_REQUEST_MS and not streaming:
+                reason = "slow"
+            if reason is not None and not self._was_sampled():
+                self._send_transaction(scope, status, started_at, elapsed, reason)
+
+    def _was_sampled(self) -> bool:
+        transaction = sentry_sdk.get_current_scope().transaction
+        return transaction is not None and bool(transaction.sampled)
+
+    def _send_transaction(self, scope, status, started_at, elapsed, reason):
+        route = scope.get("route")
+        transaction = sentry_sdk.start_transaction(
+            name=f"{scope['method']} {route.path if route is not None else scope['path']}",
+            op="http.server",
+            source="route",
+            sampled=True,
+            start_timestamp=started_at,
+        )
+        transaction.set_tag("sampling.reason", reason)
+        transaction.set_http_status(status)
+        transaction.finish(end_timestamp=started_at + timedelta(seconds=elapsed))
+        if reason == "error":
+            self.kept_errors += 1
+        else:
+            self.kept_slow += 1
+
+
+def init_sentry(dsn: Optional[str]):
+    sentry_sdk.init(
+        dsn=dsn,
+        traces_sampler=traces_sampler,
+        # Relative to the traced requests, not to all requests
+        profiles_sample_rate=settings.SENTRY_PROFILES_SAMPLE_RATE,
+    )
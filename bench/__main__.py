@@ -0,0 +1,151 @@
+"""Benchmark the booking API in-process.
+
+    python -m bench --workloads login_storm,deep_pagination --output before.json
+    python -m bench.compare before.json after.json
+
+The app is driven through httpx's ASGI transport against --database-url
+(a throwaway SQLite file by default; pass a local Postgres URL for numbers
+closer to production). Seeding drops and recreates every table there.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+from datetime import datetime
+
+DEFAULT_DATABASE_URL = "sqlite+aiosqlite:///" + os.path.join(
+    tempfile.gettempdir(), "booking-bench.db"
+)
+DEFAULT_WORKLOADS = "login_storm,booking_contention,deep_pagination,mixed"
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", DEFAULT_DATABASE_URL))
+    parser.add_argument("--workloads", default=DEFAULT_WORKLOADS,
+                        help="comma separated, run in this order")
+    parser.add_argument("--no-seed", action="store_true",
+                        help="reuse the data already in the database")
+    parser.add_argument("--offices", type=int, default=20)
+    parser.add_argument("--rooms-per-office", type=int, default=10)
+    parser.add_argument("--bookings-per-room", type=int, default=100)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--requests", type=int, default=500,
+                        help="requests per workload")
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--hot-rooms", type=int, default=3)
+    parser.add_argument("--spread-rooms", type=int, default=1000,
+                        help="rooms the admission workload spreads its writes over")
+    parser.add_argument("--page-size", type=int, default=100)
+    parser.add_argument("--pages", type=int, default=200,
+                        help="pages walked by each deep_pagination walker")
+    parser.add_argument("--random-seed", type=int, default=42)
+    parser.add_argument("--output", help="write the JSON report here instead of stdout")
+    return parser.parse_args(argv)
+
+
+def git_commit():
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"],
+            capture_output=True, text=True, check=True,
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def run(options) -> dict:
+    import httpx
+
+    from app import database, settings
+    from app.main import app
+
+    from .harness import Recorder
+    from .seed import load_dataset, seed
+    from .workloads import WORKLOADS
+
+    names = [name.strip() for name in options.workloads.split(",") if name.strip()]
+    unknown = [name for name in names if name not in WORKLOADS]
+    if unknown:
+        raise SystemExit(f"Unknown workloads: {', '.join(unknown)} (known: {', '.join(WORKLOADS)})")
+
+    if not options.no_seed:
+        await seed(
+            database.engine,
+            offices=options.offices,
+            rooms_per_office=options.rooms_per_office,
+            bookings_per_room=options.bookings_per_room,
+            users=options.users,
+        )
+    dataset = await load_dataset(database.engine)
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "started_at": datetime.utcnow().isoformat(timespec="seconds"),
+            "python": platform.python_version(),
+            "database": database.engine.dialect.name,
+            "dataset": {
+                "offices": len(dataset.office_ids),
+                "rooms": len(dataset.room_ids),
+                "bookings": dataset.bookings,
+                "users": len(dataset.usernames),
+            },
+            "options": {
+                key: value for key, value in vars(options).items()
+                if key not in ("database_url", "output")
+            },
+            "settings": {
+                "BCRYPT_ROUNDS": settings.BCRYPT_ROUNDS,
+                "PASSWORD_HASH_WORKERS": settings.PASSWORD_HASH_WORKERS,
+                "BOOKING_INDEX_ENABLED": settings.BOOKING_INDEX_ENABLED,
+                "CACHE_BACKEND": settings.CACHE_BACKEND,
+                "DB_POOL_SIZE": settings.DB_POOL_SIZE,
+                "DB_MAX_OVERFLOW": settings.DB_MAX_OVERFLOW,
+                "FAST_LIST_SERIALIZATION": settings.FAST_LIST_SERIALIZATION,
+                "BOOKING_ROOM_LOCKS": settings.BOOKING_ROOM_LOCKS,
+                "BOOKING_ADVISORY_LOCKS": settings.BOOKING_ADVISORY_LOCKS,
+            },
+        },
+        "workloads": {},
+    }
+
+    transport = httpx.ASGITransport(app=app)
+    async with app.router.lifespan_context(app):
+        async with httpx.AsyncClient(transport=transport, base_url="http://bench", timeout=None) as client:
+            for name in names:
+                print(f"Running {name}...", file=sys.stderr)
+                recorder = Recorder(client)
+                extra = await WORKLOADS[name](recorder, dataset, options)
+                recorder.stop()
+                report["workloads"][name] = {**recorder.report(), **(extra or {})}
+    report["meta"]["pool"] = database.pool_status()
+    return report
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    # Settings are read at import time, so the environment is set up first
+    os.environ["DATABASE_URL"] = options.database_url
+    os.environ.setdefault("SENTRY_DSN", "")
+    os.environ.setdefault("DB_SLOW_QUERY_MS", "0")
+    logging.getLogger("passlib").setLevel(logging.ERROR)
+
+    report = asyncio.run(run(options))
+    output = json.dumps(report, indent=2, default=str)
+    if options.output:
+        with open(options.output, "w") as f:
+            f.write(output + "\n")
+        print(f"Report written to {options.output}", file=sys.stderr)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
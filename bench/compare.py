@@ -0,0 +1,43 @@
+"""Compare two benchmark reports: python -m bench.compare before.json after.json"""
+import json
+import sys
+
+
+def _change(before: float, after: float) -> str:
+    if not before:
+        return "n/a"
+    return f"{(after - before) / before * 100:+.1f}%"
+
+
+def compare(before: dict, after: dict):
+    print(f"before: {before['meta'].get('commit')}  after: {after['meta'].get('commit')}")
+    for name, workload in after["workloads"].items():
+        old = before["workloads"].get(name)
+        if old is None:
+            continue
+        print(f"\n{name}: {old['throughput_rps']} -> {workload['throughput_rps']} req/s "
+              f"({_change(old['throughput_rps'], workload['throughput_rps'])})")
+        for label, stats in workload["endpoints"].items():
+            old_stats = old["endpoints"].get(label)
+            if old_stats is None:
+                continue
+            parts = []
+            for key in ("p50", "p95", "p99"):
+                a, b = old_stats["latency_ms"][key], stats["latency_ms"][key]
+                parts.append(f"{key} {a:.1f} -> {b:.1f} ms ({_change(a, b)})")
+            print(f"  {label}: " + ", ".join(parts))
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    if len(argv) != 2:
+        raise SystemExit(__doc__)
+    with open(argv[0]) as f:
+        before = json.load(f)
+    with open(argv[1]) as f:
+        after = json.load(f)
+    compare(before, after)
+
+
+if __name__ == "__main__":
+    main()
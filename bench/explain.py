@@ -0,0 +1,229 @@
+"""Check that the booking queries are served by an index.
+
+    python -m bench.explain [--database-url URL] [--no-seed]
+
+Seeds the database like python -m bench (or reuses it with --no-seed), runs
+each crud query once while recording its SQL, then EXPLAINs every statement
+that reads the bookings tables. Exits with status 1 when one of them reads a
+bookings table with a sequential scan. On PostgreSQL, tables (or partitions)
+under --min-rows rows are let through: the planner rightly scans those.
+"""
+import argparse
+import asyncio
+import json
+import logging
+import os
+import re
+import sys
+from datetime import timedelta
+
+from sqlalchemy import text
+
+from .__main__ import DEFAULT_DATABASE_URL
+
+READS = ("SELECT", "WITH", "INSERT", "UPDATE", "DELETE")
+# "SCAN bookings" (or "SCAN TABLE bookings_1"), but not "SCAN ... USING INDEX"
+SQLITE_SCAN = re.compile(r"^SCAN (?:TABLE )?(\w+)$")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m bench.explain", description=__doc__,
+                                     formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--database-url", default=os.getenv("BENCH_DATABASE_URL", DEFAULT_DATABASE_URL))
+    parser.add_argument("--no-seed", action="store_true",
+                        help="reuse the data already in the database")
+    parser.add_argument("--offices", type=int, default=20)
+    parser.add_argument("--rooms-per-office", type=int, default=10)
+    parser.add_argument("--bookings-per-room", type=int, default=100)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--min-rows", type=int, default=1000,
+                        help="PostgreSQL: smallest table a sequential scan is reported for")
+    return parser.parse_args(argv)
+
+
+def _is_bookings(relation: str) -> bool:
+    return relation.startswith("bookings")
+
+
+def _postgres_scans(plan: dict) -> list:
+    scans = []
+    if plan.get("Node Type") == "Seq Scan" and _is_bookings(plan.get("Relation Name", "")):
+        scans.append(plan["Relation Name"])
+    for child in plan.get("Plans", []):
+        scans.extend(_postgres_scans(child))
+    return scans
+
+
+async def sequential_scans(conn, statement: str, parameters, min_rows: int = 0) -> list:
+    if conn.dialect.name == "postgresql":
+        result = await conn.exec_driver_sql(f"EXPLAIN (FORMAT JSON) {statement}", parameters)
+        plan = result.scalar()
+        if isinstance(plan, str):
+            plan = json.loads(plan)
+        scans = []
+        for relation in _postgres_scans(plan[0]["Plan"]):
+            rows = await conn.scalar(
+                text("SELECT reltuples FROM pg_class WHERE oid = to_regclass(:name)"),
+                {"name": relation},
+            )
+            if (rows or 0) >= min_rows:
+                scans.append(relation)
+        return scans
+    result = await conn.exec_driver_sql(f"EXPLAIN QUERY PLAN {statement}", parameters)
+    scans = []
+    for row in result.all():
+        match = SQLITE_SCAN.match(row[-1])
+        if match and _is_bookings(match.group(1)):
+            scans.append(match.group(1))
+    return scans
+
+
+# label -> the crud call, run once against the seeded data
+def cases(dataset):
+    from app import analytics, availability, crud, export, recurrence
+    from app.interval_index import booking_index
+    from app.pagination import CursorParams
+    from app.schemas import BookingCreate, RecurringBookingCreate
+
+    from .seed import SEED_START
+
+    room_id, office_id = dataset.room_ids[0], dataset.office_ids[0]
+    seeded = SEED_START + timedelta(hours=10)
+    free = dataset.free_from
+
+    def page(cursor=None):
+        return CursorParams(cursor=cursor, size=50, include_total=False)
+
+    def booking(start, hours=1):
+        return BookingCreate(
+            room_id=room_id, user_id=1, start_time=start, end_time=start + timedelta(hours=hours)
+        )
+
+    async def deep_page(db):
+        first = await crud.get_bookings(db, page())
+        await crud.get_bookings(db, page(first["next_cursor"]))
+
+    async def room_page(db):
+        first = await crud.get_bookings(db, page(), room_id=room_id)
+        await crud.get_bookings(db, page(first["next_cursor"]), room_id=room_id)
+
+    async def user_page(db):
+        first = await crud.get_bookings(db, page(), user_id=2)
+        await crud.get_bookings(db, page(first["next_cursor"]), user_id=2)
+
+    async def write_cycle(db):
+        created = await crud.create_booking(db, booking(free))
+        await crud.update_booking(db, created.id, booking(free + timedelta(hours=1)))
+        await crud.delete_booking(db, created.id)
+
+    async def series(db):
+        data = RecurringBookingCreate(
+            **booking(free + timedelta(days=2)).model_dump(), frequency="daily", count=5
+        )
+        created, _, _ = await recurrence.create_series(db, data)
+        await recurrence.delete_series(db, created.id)
+
+    async def export_room(db):
+        query = export.export_query(room_id=room_id, start=SEED_START, end=seeded)
+        await db.execute(query.limit(10))
+
+    return {
+        "list bookings": lambda db: crud.get_bookings(db, page()),
+        "list bookings, next page": deep_page,
+        "list bookings of a room": room_page,
+        "list bookings of a user": user_page,
+        "list bookings by date": lambda db: crud.get_bookings(
+            db, page(), start=SEED_START, end=seeded
+        ),
+        "get booking": lambda db: crud.get_bookings_by_id(db, [1, 2, 3]),
+        "conflict check": lambda db: crud.create_booking(db, booking(seeded)),
+        "create, update, delete": write_cycle,
+        "bulk create": lambda db: crud.create_bookings_bulk(
+            db, [booking(seeded), booking(free + timedelta(days=1))]
+        ),
+        "recurring series": series,
+        "office details": lambda db: crud.get_office_details(
+            db, [office_id], SEED_START, seeded
+        ),
+        "availability": lambda db: availability.get_office_availability(
+            db, office_id, SEED_START, seeded
+        ),
+        "interval index load": lambda db: booking_index.find_conflict(
+            db, room_id, seeded, seeded + timedelta(hours=1)
+        ),
+        "export of a room": export_room,
+        "usage rebuild": lambda db: analytics.rebuild(
+            db, SEED_START.date(), SEED_START.date() + timedelta(days=1)
+        ),
+    }
+
+
+async def run(options) -> int:
+    from sqlalchemy import event
+
+    from app.database import async_session_maker, detect_range_overlaps, engine
+
+    from .seed import load_dataset, seed
+
+    if not options.no_seed:
+        await seed(
+            engine,
+            offices=options.offices,
+            rooms_per_office=options.rooms_per_office,
+            bookings_per_room=options.bookings_per_room,
+            users=options.users,
+        )
+    dataset = await load_dataset(engine)
+    await detect_range_overlaps(engine)
+    async with engine.begin() as conn:
+        await conn.exec_driver_sql("ANALYZE")
+
+    recorded = []
+    label = None
+
+    def record(conn, cursor, statement, parameters, context, executemany):
+        if label and not executemany and "bookings" in statement:
+            if statement.lstrip().upper().startswith(READS):
+                recorded.append((label, statement, parameters))
+
+    event.listen(engine.sync_engine, "before_cursor_execute", record)
+    try:
+        for label, call in cases(dataset).items():
+            async with async_session_maker() as db:
+                try:
+                    await call(db)
+                except ValueError:
+                    # Conflicts are expected, the statements are what matters
+                    pass
+    finally:
+        label = None
+        event.remove(engine.sync_engine, "before_cursor_execute", record)
+
+    failures = 0
+    async with engine.connect() as conn:
+        checked = set()
+        for label, statement, parameters in recorded:
+            if statement in checked:
+                continue
+            checked.add(statement)
+            scans = await sequential_scans(conn, statement, parameters, options.min_rows)
+            if scans:
+                failures += 1
+                print(f"FAIL {label}: sequential scan of {', '.join(scans)}\n  {statement}\n")
+            else:
+                print(f"ok   {label}")
+    print(f"{len(checked)} statements, {failures} with a sequential scan", file=sys.stderr)
+    return 1 if failures else 0
+
+
+def main(argv=None):
+    options = parse_args(argv)
+    os.environ["DATABASE_URL"] = options.database_url
+    os.environ.setdefault("SENTRY_DSN", "")
+    os.environ.setdefault("DB_SLOW_QUERY_MS", "0")
+    logging.getLogger("passlib").setLevel(logging.ERROR)
+    raise SystemExit(asyncio.run(run(options)))
+
+
+if __name__ == "__main__":
+    main()
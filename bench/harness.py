@@ -0,0 +1,98 @@
+import asyncio
+import itertools
+import time
+from collections import Counter, defaultdict
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import httpx
+
+
+# Nearest-rank percentile of an already sorted list
+def percentile(values: List[float], fraction: float) -> float:
+    if not values:
+        return 0.0
+    rank = max(int(round(fraction * len(values) + 0.5)) - 1, 0)
+    return values[min(rank, len(values) - 1)]
+
+
+# Collects latency and status of every request, grouped by endpoint label.
+# Labels are route templates ("GET /bookings/{booking_id}") so that runs with
+# different ids still line up in the report.
+class Recorder:
+    def __init__(self, client: httpx.AsyncClient):
+        self.client = client
+        self.latencies: Dict[str, List[float]] = defaultdict(list)
+        self.statuses: Dict[str, Counter] = defaultdict(Counter)
+        self.started = time.perf_counter()
+        self.finished: Optional[float] = None
+
+    async def request(
+        self, method: str, url: str, label: Optional[str] = None, **kwargs
+    ) -> Optional[httpx.Response]:
+        label = label or f"{method} {url}"
+        started = time.perf_counter()
+        try:
+            response = await self.client.request(method, url, **kwargs)
+        except Exception as e:
+            self.latencies[label].append(time.perf_counter() - started)
+            self.statuses[label][type(e).__name__] += 1
+            return None
+        self.latencies[label].append(time.perf_counter() - started)
+        self.statuses[label][str(response.status_code)] += 1
+        return response
+
+    # Start the clock over, e.g. after a workload's untimed setup requests
+    def reset_clock(self):
+        self.started = time.perf_counter()
+
+    def stop(self):
+        self.finished = time.perf_counter()
+
+    @property
+    def wall_seconds(self) -> float:
+        return (self.finished or time.perf_counter()) - self.started
+
+    def report(self) -> dict:
+        wall = self.wall_seconds
+        endpoints = {}
+        for label in self.latencies:
+            latencies = sorted(self.latencies[label])
+            statuses = self.statuses[label]
+            # 4xx answers such as booking conflicts are expected outcomes,
+            # only server errors and transport failures count as errors
+            errors = sum(
+                count for code, count in statuses.items() if code[0] not in "1234"
+            )
+            endpoints[label] = {
+                "requests": len(latencies),
+                "errors": errors,
+                "statuses": dict(sorted(statuses.items())),
+                "throughput_rps": round(len(latencies) / wall, 2) if wall else 0.0,
+                "latency_ms": {
+                    "mean": round(sum(latencies) / len(latencies) * 1000, 3),
+                    "p50": round(percentile(latencies, 0.50) * 1000, 3),
+                    "p95": round(percentile(latencies, 0.95) * 1000, 3),
+                    "p99": round(percentile(latencies, 0.99) * 1000, 3),
+                    "max": round(latencies[-1] * 1000, 3),
+                },
+            }
+        total = sum(len(latencies) for latencies in self.latencies.values())
+        return {
+            "wall_seconds": round(wall, 3),
+            "requests": total,
+            "throughput_rps": round(total / wall, 2) if wall else 0.0,
+            "endpoints": endpoints,
+        }
+
+
+# Run `task(i)` for i in range(total) with at most `concurrency` in flight
+async def run_concurrent(
+    total: int, concurrency: int, task: Callable[[int], Awaitable[None]]
+):
+    counter = itertools.count()
+
+    async def worker():
+        while (i := next(counter)) < total:
+            await task(i)
+
+    await asyncio.gather(*(worker() for _ in range(min(concurrency, total))))
@@ -0,0 +1,119 @@
+from dataclasses import dataclass, field
+from datetime import datetime, timedelta
+from typing import List
+
+from sqlalchemy import func, insert, select
+
+from app import migrations
+from app.auth import pwd_context
+from app.models import Base, Booking, Office, Room, User
+
+PASSWORD = "bench-password"
+CHUNK_SIZE = 5000
+# Seeded bookings start here and are one hour long, back to back per room
+SEED_START = datetime(2030, 1, 1, 8, 0)
+
+
+@dataclass
+class Dataset:
+    office_ids: List[int] = field(default_factory=list)
+    room_ids: List[int] = field(default_factory=list)
+    usernames: List[str] = field(default_factory=list)
+    bookings: int = 0
+    # First free hour after every seeded booking
+    free_from: datetime = SEED_START
+
+
+async def _insert_chunks(conn, model, rows):
+    for i in range(0, len(rows), CHUNK_SIZE):
+        await conn.execute(insert(model), rows[i : i + CHUNK_SIZE])
+
+
+# Recreate the schema and fill it with offices, rooms, bookings and users.
+# Rows are written with executemany inserts, not through the API, so seeding
+# a large table takes seconds rather than minutes.
+async def seed(
+    engine,
+    offices: int,
+    rooms_per_office: int,
+    bookings_per_room: int,
+    users: int,
+):
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(migrations.schema_migrations.drop, checkfirst=True)
+    # The schema production gets, indexes included
+    await migrations.upgrade(engine)
+
+    async with engine.begin() as conn:
+        # Every user shares one hash; hashing each would dominate the seed time
+        hashed = pwd_context.hash(PASSWORD)
+        await _insert_chunks(
+            conn,
+            User,
+            [
+                {"username": f"bench-user-{i}", "hashed_password": hashed}
+                for i in range(users)
+            ],
+        )
+        await _insert_chunks(
+            conn,
+            Office,
+            [
+                {"name": f"Office {i}", "location": f"City {i % 10}"}
+                for i in range(offices)
+            ],
+        )
+        office_ids = (await conn.execute(select(Office.id).order_by(Office.id))).scalars().all()
+        await _insert_chunks(
+            conn,
+            Room,
+            [
+                {"name": f"Room {j}", "capacity": 2 + j % 12, "office_id": office_id}
+                for office_id in office_ids
+                for j in range(rooms_per_office)
+            ],
+        )
+        room_ids = (await conn.execute(select(Room.id).order_by(Room.id))).scalars().all()
+
+        rows = []
+        for room_id in room_ids:
+            for k in range(bookings_per_room):
+                start = SEED_START + timedelta(hours=k)
+                rows.append(
+                    {
+                        "room_id": room_id,
+                        "user_id": 1 + (room_id + k) % max(users, 1),
+                        "start_time": start,
+                        "end_time": start + timedelta(hours=1),
+                    }
+                )
+            if len(rows) >= CHUNK_SIZE:
+                await _insert_chunks(conn, Booking, rows)
+                rows = []
+        await _insert_chunks(conn, Booking, rows)
+
+
+# Describe whatever is in the database, seeded by this run or an earlier one
+async def load_dataset(engine) -> Dataset:
+    async with engine.connect() as conn:
+        office_ids = (await conn.execute(select(Office.id).order_by(Office.id))).scalars().all()
+        room_ids = (await conn.execute(select(Room.id).order_by(Room.id))).scalars().all()
+        usernames = (
+            await conn.execute(
+                select(User.username)
+                .filter(User.username.like("bench-user-%"))
+                .order_by(User.id)
+            )
+        ).scalars().all()
+        bookings, last_end = (
+            await conn.execute(select(func.count(Booking.id), func.max(Booking.end_time)))
+        ).one()
+    free_from = max(last_end or SEED_START, SEED_START) + timedelta(days=1)
+    return Dataset(
+        office_ids=list(office_ids),
+        room_ids=list(room_ids),
+        usernames=list(usernames),
+        bookings=bookings,
+        free_from=free_from.replace(hour=0, minute=0, second=0, microsecond=0),
+    )
@@ -0,0 +1,400 @@
+import asyncio
+import random
+import time
+from datetime import timedelta
+from typing import Callable, Dict, Optional
+
+from sqlalchemy import and_, func, select
+from sqlalchemy.orm import aliased
+
+from app import settings
+from app.database import engine
+from app.models import Booking
+from app.pagination import MAX_PAGE_SIZE
+
+from .harness import Recorder, run_concurrent
+from .seed import PASSWORD, Dataset
+
+# name -> async workload(recorder, dataset, options) returning extra report fields
+WORKLOADS: Dict[str, Callable] = {}
+
+
+def workload(name: str):
+    def register(func):
+        WORKLOADS[name] = func
+        return func
+
+    return register
+
+
+def _booking(room_id: int, user_id: int, start, hours: float = 1.0) -> dict:
+    return {
+        "room_id": room_id,
+        "user_id": user_id,
+        "start_time": start.isoformat(),
+        "end_time": (start + timedelta(hours=hours)).isoformat(),
+    }
+
+
+# Many users logging in at once: bcrypt on the hashing pool plus the user lookup
+@workload("login_storm")
+async def login_storm(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    if not dataset.usernames:
+        raise SystemExit("login_storm needs seeded users (--users)")
+    rng = random.Random(options.random_seed)
+
+    async def login(i):
+        await recorder.request(
+            "POST",
+            "/auth/login",
+            json={"username": rng.choice(dataset.usernames), "password": PASSWORD},
+        )
+
+    await run_concurrent(options.requests, options.concurrency, login)
+    return None
+
+
+# Bookings that overlap another booking of the same room
+async def count_double_bookings(room_ids) -> int:
+    other = aliased(Booking)
+    query = (
+        select(func.count())
+        .select_from(Booking)
+        .join(
+            other,
+            and_(
+                other.room_id == Booking.room_id,
+                other.id > Booking.id,
+                other.start_time < Booking.end_time,
+                other.end_time > Booking.start_time,
+            ),
+        )
+        .filter(Booking.room_id.in_(room_ids))
+    )
+    async with engine.connect() as conn:
+        return (await conn.execute(query)).scalar_one()
+
+
+# Concurrent POST /bookings/ on a few hot rooms with overlapping half-hour
+# offsets, so most requests race for the same slots. Afterwards the hot rooms
+# are checked for double bookings.
+@workload("booking_contention")
+async def booking_contention(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    hot_rooms = dataset.room_ids[: options.hot_rooms]
+    if not hot_rooms:
+        raise SystemExit("booking_contention needs seeded rooms (--offices, --rooms-per-office)")
+    rng = random.Random(options.random_seed)
+    day = dataset.free_from
+
+    async def book(i):
+        start = day + timedelta(minutes=30 * rng.randrange(16))
+        await recorder.request(
+            "POST",
+            "/bookings/",
+            json=_booking(rng.choice(hot_rooms), 1 + i % 100, start),
+        )
+
+    await run_concurrent(options.requests, options.concurrency, book)
+    return {
+        "hot_rooms": len(hot_rooms),
+        "double_bookings": await count_double_bookings(hot_rooms),
+    }
+
+
+# The same number of non-overlapping bookings written to one room and then
+# spread over --spread-rooms rooms. Writes to one room are serialized by the
+# admission locks; spread over many rooms they should go through in parallel.
+@workload("admission")
+async def admission(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    spread_rooms = dataset.room_ids[: options.spread_rooms]
+    if len(spread_rooms) < 2:
+        raise SystemExit("admission needs seeded rooms (--offices, --rooms-per-office)")
+    throughput = {}
+    start = dataset.free_from
+    for rooms in ([spread_rooms[0]], spread_rooms):
+        label = f"POST /bookings/ ({len(rooms)} room{'s' if len(rooms) > 1 else ''})"
+        base = start
+
+        async def book(i):
+            slot = base + timedelta(hours=i // len(rooms))
+            await recorder.request(
+                "POST", "/bookings/", label=label, json=_booking(rooms[i % len(rooms)], 1, slot)
+            )
+
+        started = time.perf_counter()
+        await run_concurrent(options.requests, options.concurrency, book)
+        throughput[label] = round(options.requests / (time.perf_counter() - started), 2)
+        start += timedelta(hours=options.requests + 24)
+    return {
+        "rooms": len(spread_rooms),
+        "throughput_rps_by_rooms": throughput,
+        "double_bookings": await count_double_bookings(spread_rooms),
+    }
+
+
+def _page_label(page: int) -> str:
+    if page == 1:
+        return "GET /bookings/ page 1"
+    if page <= 10:
+        return "GET /bookings/ pages 2-10"
+    if page <= 100:
+        return "GET /bookings/ pages 11-100"
+    return "GET /bookings/ pages 101+"
+
+
+# Walk /bookings/ by cursor, `concurrency` walkers at once. Latency is reported
+# per depth bucket, so a listing whose cost grows with depth shows up at once.
+@workload("deep_pagination")
+async def deep_pagination(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    deepest = 0
+
+    async def walk(i):
+        nonlocal deepest
+        cursor = None
+        for page in range(1, options.pages + 1):
+            params = {"size": options.page_size}
+            if cursor:
+                params["cursor"] = cursor
+            response = await recorder.request(
+                "GET", "/bookings/", label=_page_label(page), params=params
+            )
+            if response is None or response.status_code != 200:
+                return
+            deepest = max(deepest, page)
+            cursor = response.json()["next_cursor"]
+            if cursor is None:
+                return
+
+    await run_concurrent(options.concurrency, options.concurrency, walk)
+    return {"page_size": options.page_size, "deepest_page": deepest}
+
+
+# Full pages of /bookings/ rendered both ways in the same run: through the
+# response model (ORM objects validated by pydantic) and through the column
+# tuple + orjson fast path. Both share the recorder's wall clock, so the
+# throughput of each is reported separately, along with whether both gave
+# the same documents.
+@workload("list_serialization")
+async def list_serialization(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    if dataset.bookings < MAX_PAGE_SIZE:
+        raise SystemExit(f"list_serialization needs at least {MAX_PAGE_SIZE} bookings")
+    params = {"size": MAX_PAGE_SIZE}
+    bodies = {}
+    throughput = {}
+    previous = settings.FAST_LIST_SERIALIZATION
+    try:
+        for fast in (False, True):
+            settings.FAST_LIST_SERIALIZATION = fast
+            mode = "fast" if fast else "model"
+            label = f"GET /bookings/ size={MAX_PAGE_SIZE} ({mode})"
+            first = await recorder.client.get("/bookings/", params=params)
+            bodies[fast] = first.json()
+
+            async def fetch(i):
+                await recorder.request("GET", "/bookings/", label=label, params=params)
+
+            started = time.perf_counter()
+            await run_concurrent(options.requests, options.concurrency, fetch)
+            throughput[mode] = round(options.requests / (time.perf_counter() - started), 2)
+    finally:
+        settings.FAST_LIST_SERIALIZATION = previous
+    return {
+        "page_size": MAX_PAGE_SIZE,
+        "throughput_rps_by_mode": throughput,
+        "identical": bodies[False] == bodies[True],
+    }
+
+
+# A popular office page opened by many clients at once: each fetches the
+# office and its rooms one by one, all clients asking for the same ids.
+# Concurrent lookups of one id share a query and lookups of different ids in
+# the same loop pass are batched; the loader counters show how many queries
+# the requests actually cost.
+@workload("fan_out")
+async def fan_out(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    from app.cache import entity_cache
+    from app.crud import office_loader, room_loader
+
+    if not dataset.office_ids:
+        raise SystemExit("fan_out needs seeded offices and rooms")
+    office_id = dataset.office_ids[0]
+    rooms = await recorder.client.get("/rooms/", params={"office_id": office_id})
+    room_ids = [room["id"] for room in rooms.json()["items"]]
+    # Start cold, so the shared loads are what gets measured
+    if entity_cache.backend is not None:
+        entity_cache.backend.forget(
+            f"office:{office_id}", *[f"room:{room_id}" for room_id in room_ids]
+        )
+    before = {"offices": office_loader.stats(), "rooms": room_loader.stats()}
+    recorder.reset_clock()
+
+    async def open_page(i):
+        await recorder.request("GET", f"/offices/{office_id}", label="GET /offices/{office_id}")
+        await asyncio.gather(
+            *(
+                recorder.request("GET", f"/rooms/{room_id}", label="GET /rooms/{room_id}")
+                for room_id in room_ids
+            )
+        )
+
+    await run_concurrent(options.requests, options.concurrency, open_page)
+    after = {"offices": office_loader.stats(), "rooms": room_loader.stats()}
+    return {
+        "rooms_per_page": len(room_ids),
+        "loader_batches": {
+            name: after[name]["batches"] - before[name]["batches"] for name in after
+        },
+        "entity_cache": entity_cache.stats(),
+    }
+
+
+# Read-heavy traffic over every kind of endpoint with some booking writes
+@workload("mixed")
+async def mixed(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    if not dataset.room_ids or not dataset.usernames:
+        raise SystemExit("mixed needs seeded rooms and users")
+    rng = random.Random(options.random_seed)
+
+    login = await recorder.client.post(
+        "/auth/login", json={"username": dataset.usernames[0], "password": PASSWORD}
+    )
+    headers = {"Authorization": f"Bearer {login.json()['access_token']}"}
+    window_start = dataset.free_from + timedelta(days=1)
+    recorder.reset_clock()
+
+    async def get_office():
+        office_id = rng.choice(dataset.office_ids)
+        await recorder.request("GET", f"/offices/{office_id}", label="GET /offices/{office_id}")
+
+    async def get_room():
+        room_id = rng.choice(dataset.room_ids)
+        await recorder.request("GET", f"/rooms/{room_id}", label="GET /rooms/{room_id}")
+
+    async def list_rooms():
+        await recorder.request(
+            "GET", "/rooms/", params={"office_id": rng.choice(dataset.office_ids)}
+        )
+
+    async def list_room_bookings():
+        await recorder.request(
+            "GET", "/bookings/", params={"room_id": rng.choice(dataset.room_ids)}
+        )
+
+    async def availability():
+        office_id = rng.choice(dataset.office_ids)
+        start = window_start + timedelta(days=rng.randrange(7))
+        await recorder.request(
+            "GET",
+            f"/offices/{office_id}/availability",
+            label="GET /offices/{office_id}/availability",
+            params={
+                "start_time": start.isoformat(),
+                "end_time": (start + timedelta(days=1)).isoformat(),
+                "duration_minutes": 60,
+            },
+        )
+
+    async def create_booking():
+        start = window_start + timedelta(hours=rng.randrange(24 * 30))
+        await recorder.request(
+            "POST",
+            "/bookings/",
+            json=_booking(rng.choice(dataset.room_ids), rng.randrange(1, 100), start),
+        )
+
+    async def me():
+        await recorder.request("GET", "/auth/me", headers=headers)
+
+    operations = [
+        (get_office, 20),
+        (get_room, 20),
+        (list_rooms, 15),
+        (list_room_bookings, 20),
+        (availability, 10),
+        (create_booking, 10),
+        (me, 5),
+    ]
+    choices = [operation for operation, _ in operations]
+    weights = [weight for _, weight in operations]
+
+    async def step(i):
+        await rng.choices(choices, weights)[0]()
+
+    await run_concurrent(options.requests, options.concurrency, step)
+    return None
+
+
+# More clients than the service admits at once (--concurrency well above
+# the gate's capacity, lowered here to a quarter of it), once without and
+# once with load shedding: writes, room listings and analytics reports side
+# by side. With shedding, the analytics reports are turned away first and
+# the latency of the requests that are admitted stays bounded.
+@workload("overload")
+async def overload(recorder: Recorder, dataset: Dataset, options) -> Optional[dict]:
+    from app.shedding import shedder
+
+    if not dataset.room_ids:
+        raise SystemExit("overload needs seeded rooms and offices")
+    rng = random.Random(options.random_seed)
+    day = dataset.free_from.date()
+    shed = {}
+    throughput = {}
+    previous = settings.SHED_ENABLED, shedder.gate.capacity
+    try:
+        shedder.gate.capacity = max(options.concurrency // 4, 1)
+        for enabled in (False, True):
+            settings.SHED_ENABLED = enabled
+            mode = "shedding" if enabled else "no shedding"
+            window_start = dataset.free_from + timedelta(days=60 if enabled else 30)
+            before = shedder.stats()
+
+            async def create_booking():
+                start = window_start + timedelta(hours=rng.randrange(24 * 28))
+                await recorder.request(
+                    "POST",
+                    "/bookings/",
+                    label=f"POST /bookings/ ({mode})",
+                    json=_booking(rng.choice(dataset.room_ids), rng.randrange(1, 100), start),
+                )
+
+            async def list_room_bookings():
+                await recorder.request(
+                    "GET",
+                    "/bookings/",
+                    label=f"GET /bookings/ ({mode})",
+                    params={"room_id": rng.choice(dataset.room_ids)},
+                )
+
+            async def utilization():
+                office_id = rng.choice(dataset.office_ids)
+                await recorder.request(
+                    "GET",
+                    f"/analytics/offices/{office_id}/utilization",
+                    label=f"GET /analytics/offices/{{office_id}}/utilization ({mode})",
+                    params={
+                        "start_date": (day - timedelta(days=30)).isoformat(),
+                        "end_date": day.isoformat(),
+                    },
+                )
+
+            operations = [create_booking, list_room_bookings, utilization]
+
+            async def step(i):
+                await rng.choices(operations, [20, 50, 30])[0]()
+
+            started = time.perf_counter()
+            await run_concurrent(options.requests, options.concurrency, step)
+            throughput[mode] = round(options.requests / (time.perf_counter() - started), 2)
+            after = shedder.stats()
+            shed[mode] = {
+                key: after[key] - before[key]
+                for key in after
+                if key.startswith(("admitted_", "shed_"))
+            }
+    finally:
+        settings.SHED_ENABLED, shedder.gate.capacity = previous
+    return {
+        "max_in_flight": max(options.concurrency // 4, 1),
+        "throughput_rps_by_mode": throughput,
+        "admitted_and_shed_by_mode": shed,
+    }
@@ -0,0 +1,56 @@
+import os
+import sys
+import tempfile
+
+import pytest
+
+# Settings are read at import: the app gets a throwaway SQLite database unless
+# DATABASE_URL points somewhere (a PostgreSQL one enables the tests needing it)
+os.environ.setdefault(
+    "DATABASE_URL", "sqlite+aiosqlite:///" + os.path.join(tempfile.mkdtemp(), "test.db")
+)
+os.environ["SENTRY_DSN"] = ""
+os.environ.setdefault("BCRYPT_ROUNDS", "4")
+os.environ.setdefault("DB_SLOW_QUERY_MS", "0")
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def anyio_backend():
+    return "asyncio"
+
+
+requires_postgres = pytest.mark.skipif(
+    not os.environ["DATABASE_URL"].startswith("postgresql"),
+    reason="needs DATABASE_URL pointing to a PostgreSQL database",
+)
+
+
+# A session on the app's database, with the tables of the models created
+# for the test and dropped after it
+@pytest.fixture
+async def db():
+    from app.cache import entity_cache, make_backend
+    from app.database import async_session_maker, engine
+    from app.models import Base
+
+    # Ids start over with the tables: drop what earlier tests cached
+    entity_cache.backend = make_backend()
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    async with async_session_maker() as session:
+        yield session
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+
+
+@pytest.fixture
+async def client(db):
+    import httpx
+
+    from app.main import app
+
+    async with app.router.lifespan_context(app):
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            yield client
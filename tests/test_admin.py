@@ -0,0 +1,105 @@
+from datetime import date, datetime
+
+import pytest
+from sqlalchemy import select
+
+from app.models import Booking, Office, Room, RoomUsageDaily
+
+
+@pytest.fixture
+async def office_id(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.commit()
+    return office.id
+
+
+# An admin edit changes the ETag and the cached office
+@pytest.mark.anyio
+async def test_admin_office_edit_invalidates(client, office_id):
+    response = await client.get(f"/offices/{office_id}")
+    etag = response.headers["etag"]
+
+    response = await client.post(
+        f"/admin/office/edit/{office_id}", data={"name": "Head office", "location": "Tashkent"}
+    )
+    assert response.status_code == 302
+
+    response = await client.get(f"/offices/{office_id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["name"] == "Head office"
+
+
+@pytest.mark.anyio
+async def test_admin_booking_edit_updates_rollups(client, db, office_id):
+    room = Room(name="A", office_id=office_id)
+    db.add(room)
+    await db.flush()
+    booking = Booking(
+        room_id=room.id,
+        user_id=1,
+        start_time=datetime(2030, 1, 1, 9, 0),
+        end_time=datetime(2030, 1, 1, 10, 0),
+    )
+    db.add(booking)
+    await db.commit()
+    response = await client.get(f"/bookings/{booking.id}")
+    etag = response.headers["etag"]
+
+    response = await client.post(
+        f"/admin/booking/edit/{booking.id}",
+        data={
+            "room": str(room.id),
+            "user_id": "1",
+            "start_time": "2030-01-02 09:00:00",
+            "end_time": "2030-01-02 11:00:00",
+        },
+    )
+    assert response.status_code == 302
+
+    response = await client.get(f"/bookings/{booking.id}", headers={"If-None-Match": etag})
+    assert response.status_code == 200
+    assert response.json()["end_time"] == "2030-01-02T11:00:00"
+    usage = await db.execute(select(RoomUsageDaily.day, RoomUsageDaily.booked_seconds))
+    assert sorted(usage.all()) == [(date(2030, 1, 1), -3600), (date(2030, 1, 2), 7200)]
+
+
+# A replica that has not seen the office yet
+@pytest.fixture
+async def lagging_replica(monkeypatch, tmp_path):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    from app.models import Base
+    from app.replicas import replica_router
+
+    replica = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'replica.db'}")
+    async with replica.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+    monkeypatch.setattr(replica_router, "choose", lambda: replica)
+    yield replica
+    await replica.dispose()
+
+
+@pytest.mark.anyio
+async def test_admin_reads_lists_from_the_replica(client, office_id, lagging_replica):
+    response = await client.get("/admin/office/list")
+    assert response.status_code == 200
+    assert "Tashkent" not in response.text
+
+
+@pytest.mark.anyio
+async def test_admin_writes_load_from_the_primary(client, db, office_id, lagging_replica):
+    response = await client.get(f"/admin/office/edit/{office_id}")
+    assert response.status_code == 200
+    assert "Tashkent" in response.text
+
+    response = await client.post(
+        f"/admin/office/edit/{office_id}", data={"name": "HQ", "location": "Samarkand"}
+    )
+    assert response.status_code == 302
+    assert (await db.get(Office, office_id, populate_existing=True)).location == "Samarkand"
+
+    response = await client.delete("/admin/office/delete", params={"pks": office_id})
+    assert response.status_code == 200
+    db.expunge_all()
+    assert await db.get(Office, office_id) is None
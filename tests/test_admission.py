@@ -0,0 +1,46 @@
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import admission, crud, settings
+from app.models import Booking, Office, Room
+
+START = datetime(2030, 1, 1, 9, 0)
+
+
+@pytest.fixture
+async def room_id(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", office_id=office.id)
+    db.add(room)
+    await db.flush()
+    db.add(Booking(room_id=room.id, user_id=1, start_time=START, end_time=START + timedelta(hours=1)))
+    await db.commit()
+    return room.id
+
+
+# The hint check must not leave the request's session holding a connection
+# while the request then queues for the busy room
+@pytest.mark.anyio
+async def test_contended_conflict_leaves_request_session_idle(db, room_id, monkeypatch):
+    monkeypatch.setattr(settings, "BOOKING_ROOM_LOCKS", True)
+    held, release = asyncio.Event(), asyncio.Event()
+
+    async def hold_room():
+        async with admission.room_locks.hold([room_id]):
+            held.set()
+            await release.wait()
+
+    holder = asyncio.create_task(hold_room())
+    await held.wait()
+    try:
+        end = START + timedelta(minutes=90)
+        assert await crud._contended_conflict(db, room_id, START, end)
+        assert not await crud._contended_conflict(db, room_id, end, end + timedelta(hours=1))
+        assert not db.in_transaction()
+    finally:
+        release.set()
+        await holder
@@ -0,0 +1,33 @@
+from datetime import datetime
+from types import SimpleNamespace
+
+import pytest
+
+from app import analytics
+
+
+class RecordingSession:
+    def __init__(self):
+        self.bind = SimpleNamespace(dialect=SimpleNamespace(name="postgresql"))
+        self.rows = []
+
+    async def execute(self, statement, rows):
+        self.rows.append(rows)
+
+
+# Rollup rows are upserted in key order whatever order the bookings came in
+@pytest.mark.anyio
+async def test_usage_rows_are_upserted_in_key_order():
+    delta = analytics.UsageDelta()
+    delta.add_booking(7, datetime(2030, 1, 2, 9), datetime(2030, 1, 2, 11))
+    delta.add_booking(3, datetime(2030, 1, 3, 14), datetime(2030, 1, 3, 15))
+    delta.add_booking(3, datetime(2030, 1, 1, 9), datetime(2030, 1, 1, 10))
+    delta.cancel(1, datetime(2030, 1, 5, 9))
+
+    session = RecordingSession()
+    await delta.apply(session)
+    hourly, daily = session.rows
+    assert [(r["room_id"], r["day"].day, r["hour"]) for r in hourly] == [
+        (3, 1, 9), (3, 3, 14), (7, 2, 9), (7, 2, 10)
+    ]
+    assert [(r["room_id"], r["day"].day) for r in daily] == [(1, 5), (3, 1), (3, 3), (7, 2)]
@@ -0,0 +1,89 @@
+import time
+
+import pytest
+from fastapi import HTTPException
+
+from app import auth
+from app.pubsub import broadcast
+from app.token_cache import REVOCATION_CHANNEL, token_cache, token_digest
+
+
+@pytest.fixture(autouse=True)
+def empty_cache():
+    token_cache.clear()
+    token_cache._revoked.clear()
+    yield
+    token_cache.clear()
+    token_cache._revoked.clear()
+
+
+async def _login(client) -> str:
+    credentials = {"username": "ada", "password": "secret"}
+    await client.post("/auth/register", json=credentials)
+    response = await client.post("/auth/login", json=credentials)
+    return response.json()["access_token"]
+
+
+@pytest.mark.anyio
+async def test_logout_revokes_the_token(client):
+    token = await _login(client)
+    headers = {"Authorization": f"Bearer {token}"}
+    assert (await client.get("/auth/me", headers=headers)).status_code == 200
+    assert (await client.post("/auth/logout", headers=headers)).status_code == 200
+    assert (await client.get("/auth/me", headers=headers)).status_code == 401
+
+
+# Not in the cache when revoked: still refused until the token's own expiry
+@pytest.mark.anyio
+async def test_revocation_lasts_until_exp(monkeypatch):
+    token = auth.create_access_token({"sub": "1"})
+    exp = auth.verify_token(token)["exp"]
+    await auth.revoke_token(token)
+    assert token_cache._revoked[token_digest(token)] == exp
+
+    now = time.time()
+    monkeypatch.setattr(time, "time", lambda: now + token_cache.ttl + 1)
+    assert token_cache.is_revoked(token)
+
+
+@pytest.mark.anyio
+async def test_invalid_tokens_are_not_remembered(client):
+    response = await client.post("/auth/logout", headers={"Authorization": "Bearer junk"})
+    assert response.status_code == 401
+    assert token_cache.stats()["revoked"] == 0
+
+
+@pytest.mark.anyio
+async def test_revocation_reaches_other_workers(monkeypatch):
+    published = []
+
+    async def publish(channel, message, local=True):
+        published.append((channel, message, local))
+
+    monkeypatch.setattr(broadcast, "publish", publish)
+    token = auth.create_access_token({"sub": "1"})
+    await auth.revoke_token(token)
+    [(channel, message, local)] = published
+    assert channel == REVOCATION_CHANNEL and not local
+    assert token not in str(message)
+
+    # What another worker does with the message
+    token_cache._revoked.clear()
+    broadcast._deliver(channel, message)
+    with pytest.raises(HTTPException):
+        auth.get_token_entry(token)
+
+
+# A taken username is refused without hashing the password
+@pytest.mark.anyio
+async def test_duplicate_registration_skips_the_hash(client, monkeypatch):
+    credentials = {"username": "ada", "password": "secret"}
+    assert (await client.post("/auth/register", json=credentials)).status_code == 200
+
+    async def hash(password):
+        raise AssertionError("hashed a password for a taken username")
+
+    monkeypatch.setattr(auth.password_hasher, "hash", hash)
+    response = await client.post("/auth/register", json=credentials)
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Username already registered"
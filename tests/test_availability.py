@@ -0,0 +1,54 @@
+from datetime import datetime
+
+import pytest
+
+from app.models import Booking, Office, Room
+
+
+@pytest.fixture
+async def office_id(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", capacity=4, office_id=office.id)
+    db.add(room)
+    await db.flush()
+    db.add(
+        Booking(
+            room_id=room.id,
+            user_id=1,
+            start_time=datetime(2030, 1, 1, 9, 0),
+            end_time=datetime(2030, 1, 1, 10, 0),
+        )
+    )
+    await db.commit()
+    return office.id
+
+
+# Aware query times are taken as the UTC instants they stand for
+@pytest.mark.anyio
+async def test_availability_accepts_aware_times(client, office_id):
+    response = await client.get(
+        f"/offices/{office_id}/availability",
+        params={"start_time": "2030-01-01T13:00:00+05:00", "end_time": "2030-01-01T12:00:00Z"},
+    )
+    assert response.status_code == 200
+    windows = response.json()["rooms"][0]["free"]
+    assert windows == [
+        {"start_time": "2030-01-01T08:00:00", "end_time": "2030-01-01T09:00:00"},
+        {"start_time": "2030-01-01T10:00:00", "end_time": "2030-01-01T12:00:00"},
+    ]
+
+
+@pytest.mark.anyio
+async def test_office_details_accept_aware_times(client, office_id):
+    response = await client.get(
+        "/offices/detail",
+        params={
+            "ids": office_id,
+            "start_time": "2030-01-01T08:00:00Z",
+            "end_time": "2030-01-02T08:00:00",
+        },
+    )
+    assert response.status_code == 200
+    assert response.json()[0]["rooms"][0]["upcoming_bookings"] == 1
@@ -0,0 +1,98 @@
+import asyncio
+from datetime import datetime
+
+import pytest
+from sqlalchemy import event
+
+from app import crud, settings
+from app.database import engine
+from app.models import Booking, Office, Room
+
+
+@pytest.fixture
+async def ids(db):
+    offices = [Office(name=name, location="Tashkent") for name in ("HQ", "Branch")]
+    db.add_all(offices)
+    await db.flush()
+    rooms = [Room(name=name, office_id=offices[0].id) for name in "AB"]
+    db.add_all(rooms)
+    await db.flush()
+    bookings = [
+        Booking(
+            room_id=rooms[0].id,
+            user_id=1,
+            start_time=datetime(2030, 1, day, 9, 0),
+            end_time=datetime(2030, 1, day, 10, 0),
+        )
+        for day in (1, 2, 3)
+    ]
+    db.add_all(bookings)
+    await db.commit()
+    return {
+        "offices": [office.id for office in offices],
+        "rooms": [room.id for room in rooms],
+        "bookings": [booking.id for booking in bookings],
+    }
+
+
+# The SELECTs sent for a table while the block runs
+class Statements:
+    def __init__(self, table: str):
+        self.table = table
+        self.seen = []
+
+    def _record(self, conn, cursor, statement, parameters, context, executemany):
+        if statement.lstrip().upper().startswith("SELECT") and f"FROM {self.table}" in statement:
+            self.seen.append(statement)
+
+    def __enter__(self):
+        event.listen(engine.sync_engine, "before_cursor_execute", self._record)
+        return self.seen
+
+    def __exit__(self, *exc):
+        event.remove(engine.sync_engine, "before_cursor_execute", self._record)
+
+
+# Found ones in the order asked for, unknown and repeated ids left out
+@pytest.mark.anyio
+@pytest.mark.parametrize("kind", ["offices", "rooms", "bookings"])
+async def test_lookup_by_ids(client, ids, kind):
+    wanted = ids[kind][::-1]
+    response = await client.get(f"/{kind}/", params={"ids": wanted + [999, wanted[0]]})
+    assert response.status_code == 200
+    page = response.json()
+    assert [item["id"] for item in page["items"]] == wanted
+    assert (page["size"], page["next_cursor"]) == (len(wanted), None)
+
+
+@pytest.mark.anyio
+async def test_too_many_ids_are_refused(client, ids, monkeypatch):
+    monkeypatch.setattr(settings, "BATCH_MAX_IDS", 2)
+    response = await client.get("/bookings/", params={"ids": ids["bookings"]})
+    assert response.status_code == 400
+
+
+# One WHERE id IN (...) for all the ids of one request
+@pytest.mark.anyio
+async def test_ids_share_one_query(client, ids):
+    with Statements("bookings") as seen:
+        response = await client.get("/bookings/", params={"ids": ids["bookings"]})
+    assert len(response.json()["items"]) == 3
+    assert len(seen) == 1
+
+
+# Concurrent lookups of one room: one query, the rest served by it or the cache
+@pytest.mark.anyio
+async def test_concurrent_lookups_coalesce(db, ids):
+    room_id = ids["rooms"][0]
+    with Statements("rooms") as seen:
+        rooms = await asyncio.gather(*(crud.get_room(db, room_id) for _ in range(20)))
+    assert all(room["id"] == room_id for room in rooms)
+    assert len(seen) == 1
+
+    with Statements("rooms") as seen:
+        found = await asyncio.gather(
+            crud.get_rooms_by_id(db, ids["rooms"][1:]), crud.get_room(db, 999)
+        )
+    assert found == [[{"id": ids["rooms"][1], "name": "B", "capacity": None, "office_id": 1}], None]
+    assert len(seen) == 1
@@ -0,0 +1,140 @@
+import json
+from datetime import datetime
+
+import pytest
+from sqlalchemy import select
+
+from app import settings
+from app.models import Booking, Office, Room
+
+
+@pytest.fixture
+async def room_id(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", capacity=4, office_id=office.id)
+    db.add(room)
+    await db.flush()
+    db.add(
+        Booking(
+            room_id=room.id,
+            user_id=1,
+            start_time=datetime(2030, 1, 1, 9, 0),
+            end_time=datetime(2030, 1, 1, 10, 0),
+        )
+    )
+    await db.commit()
+    return room.id
+
+
+async def _stored_times(db):
+    result = await db.execute(
+        select(Booking.start_time, Booking.end_time).order_by(Booking.start_time)
+    )
+    return result.all()
+
+
+def _item(room_id, start_time, end_time):
+    return {"room_id": room_id, "user_id": 1, "start_time": start_time, "end_time": end_time}
+
+
+# Aware items are checked against the stored (naive UTC) bookings
+@pytest.mark.anyio
+async def test_bulk_accepts_aware_times(client, db, room_id):
+    response = await client.post(
+        "/bookings/bulk",
+        json=[
+            _item(room_id, "2030-01-01T10:00:00Z", "2030-01-01T11:00:00Z"),
+            _item(room_id, "2030-01-01T16:00:00+05:00", "2030-01-01T17:00:00+05:00"),
+        ],
+    )
+    assert response.status_code == 200
+    body = response.json()
+    assert body["created"] == 2
+    assert body["results"][1]["booking"]["start_time"] == "2030-01-01T11:00:00"
+    assert await _stored_times(db) == [
+        (datetime(2030, 1, 1, 9, 0), datetime(2030, 1, 1, 10, 0)),
+        (datetime(2030, 1, 1, 10, 0), datetime(2030, 1, 1, 11, 0)),
+        (datetime(2030, 1, 1, 11, 0), datetime(2030, 1, 1, 12, 0)),
+    ]
+
+
+# One item overlapping a stored booking: nothing is written
+@pytest.mark.anyio
+async def test_bulk_conflict_with_stored_booking(client, db, room_id):
+    response = await client.post(
+        "/bookings/bulk",
+        json=[
+            _item(room_id, "2030-01-01T10:00:00Z", "2030-01-01T11:00:00Z"),
+            _item(room_id, "2030-01-01T13:30:00+05:00", "2030-01-01T14:30:00+05:00"),
+        ],
+    )
+    assert response.status_code == 409
+    detail = response.json()["detail"]
+    assert (detail["created"], detail["failed"]) == (0, 1)
+    assert [result["status"] for result in detail["results"]] == ["skipped", "conflict"]
+    assert detail["results"][1]["detail"].startswith("Room is already booked")
+    assert len(await _stored_times(db)) == 1
+
+
+# Items overlapping each other, with naive and aware times mixed
+@pytest.mark.anyio
+async def test_bulk_conflict_within_request(client, db, room_id):
+    response = await client.post(
+        "/bookings/bulk",
+        json=[
+            _item(room_id, "2030-01-02T09:00:00", "2030-01-02T10:00:00"),
+            _item(room_id, "2030-01-02T14:30:00+05:00", "2030-01-02T15:00:00+05:00"),
+            _item(room_id, "2030-01-02T10:00:00Z", "2030-01-02T11:00:00"),
+            _item(room_id, "2030-01-02T12:00:00", "2030-01-02T12:00:00"),
+        ],
+    )
+    assert response.status_code == 409
+    results = response.json()["detail"]["results"]
+    assert [result["status"] for result in results] == ["skipped", "conflict", "skipped", "invalid"]
+    assert results[1]["detail"] == "Overlaps item 0 of this request."
+    assert len(await _stored_times(db)) == 1
+
+
+@pytest.mark.anyio
+async def test_export_accepts_aware_times(client, room_id):
+    response = await client.get(
+        "/bookings/export",
+        params={
+            "room_id": room_id,
+            "start_time": "2030-01-01T13:30:00+05:00",
+            "end_time": "2030-01-01T09:30:00Z",
+        },
+    )
+    assert response.status_code == 200
+    [line] = response.text.splitlines()
+    assert json.loads(line)["start_time"] == "2030-01-01T09:00:00"
+
+
+@pytest.mark.anyio
+async def test_list_accepts_aware_times(client, room_id):
+    response = await client.get(
+        "/bookings/",
+        params={"start_time": "2030-01-01T13:30:00+05:00", "end_time": "2030-01-01T09:30:00Z"},
+    )
+    assert response.status_code == 200
+    [booking] = response.json()["items"]
+    assert booking["start_time"] == "2030-01-01T09:00:00"
+
+
+@pytest.mark.anyio
+async def test_bulk_checks_across_batches(client, db, room_id, monkeypatch):
+    monkeypatch.setattr(settings, "BULK_BOOKING_BATCH_SIZE", 1)
+    items = [
+        _item(room_id, "2030-01-03T09:00:00", "2030-01-03T10:00:00"),
+        _item(room_id, "2030-01-03T10:00:00", "2030-01-03T11:00:00"),
+    ]
+    response = await client.post("/bookings/bulk", json=items + [items[0]])
+    assert response.status_code == 409
+    assert response.json()["detail"]["results"][2]["status"] == "conflict"
+
+    response = await client.post("/bookings/bulk", json=items)
+    assert response.status_code == 200
+    assert [result["booking"]["id"] for result in response.json()["results"]] == [2, 3]
+    assert len(await _stored_times(db)) == 3
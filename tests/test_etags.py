@@ -0,0 +1,96 @@
+import json
+
+import pytest
+
+from app.etags import Versions
+from app.pubsub import broadcast
+
+
+# The few Redis commands the versions use, over dicts
+class MemoryRedis:
+    def __init__(self):
+        self.values = {}
+        self.published = []
+
+    async def set(self, key, value, nx=False):
+        if nx and key in self.values:
+            return None
+        self.values[key] = str(value)
+        return True
+
+    async def get(self, key):
+        return self.values.get(key)
+
+    async def hget(self, key, field):
+        return self.values.get(key, {}).get(field)
+
+    async def hsetnx(self, key, field, value):
+        fields = self.values.setdefault(key, {})
+        if field in fields:
+            return 0
+        fields[field] = str(value)
+        return 1
+
+    async def hset(self, key, mapping):
+        self.values.setdefault(key, {}).update({f: str(v) for f, v in mapping.items()})
+        return len(mapping)
+
+    async def hincrby(self, key, field, amount):
+        fields = self.values.setdefault(key, {})
+        fields[field] = str(int(fields.get(field, 0)) + amount)
+        return int(fields[field])
+
+    async def publish(self, channel, payload):
+        self.published.append((channel, json.loads(payload)["data"]))
+
+    def pipeline(self, transaction=True):
+        return MemoryPipeline(self)
+
+
+class MemoryPipeline:
+    def __init__(self, redis):
+        self.redis = redis
+        self.calls = []
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def __getattr__(self, name):
+        return lambda *args, **kwargs: self.calls.append((name, args, kwargs))
+
+    async def execute(self):
+        return [await getattr(self.redis, name)(*a, **kw) for name, a, kw in self.calls]
+
+
+@pytest.mark.anyio
+async def test_workers_sharing_redis_agree_on_versions(monkeypatch):
+    redis = MemoryRedis()
+    monkeypatch.setattr(broadcast, "_redis", redis)
+    first, second = Versions(), Versions()
+
+    assert await first.token("bookings") == await second.token("bookings")
+    before = await second.token("bookings")
+
+    await first.publish("bookings", "booking:1")
+    [(_, message)] = redis.published
+    # What the second worker receives over the broadcast
+    second._on_remote_bump(message)
+    assert await first.token("bookings") == await second.token("bookings") != before
+    # A worker started later reads the same versions from Redis
+    assert await Versions().token("booking:1") == await first.token("booking:1")
+
+
+@pytest.mark.anyio
+async def test_conditional_get(client):
+    first = await client.get("/offices/")
+    etag = first.headers["etag"]
+    again = await client.get("/offices/", headers={"If-None-Match": etag})
+    assert again.status_code == 304
+
+    await client.post("/offices/", json={"name": "HQ", "location": "Tashkent"})
+    changed = await client.get("/offices/", headers={"If-None-Match": etag})
+    assert changed.status_code == 200
+    assert changed.headers["etag"] != etag
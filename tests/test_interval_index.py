@@ -0,0 +1,113 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import delete
+
+from app import settings
+from app.interval_index import RoomIntervals, booking_index
+from app.models import Booking, Office, Room
+
+DAY = datetime(2030, 1, 1)
+
+
+def at(hour: int) -> datetime:
+    return DAY + timedelta(hours=hour)
+
+
+def test_adjacent_intervals_do_not_conflict():
+    room = RoomIntervals.from_sorted([(1, at(9), at(10)), (2, at(11), at(12))])
+    assert room.find_conflict(at(10), at(11)) is None
+    assert room.find_conflict(at(8), at(9)) is None
+    assert room.find_conflict(at(12), at(13)) is None
+
+
+def test_overlapping_intervals_conflict():
+    room = RoomIntervals.from_sorted([(1, at(9), at(10)), (2, at(11), at(12))])
+    assert room.find_conflict(at(9), at(10)) == 1
+    assert room.find_conflict(at(8), at(10)) == 1
+    assert room.find_conflict(at(11) + timedelta(minutes=30), at(13)) == 2
+    assert room.find_conflict(at(9), at(12), exclude_id=1) == 2
+    assert room.find_conflict(at(9), at(10), exclude_id=1) is None
+
+
+# A long legacy booking covering later ones is found through max_ends
+def test_nested_intervals_conflict():
+    room = RoomIntervals.from_sorted(
+        [(1, at(8), at(18)), (2, at(9), at(10)), (3, at(12), at(13))]
+    )
+    assert room.max_ends == [at(18), at(18), at(18)]
+    assert room.find_conflict(at(15), at(16)) == 1
+    assert room.find_conflict(at(12), at(13), exclude_id=3) == 1
+
+
+def test_max_ends_after_remove():
+    room = RoomIntervals()
+    room.add(2, at(9), at(10))
+    room.add(1, at(8), at(18))
+    room.add(3, at(12), at(13))
+    assert room.ids == [1, 2, 3]
+
+    assert room.remove(1, at(8))
+    assert room.max_ends == [at(10), at(13)]
+    assert room.find_conflict(at(15), at(16)) is None
+    assert room.find_conflict(at(12), at(14)) == 3
+    assert not room.remove(1, at(8))
+    assert len(room) == 2
+
+
+@pytest.fixture
+async def room_id(db, monkeypatch):
+    monkeypatch.setattr(settings, "BOOKING_INDEX_ENABLED", True)
+    booking_index.invalidate()
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", office_id=office.id)
+    db.add(room)
+    await db.flush()
+    db.add(Booking(room_id=room.id, user_id=1, start_time=at(9), end_time=at(10)))
+    await db.commit()
+    yield room.id
+    booking_index.invalidate()
+
+
+@pytest.mark.anyio
+async def test_index_accepts_aware_times(client, room_id):
+    booking = {
+        "room_id": room_id,
+        "user_id": 1,
+        "start_time": "2030-01-01T14:30:00+05:00",
+        "end_time": "2030-01-01T15:30:00+05:00",
+    }
+    hits = booking_index.hits
+    response = await client.post("/bookings/", json=booking)
+    assert response.status_code == 400
+    assert booking_index.hits == hits + 1
+
+    booking.update(start_time="2030-01-01T10:00:00Z", end_time="2030-01-01T11:00:00Z")
+    response = await client.post("/bookings/", json=booking)
+    assert response.status_code == 200
+    booking_id = response.json()["id"]
+
+    booking.update(start_time="2030-01-01T16:00:00+05:00", end_time="2030-01-01T17:00:00+05:00")
+    response = await client.put(f"/bookings/{booking_id}", json=booking)
+    assert response.status_code == 200
+    assert response.json()["start_time"] == "2030-01-01T11:00:00"
+
+
+# A booking deleted by another worker (no Redis to tell this one) is still in
+# the index; the database is asked before the request is turned away
+@pytest.mark.anyio
+async def test_stale_index_hit_is_confirmed(client, db, room_id):
+    booking = {
+        "room_id": room_id,
+        "user_id": 1,
+        "start_time": at(9).isoformat(),
+        "end_time": at(10).isoformat(),
+    }
+    assert (await client.post("/bookings/", json=booking)).status_code == 400
+
+    await db.execute(delete(Booking).where(Booking.room_id == room_id))
+    await db.commit()
+    response = await client.post("/bookings/", json=booking)
+    assert response.status_code == 200
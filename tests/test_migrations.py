@@ -0,0 +1,168 @@
+import sqlite3
+from datetime import datetime
+
+import pytest
+from sqlalchemy import inspect, text
+from sqlalchemy.dialects import postgresql
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app import database, migrations
+from app.models import Base, Booking
+from app.migrations import v0001_initial
+from app.partitions import overlaps
+
+from .conftest import requires_postgres
+
+# What create_all made of the models before there were migrations
+BASELINE_SCHEMA = """
+CREATE TABLE offices (
+    id INTEGER NOT NULL, name VARCHAR NOT NULL, location VARCHAR NOT NULL, PRIMARY KEY (id)
+);
+CREATE INDEX ix_offices_id ON offices (id);
+CREATE INDEX ix_offices_name ON offices (name);
+CREATE INDEX ix_offices_location ON offices (location);
+CREATE TABLE users (
+    id INTEGER NOT NULL, username VARCHAR, hashed_password VARCHAR, PRIMARY KEY (id)
+);
+CREATE INDEX ix_users_id ON users (id);
+CREATE UNIQUE INDEX ix_users_username ON users (username);
+CREATE TABLE rooms (
+    id INTEGER NOT NULL, name VARCHAR NOT NULL, capacity INTEGER, office_id INTEGER,
+    PRIMARY KEY (id), FOREIGN KEY(office_id) REFERENCES offices (id)
+);
+CREATE INDEX ix_rooms_id ON rooms (id);
+CREATE TABLE bookings (
+    id INTEGER NOT NULL, room_id INTEGER, user_id INTEGER NOT NULL,
+    start_time DATETIME NOT NULL, end_time DATETIME NOT NULL,
+    PRIMARY KEY (id), FOREIGN KEY(room_id) REFERENCES rooms (id)
+);
+CREATE INDEX ix_bookings_id ON bookings (id);
+INSERT INTO offices (id, name, location) VALUES (1, 'HQ', 'Tashkent'), (2, 'HQ', 'Samarkand');
+INSERT INTO rooms (id, name, office_id) VALUES (1, 'A', 1), (2, 'B', 2);
+INSERT INTO bookings (room_id, user_id, start_time, end_time)
+VALUES (1, 1, '2030-01-01 08:00:00.000000', '2030-01-01 09:00:00.000000'),
+    (2, 1, '2030-01-01 11:00:00.000000', '2030-01-01 10:00:00.000000');
+"""
+
+
+def _schema(sync_conn):
+    inspector = inspect(sync_conn)
+    return {
+        table: (
+            sorted(column["name"] for column in inspector.get_columns(table)),
+            sorted((index["name"], bool(index["unique"])) for index in inspector.get_indexes(table)),
+        )
+        for table in inspector.get_table_names()
+        if table != "schema_migrations"
+    }
+
+
+@pytest.fixture
+async def engines(tmp_path):
+    baseline = tmp_path / "baseline.db"
+    with sqlite3.connect(baseline) as conn:
+        conn.executescript(BASELINE_SCHEMA)
+    migrated = create_async_engine(f"sqlite+aiosqlite:///{baseline}")
+    fresh = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'fresh.db'}")
+    yield migrated, fresh
+    await migrated.dispose()
+    await fresh.dispose()
+
+
+@pytest.mark.anyio
+async def test_upgrade_from_baseline_matches_models(engines):
+    migrated, fresh = engines
+    applied = await migrations.upgrade(migrated)
+    assert applied == [migrations.version_of(step) for step in migrations.STEPS]
+
+    async with fresh.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        expected = await conn.run_sync(_schema)
+    async with migrated.connect() as conn:
+        assert await conn.run_sync(_schema) == expected
+        offices = await conn.execute(text("SELECT id, name FROM offices ORDER BY id"))
+        assert offices.all() == [(1, "HQ"), (2, "HQ (2)")]
+        bookings = await conn.execute(
+            text("SELECT room_id, series_id, start_time, end_time FROM bookings ORDER BY id")
+        )
+        assert bookings.all() == [
+            (1, None, "2030-01-01 08:00:00.000000", "2030-01-01 09:00:00.000000"),
+            # Stored inverted, swapped by 0006
+            (2, None, "2030-01-01 10:00:00.000000", "2030-01-01 11:00:00.000000"),
+        ]
+
+    assert await migrations.upgrade(migrated) == []
+
+
+@pytest.mark.anyio
+async def test_downgrade_and_upgrade_again(engines):
+    migrated, _ = engines
+    await migrations.upgrade(migrated)
+    await migrations.downgrade(migrated, "0001")
+    async with migrated.connect() as conn:
+        schema = await conn.run_sync(_schema)
+    assert sorted(schema) == ["bookings", "offices", "rooms", "users"]
+    assert "series_id" not in schema["bookings"][0]
+    assert ("ix_offices_name", False) in schema["offices"][1]
+
+    await migrations.upgrade(migrated)
+    status = await migrations.status(migrated)
+    assert all(isinstance(step["applied_at"], datetime) for step in status)
+
+
+@pytest.mark.anyio
+async def test_upgrade_adopts_database_made_by_create_all(engines):
+    _, fresh = engines
+    async with fresh.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+        expected = await conn.run_sync(_schema)
+    await migrations.upgrade(fresh)
+    async with fresh.connect() as conn:
+        assert await conn.run_sync(_schema) == expected
+
+
+# tsrange only once the constraint is known to be there
+def test_range_overlaps_falls_back_to_comparisons(monkeypatch):
+    condition = overlaps(Booking, datetime(2030, 1, 1), datetime(2030, 1, 2))
+    dialect = postgresql.dialect()
+    monkeypatch.setattr(database, "use_tsrange", False)
+    assert "tsrange" not in str(condition.compile(dialect=dialect))
+    monkeypatch.setattr(database, "use_tsrange", True)
+    assert "tsrange" in str(condition.compile(dialect=dialect))
+
+
+@requires_postgres
+@pytest.mark.anyio
+async def test_inverted_bookings_are_fixed_and_refused(monkeypatch):
+    monkeypatch.setattr(database, "use_tsrange", False)
+    engine = database.engine
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.drop_all)
+        await conn.run_sync(migrations.schema_migrations.drop, checkfirst=True)
+        await conn.run_sync(v0001_initial.metadata.create_all)
+        await conn.execute(text("INSERT INTO offices (id, name, location) VALUES (1, 'HQ', 'Tashkent')"))
+        await conn.execute(text("INSERT INTO rooms (id, name, office_id) VALUES (1, 'A', 1)"))
+        await conn.execute(
+            text(
+                "INSERT INTO bookings (room_id, user_id, start_time, end_time)"
+                " VALUES (1, 1, '2030-01-01 11:00', '2030-01-01 10:00')"
+            )
+        )
+    try:
+        await migrations.upgrade(engine)
+        assert await database.detect_range_overlaps(engine)
+        async with engine.connect() as conn:
+            times = await conn.execute(text("SELECT start_time, end_time FROM bookings"))
+            assert times.all() == [(datetime(2030, 1, 1, 10), datetime(2030, 1, 1, 11))]
+            with pytest.raises(IntegrityError):
+                await conn.execute(
+                    text(
+                        "INSERT INTO bookings (room_id, user_id, start_time, end_time)"
+                        " VALUES (1, 1, '2030-01-02 11:00', '2030-01-02 10:00')"
+                    )
+                )
+    finally:
+        await migrations.downgrade(engine, "0")
+        async with engine.begin() as conn:
+            await conn.run_sync(migrations.schema_migrations.drop, checkfirst=True)
@@ -0,0 +1,78 @@
+from datetime import datetime
+
+import pytest
+
+from app.models import Booking, Office, Room
+
+
+@pytest.fixture
+async def room(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", capacity=4, office_id=office.id)
+    db.add(room)
+    await db.commit()
+    return room
+
+
+# The foreign keys refuse to orphan rooms and bookings
+@pytest.mark.anyio
+async def test_delete_with_children_conflicts(client, db, room):
+    booking = Booking(
+        room_id=room.id,
+        user_id=1,
+        start_time=datetime(2030, 1, 1, 9, 0),
+        end_time=datetime(2030, 1, 1, 10, 0),
+    )
+    db.add(booking)
+    await db.commit()
+
+    response = await client.delete(f"/offices/{room.office_id}")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Office still has rooms."
+    response = await client.delete(f"/rooms/{room.id}")
+    assert response.status_code == 409
+    assert response.json()["detail"] == "Room still has bookings."
+    assert (await client.get(f"/rooms/{room.id}")).status_code == 200
+
+    assert (await client.delete(f"/bookings/{booking.id}")).status_code == 200
+    assert (await client.delete(f"/rooms/{room.id}")).status_code == 200
+    assert (await client.delete(f"/offices/{room.office_id}")).status_code == 200
+    assert (await client.get(f"/offices/{room.office_id}")).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_missing_rows_are_not_found(client, room):
+    office = {"name": "Branch", "location": "Bukhara"}
+    assert (await client.put("/offices/999", json=office)).status_code == 404
+    assert (await client.delete("/offices/999")).status_code == 404
+
+    changed = {"name": "B", "capacity": 2, "office_id": room.office_id}
+    assert (await client.put("/rooms/999", json=changed)).status_code == 404
+    assert (await client.delete("/rooms/999")).status_code == 404
+
+    booking = {
+        "room_id": room.id,
+        "user_id": 1,
+        "start_time": "2030-01-01T09:00:00",
+        "end_time": "2030-01-01T10:00:00",
+    }
+    assert (await client.put("/bookings/999", json=booking)).status_code == 404
+    assert (await client.delete("/bookings/999")).status_code == 404
+
+
+@pytest.mark.anyio
+async def test_office_names_are_unique(client, room):
+    response = await client.post("/offices/", json={"name": "HQ", "location": "Bukhara"})
+    assert response.status_code == 409
+
+    response = await client.post("/offices/", json={"name": "Branch", "location": "Bukhara"})
+    assert response.status_code == 200
+    office_id = response.json()["id"]
+    response = await client.put(f"/offices/{office_id}", json={"name": "HQ", "location": "Bukhara"})
+    assert response.status_code == 409
+    response = await client.put(
+        f"/offices/{office_id}", json={"name": "Branch office", "location": "Bukhara"}
+    )
+    assert response.json() == {"id": office_id, "name": "Branch office", "location": "Bukhara"}
@@ -0,0 +1,112 @@
+from datetime import datetime, timedelta
+
+import pytest
+
+from app import settings
+from app.models import Booking, Office, Room
+
+START = datetime(2030, 1, 1, 9, 0)
+
+
+@pytest.fixture(params=[False, True], ids=["orm", "rows"])
+def fast_serialization(request, monkeypatch):
+    monkeypatch.setattr(settings, "FAST_LIST_SERIALIZATION", request.param)
+
+
+# Seven bookings in three rooms; several share a start time, so pages have
+# to break ties on the id
+@pytest.fixture
+async def booking_ids(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    rooms = [Room(name=name, office_id=office.id) for name in "ABC"]
+    db.add_all(rooms)
+    await db.flush()
+    bookings = []
+    for hours, room in [(2, 0), (0, 0), (0, 1), (1, 0), (0, 2), (1, 1), (2, 1)]:
+        start = START + timedelta(hours=hours)
+        bookings.append(
+            Booking(
+                room_id=rooms[room].id,
+                user_id=1,
+                start_time=start,
+                end_time=start + timedelta(hours=1),
+            )
+        )
+    db.add_all(bookings)
+    await db.commit()
+    ordered = sorted(bookings, key=lambda booking: (booking.start_time, booking.id))
+    return [booking.id for booking in ordered]
+
+
+async def _walk(client, url, size, **params):
+    ids, cursor, pages = [], None, 0
+    while True:
+        query = {"size": size, **params}
+        if cursor:
+            query["cursor"] = cursor
+        response = await client.get(url, params=query)
+        assert response.status_code == 200
+        page = response.json()
+        assert len(page["items"]) <= size
+        ids.extend(item["id"] for item in page["items"])
+        pages += 1
+        cursor = page["next_cursor"]
+        if cursor is None:
+            return ids, pages
+
+
+@pytest.mark.anyio
+async def test_pages_break_ties_on_id(client, booking_ids, fast_serialization):
+    ids, pages = await _walk(client, "/bookings/", size=2)
+    assert ids == booking_ids
+    assert pages == 4
+
+    # Exactly full pages: the last one has no cursor to an empty page
+    ids, pages = await _walk(client, "/bookings/", size=7)
+    assert (ids, pages) == (booking_ids, 1)
+
+
+@pytest.mark.anyio
+async def test_pages_of_offices_and_rooms(client, booking_ids, fast_serialization):
+    ids, pages = await _walk(client, "/rooms/", size=2)
+    assert (ids, pages) == ([1, 2, 3], 2)
+    ids, _ = await _walk(client, "/offices/", size=1)
+    assert ids == [1]
+
+
+@pytest.mark.anyio
+async def test_filters_apply_to_every_page(client, booking_ids):
+    ids, _ = await _walk(client, "/bookings/", size=1, room_id=2)
+    assert ids == [booking_id for booking_id in booking_ids if booking_id in (3, 6, 7)]
+    ids, _ = await _walk(
+        client,
+        "/bookings/",
+        size=2,
+        start_time=START.isoformat(),
+        end_time=(START + timedelta(hours=2)).isoformat(),
+    )
+    assert ids == booking_ids[:5]
+
+
+@pytest.mark.anyio
+@pytest.mark.parametrize("cursor", ["not-base64!", "WzFd", "eyJhIjoxfQ", "WyJ4IiwiMSJd"])
+async def test_malformed_cursor_is_rejected(client, booking_ids, cursor):
+    response = await client.get("/bookings/", params={"cursor": cursor})
+    assert response.status_code == 400
+    assert response.json()["detail"] == "Invalid cursor"
+
+
+@pytest.mark.anyio
+async def test_total_only_when_asked_for(client, db, booking_ids):
+    page = (await client.get("/bookings/", params={"size": 2})).json()
+    assert page["total"] is None
+    all_rooms = (await client.get("/bookings/", params={"size": 2, "include_total": True})).json()
+    one_room = (await client.get("/bookings/", params={"room_id": 1, "include_total": True})).json()
+    assert len(all_rooms["items"]) == 2
+    if db.bind.dialect.name == "sqlite":
+        assert (all_rooms["total"], one_room["total"]) == (len(booking_ids), 3)
+    else:
+        # The planner's estimate
+        assert isinstance(all_rooms["total"], int) and isinstance(one_room["total"], int)
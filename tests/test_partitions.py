@@ -0,0 +1,174 @@
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, insert, select, text
+
+from app import export, migrations, partitions, settings
+from app.database import engine
+from app.models import Booking, BookingArchive, Office, Room
+
+from .conftest import requires_postgres
+
+
+async def _room_id(db) -> int:
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", office_id=office.id)
+    db.add(room)
+    await db.commit()
+    return room.id
+
+
+# Three one-hour bookings on the first days of each month
+async def _seed(db, room_id, months):
+    for month in months:
+        for day in range(1, 4):
+            start = datetime(month.year, month.month, day, 9)
+            end = start + timedelta(hours=1)
+            db.add(Booking(room_id=room_id, user_id=1, start_time=start, end_time=end))
+    await db.commit()
+
+
+async def _count(conn, table: str) -> int:
+    return await conn.scalar(text(f"SELECT count(*) FROM {table}"))
+
+
+def test_no_duration_limit_unless_set(monkeypatch):
+    start = datetime(2030, 1, 1)
+    monkeypatch.setattr(settings, "BOOKING_MAX_DAYS", 0)
+    partitions.check_duration(start, start + timedelta(days=60))
+    monkeypatch.setattr(settings, "BOOKING_MAX_DAYS", 31)
+    with pytest.raises(ValueError):
+        partitions.check_duration(start, start + timedelta(days=32))
+
+
+# Without partitions the old rows are moved over
+@pytest.mark.anyio
+async def test_maintain_archives_rows(db, monkeypatch):
+    if engine.dialect.name == "postgresql":
+        pytest.skip("PostgreSQL archives partitions, see below")
+    monkeypatch.setattr(settings, "BOOKING_ARCHIVE_AFTER_MONTHS", 24)
+    this_month = partitions.month_start(datetime.utcnow().date())
+    old = partitions.add_months(this_month, -25)
+    room_id = await _room_id(db)
+    await _seed(db, room_id, [old, this_month])
+
+    async with engine.begin() as conn:
+        report = await partitions.maintain(conn)
+        assert report["room_ids"] == {room_id}
+        assert await _count(conn, "bookings") == 3
+        assert await _count(conn, "bookings_archive") == 3
+        assert len((await conn.execute(export.export_query(room_id=room_id))).all()) == 6
+
+
+@requires_postgres
+@pytest.mark.anyio
+async def test_partition_and_archive_on_postgres(db, monkeypatch):
+    monkeypatch.setattr(settings, "BOOKING_MAX_DAYS", 31)
+    monkeypatch.setattr(settings, "BOOKING_PARTITION_MONTHS_AHEAD", 2)
+    monkeypatch.setattr(settings, "BOOKING_ARCHIVE_AFTER_MONTHS", 24)
+    today = datetime.utcnow().date()
+    this_month = partitions.month_start(today)
+    old_months = [partitions.add_months(this_month, -26), partitions.add_months(this_month, -25)]
+    # Months with bookings get a partition even beyond the months ahead
+    far = partitions.add_months(this_month, 6)
+    # A month only booked later goes to the default partition meanwhile
+    later = partitions.add_months(this_month, 9)
+
+    room_id = await _room_id(db)
+    await _seed(db, room_id, old_months + [this_month, far])
+    seeded_max_id = await db.scalar(select(func.max(Booking.id)))
+    try:
+        # The indexes production has (GiST included) on top of create_all
+        await migrations.upgrade(engine)
+        async with engine.connect() as conn:
+            indexes = await conn.execute(
+                text("SELECT indexname FROM pg_indexes WHERE tablename = 'bookings'")
+            )
+            indexes = set(indexes.scalars())
+
+        async with engine.begin() as conn:
+            assert await partitions.setup(conn) == ["bookings", "bookings_archive"]
+            assert await partitions.setup(conn) == []
+
+        async with engine.connect() as conn:
+            assert await partitions.is_partitioned(conn, "bookings")
+            assert await partitions.is_partitioned(conn, "bookings_archive")
+            names = await partitions.partitions(conn, "bookings")
+            assert partitions.partition_name("bookings", old_months[0]) in names
+            assert partitions.partition_name("bookings", far) in names
+            assert "bookings_default" in names
+            assert await _count(conn, "bookings") == 12
+            assert await _count(conn, partitions.partition_name("bookings", far)) == 3
+            after = await conn.execute(
+                text("SELECT indexname FROM pg_indexes WHERE tablename = 'bookings'")
+            )
+            assert set(after.scalars()) == indexes
+            foreign_keys = await conn.scalar(
+                text(
+                    "SELECT count(*) FROM pg_constraint"
+                    " WHERE conrelid = 'bookings'::regclass AND contype = 'f'"
+                )
+            )
+            assert foreign_keys == 2
+            assert await conn.scalar(text("SELECT pg_get_serial_sequence('bookings', 'id')"))
+
+        # New bookings keep numbering from the old sequence
+        async with engine.begin() as conn:
+            start = datetime(later.year, later.month, 10, 9)
+            new_id = await conn.scalar(
+                insert(Booking)
+                .values(
+                    room_id=room_id,
+                    user_id=1,
+                    start_time=start,
+                    end_time=start + timedelta(hours=1),
+                )
+                .returning(Booking.id)
+            )
+        assert new_id > seeded_max_id
+        async with engine.connect() as conn:
+            assert await _count(conn, "bookings_default") == 1
+
+        async with engine.begin() as conn:
+            report = await partitions.maintain(conn, today)
+        assert report["archived"] == [partitions.partition_name("bookings", m) for m in old_months]
+        assert report["room_ids"] == {room_id}
+        async with engine.connect() as conn:
+            assert await _count(conn, "bookings") == 7
+            assert await _count(conn, "bookings_archive") == 6
+            archived = await partitions.partitions(conn, "bookings_archive")
+            assert archived == [partitions.partition_name("bookings", m) for m in old_months]
+            rows = await conn.execute(export.export_query(room_id=room_id))
+            assert len(rows.all()) == 13
+            archive_ids = await conn.scalar(select(func.count(BookingArchive.id.distinct())))
+            assert archive_ids == 6
+
+        # The later month's booking leaves the default partition once the
+        # month is created
+        async with engine.begin() as conn:
+            report = await partitions.maintain(conn, later)
+        assert partitions.partition_name("bookings", later) in report["created"]
+        async with engine.connect() as conn:
+            assert await _count(conn, "bookings_default") == 0
+            assert await _count(conn, partitions.partition_name("bookings", later)) == 1
+            assert await _count(conn, "bookings") + await _count(conn, "bookings_archive") == 13
+    finally:
+        async with engine.begin() as conn:
+            await conn.run_sync(migrations.schema_migrations.drop, checkfirst=True)
+
+
+@requires_postgres
+@pytest.mark.anyio
+async def test_setup_refuses_bookings_longer_than_the_limit(db, monkeypatch):
+    monkeypatch.setattr(settings, "BOOKING_MAX_DAYS", 31)
+    room_id = await _room_id(db)
+    start = datetime(2030, 1, 1)
+    end = start + timedelta(days=40)
+    db.add(Booking(room_id=room_id, user_id=1, start_time=start, end_time=end))
+    await db.commit()
+    async with engine.begin() as conn:
+        with pytest.raises(ValueError):
+            await partitions.setup(conn)
+        assert not await partitions.is_partitioned(conn, "bookings")
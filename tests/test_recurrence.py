@@ -0,0 +1,91 @@
+from contextlib import asynccontextmanager
+from datetime import datetime, timedelta
+
+import pytest
+from sqlalchemy import func, select
+
+from app import admission, recurrence
+from app.models import Booking, Office, RecurringBooking, Room
+
+
+@pytest.fixture
+async def room_id(db):
+    office = Office(name="HQ", location="Tashkent")
+    db.add(office)
+    await db.flush()
+    room = Room(name="A", office_id=office.id)
+    db.add(room)
+    await db.commit()
+    return room.id
+
+
+@pytest.mark.anyio
+async def test_extend_horizons_admits_each_room(db, room_id, monkeypatch):
+    today = datetime.utcnow().replace(hour=9, minute=0, second=0, microsecond=0)
+    start = today + timedelta(days=1)
+    taken = start + timedelta(days=2)
+    series = RecurringBooking(
+        room_id=room_id,
+        user_id=1,
+        start_time=start,
+        end_time=start + timedelta(hours=1),
+        frequency="daily",
+        interval=1,
+        count=5,
+        materialized_until=start,
+        skipped_occurrences=0,
+    )
+    db.add(series)
+    # Taken since the series was created: skipped, not double booked
+    db.add(Booking(room_id=room_id, user_id=2, start_time=taken, end_time=taken + timedelta(hours=1)))
+    await db.commit()
+
+    admitted = []
+    admit = admission.admit
+
+    @asynccontextmanager
+    async def spy(session, *room_ids):
+        admitted.append(room_ids)
+        async with admit(session, *room_ids):
+            yield
+
+    monkeypatch.setattr(admission, "admit", spy)
+    assert await recurrence.extend_horizons(db) == 4
+    assert admitted == [(room_id,)]
+
+    await db.refresh(series)
+    assert series.skipped_occurrences == 1
+    overlapping = await db.scalar(
+        select(func.count()).select_from(Booking).filter(Booking.start_time == taken)
+    )
+    assert overlapping == 1
+    assert await recurrence.extend_horizons(db) == 0
+
+
+# Aware times are stored as the naive UTC instants they stand for
+@pytest.mark.anyio
+async def test_create_series_with_aware_times(client, room_id):
+    start = (datetime.utcnow() + timedelta(days=1)).replace(microsecond=0)
+    response = await client.post(
+        "/recurring-bookings/",
+        json={
+            "room_id": room_id,
+            "user_id": 1,
+            "start_time": start.isoformat() + "Z",
+            "end_time": (start + timedelta(hours=6)).isoformat() + "+05:00",
+            "frequency": "daily",
+            "until": (start + timedelta(days=2)).isoformat() + "Z",
+        },
+    )
+    assert response.status_code == 200, response.text
+    series = response.json()
+    assert series["start_time"] == start.isoformat()
+    assert series["end_time"] == (start + timedelta(hours=1)).isoformat()
+    assert series["occurrences"] == 3
+
+    response = await client.get(
+        f"/recurring-bookings/{series['id']}/occurrences",
+        params={"after": (start + timedelta(hours=1)).isoformat() + "Z"},
+    )
+    assert response.status_code == 200
+    assert len(response.json()) == 2
@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+from app import settings
+from app.shedding import HIGH, Gate, shedder
+
+
+@pytest.fixture
+def full_gate(monkeypatch):
+    monkeypatch.setattr(settings, "SHED_ENABLED", True)
+    # One slot and no queue, taken by a request that is still running
+    gate = Gate(1, max_waiting=0)
+    monkeypatch.setattr(shedder, "gate", gate)
+    return gate
+
+
+@pytest.mark.anyio
+async def test_overload_is_shed_with_503(client, full_gate):
+    assert await full_gate.acquire(HIGH, 1)
+    shed = shedder.shed["normal"]
+
+    response = await client.get("/offices/")
+    assert response.status_code == 503
+    assert response.headers["retry-after"] == str(settings.SHED_RETRY_AFTER_SECONDS)
+    assert response.json() == {"detail": "Service overloaded, retry later."}
+    assert shedder.shed["normal"] == shed + 1
+    # Never queued
+    assert (await client.get("/metrics")).status_code == 200
+
+    full_gate.release()
+    assert (await client.get("/offices/")).status_code == 200
+    assert full_gate.in_flight == 0
+
+
+# A waiting request gets the slot freed before its deadline
+@pytest.mark.anyio
+async def test_waiters_get_freed_slots(client, monkeypatch):
+    monkeypatch.setattr(settings, "SHED_ENABLED", True)
+    gate = Gate(1, max_waiting=1)
+    monkeypatch.setattr(shedder, "gate", gate)
+    assert await gate.acquire(HIGH, 1)
+
+    request = asyncio.ensure_future(client.get("/offices/"))
+    while not gate.waiting:
+        await asyncio.sleep(0)
+    gate.release()
+    assert (await request).status_code == 200
+
+
+# Low priority requests give way while the pool is slow to hand out connections
+@pytest.mark.anyio
+async def test_low_priority_shed_on_pool_wait(client, monkeypatch):
+    monkeypatch.setattr(settings, "SHED_ENABLED", True)
+    monkeypatch.setattr(shedder, "pool_wait", 0.0)
+    for _ in range(20):
+        shedder.observe_pool_wait(settings.SHED_POOL_WAIT_MS / 1000 * 2)
+
+    response = await client.get("/bookings/export")
+    assert response.status_code == 503
+    assert (await client.get("/offices/")).status_code == 200